@@ -0,0 +1,1130 @@
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import platform
+import random
+import shutil
+import tempfile
+import statistics
+import subprocess
+import multiprocessing
+from collections import namedtuple
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt5.QtWidgets import QApplication, QPlainTextDocumentLayout, QPlainTextEdit
+from PyQt5.QtCore import QEventLoop, Qt, QT_VERSION_STR, PYQT_VERSION_STR
+from PyQt5.QtTest import QTest
+from PyQt5.QtGui import QTextDocument, QTextCursor
+from highlighter import PythonTreeHighlighter, CTreeHighlighter, attach_highlighter
+from codeeditor import CodeEditor
+from syntax import SyntaxTree
+from fileindex import FileIndex
+from search import ProjectSearch, compile_query, executor
+from trigramindex import TrigramIndex
+from symbolindex import SymbolIndex
+from replace import ProjectReplace
+from runner import BuildRunner, ProblemParser
+from diagnostics import DiagnosticsService
+from bufferview import BufferView
+from fileio import iter_file_chunks, make_decoder, atomic_write
+from startup import TRACE_ENV
+from profiler import profiler
+from terminal import OutputBuffer, TerminalPane
+from main import MainWindow, TREE_IS_DIR_ROLE, TREE_LOADED_ROLE
+
+# Every benchmark returns {label: Metric}. The unit says which way is better:
+# the rates below are higher-is-better, everything else (s, ms, MB) lower
+Metric = namedtuple('Metric', ['value', 'unit'])
+HIGHER_IS_BETTER = frozenset({'lines/s', 'files/s', 'MB/s', 'dirs/s'})
+# How much worse than the baseline a metric may get, in percent, before
+# --compare calls it a regression
+REGRESSION_THRESHOLD = 10.0
+
+PYTHON_SNIPPET = [
+    'import os',
+    'from pathlib import Path',
+    '',
+    'class Widget(object):',
+    '    """Docstring that spans',
+    '    two lines."""',
+    '    def render(self, items, depth=0):',
+    "        # walk the items and print them",
+    '        for index, item in enumerate(items):',
+    "            if item is not None and depth < 10:",
+    "                print(f'{index}: {item!r}', \"done\")",
+    '            elif isinstance(item, (list, tuple)):',
+    '                self.render(item, depth + 1)',
+    '        return None',
+    '',
+]
+
+C_SNIPPET = [
+    '#include <stdio.h>',
+    '',
+    '/* multi-line',
+    '   block comment */',
+    'struct point { int x; int y; };',
+    '',
+    'int main(int argc, char **argv) {',
+    '    // loop over the arguments',
+    '    for (int i = 0; i < argc; i++) {',
+    '        printf("%d: %s\\n", i, argv[i]);',
+    "        char c = 'x';",
+    '    }',
+    '    return 0;',
+    '}',
+    '',
+]
+
+
+@contextmanager
+def temporary_cache():
+    # Sessions, indexes and build caches go to a scratch directory rather
+    # than the user's
+    directory = tempfile.mkdtemp(prefix='aidanide-cache-')
+    cache = os.environ.get('XDG_CACHE_HOME')
+    os.environ['XDG_CACHE_HOME'] = directory
+    try:
+        yield directory
+    finally:
+        if cache is None:
+            os.environ.pop('XDG_CACHE_HOME', None)
+        else:
+            os.environ['XDG_CACHE_HOME'] = cache
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def wait_until(condition, timeout=120):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            raise RuntimeError("timed out waiting for the IDE")
+        QApplication.processEvents(QEventLoop.AllEvents, 10)
+
+
+def synthetic_source(snippet, lines):
+    repeats = lines // len(snippet) + 1
+    return '\n'.join((snippet * repeats)[:lines])
+
+
+def bench_highlighter(lines=100000):
+    results = {}
+    for name, cls, snippet in [
+        ("python", PythonTreeHighlighter, PYTHON_SNIPPET),
+        ("c", CTreeHighlighter, C_SNIPPET),
+    ]:
+        document = QTextDocument()
+        document.setPlainText(synthetic_source(snippet, lines))
+
+        # Building the tree is the parse, so it counts towards the highlight
+        start = time.perf_counter()
+        highlighter = cls(document, SyntaxTree(document, cls.parser))
+        highlighter.rehighlight()
+        elapsed = time.perf_counter() - start
+
+        results[name] = Metric(lines / elapsed, 'lines/s')
+        print(f"highlighter[{name}]: {lines} lines in {elapsed:.3f}s ({lines / elapsed:,.0f} lines/s)")
+    return results
+
+def bench_typing(sizes=(1000, 20000, 150000), keys=200):
+    # Per-keystroke latency through CodeEditor.keyPressEvent, from a small
+    # file up to one of several MB: plain characters, auto-paired brackets,
+    # typing over the closing bracket, and moving the cursor between
+    # brackets so their match is highlighted
+    results = {}
+    for lines in sizes:
+        editor = CodeEditor()
+        editor.resize(800, 600)
+        editor.setPlainText(synthetic_source(PYTHON_SNIPPET, lines))
+        attach_highlighter(PythonTreeHighlighter, editor)
+        size = editor.document().characterCount()
+        cursor = editor.textCursor()
+        cursor.setPosition(editor.document().findBlockByNumber(lines // 2).position())
+        editor.setTextCursor(cursor)
+        editor.show()
+        # Background highlighting shares the event loop with the keystrokes,
+        # so it is left to finish first
+        while editor.highlighter.deferred:
+            QApplication.processEvents()
+
+        for name, sequence in [
+            ("char", [Qt.Key_X]),
+            ("pair", [Qt.Key_ParenLeft, Qt.Key_ParenRight]),
+            ("arrows", [Qt.Key_Left, Qt.Key_Right]),
+        ]:
+            timings = []
+            for i in range(keys):
+                start = time.perf_counter()
+                QTest.keyClick(editor, sequence[i % len(sequence)], Qt.NoModifier)
+                # The bracket match and highlighting run from the event loop
+                QApplication.processEvents()
+                timings.append((time.perf_counter() - start) * 1000)
+            results[f"{name} {lines} lines"] = Metric(statistics.median(timings), 'ms')
+            print(
+                f"typing[{name} {lines} lines]: {size / 1e6:.2f} MB document, "
+                f"median {statistics.median(timings):.3f} ms, worst {max(timings):.3f} ms per key"
+            )
+        editor.close()
+    return results
+
+
+def time_edit(document, line, column, text):
+    # Inserts text mid-document and undoes it again, timing both
+    cursor = QTextCursor(document.findBlockByNumber(line))
+    cursor.movePosition(QTextCursor.Right, n=column)
+    start = time.perf_counter()
+    cursor.insertText(text)
+    edited = time.perf_counter()
+    document.undo()
+    return edited - start, time.perf_counter() - edited
+
+
+def bench_syntax(lines=100000, edits=50):
+    # Full parse, then the latency of single edits in the middle of a large
+    # file. The tree re-parses only until the line state converges; an
+    # opener that flips every string after it still costs a pass over the
+    # rest of the file. No view is attached, so every changed block repaints.
+    results = {}
+    for name, cls, snippet, opener in [
+        ("python", PythonTreeHighlighter, PYTHON_SNIPPET, '"""'),
+        ("c", CTreeHighlighter, C_SNIPPET, '/*'),
+    ]:
+        document = QTextDocument()
+        # contentsChange is only emitted for documents with a layout
+        document.setDocumentLayout(QPlainTextDocumentLayout(document))
+        document.setPlainText(synthetic_source(snippet, lines))
+        start = time.perf_counter()
+        highlighter = cls(document, SyntaxTree(document, cls.parser))
+        highlighter.rehighlight()
+        parse = time.perf_counter() - start
+        results[name] = Metric(lines / parse, 'lines/s')
+        print(f"syntax[{name}]: {lines} lines in {parse:.3f}s ({lines / parse:,.0f} lines/s)")
+
+        rng = random.Random(1)
+        for kind, text in [("char", "x"), ("newline", "\n"), ("opener", opener)]:
+            typed, undone = [], []
+            for _ in range(edits):
+                line = rng.randrange(lines // 4, lines * 3 // 4)
+                length = document.findBlockByNumber(line).length() - 1
+                insert, undo = time_edit(document, line, rng.randint(0, length), text)
+                typed.append(insert)
+                undone.append(undo)
+            results[f"{name}/{kind}"] = Metric(statistics.median(typed) * 1000, 'ms')
+            print(
+                f"syntax[{name}/{kind}]: median {statistics.median(typed) * 1000:.2f} ms,"
+                f" undo {statistics.median(undone) * 1000:.2f} ms"
+            )
+        highlighter.setDocument(None)
+    return results
+
+
+WORDS = [
+    'app', 'api', 'auth', 'build', 'cache', 'client', 'config', 'core', 'data',
+    'debug', 'editor', 'event', 'file', 'format', 'handler', 'http', 'index',
+    'io', 'job', 'layout', 'lib', 'loader', 'main', 'model', 'net', 'parser',
+    'plugin', 'query', 'render', 'request', 'router', 'schema', 'search',
+    'server', 'session', 'shell', 'store', 'stream', 'task', 'test', 'theme',
+    'token', 'tree', 'ui', 'user', 'util', 'view', 'watch', 'widget', 'worker'
+]
+EXTENSIONS = ['.py', '.c', '.h', '.cpp', '.txt', '.md', '.json']
+
+
+def synthetic_paths(count, files_per_dir=10, seed=1):
+    # A tree shaped like a real project: nested directories of related names
+    rng = random.Random(seed)
+    paths = set()
+    dirs = ['']
+    while len(paths) < count:
+        parent = rng.choice(dirs)
+        if parent.count('/') < 5 and rng.random() < 1 / files_per_dir:
+            dirs.append((parent + '/' if parent else '') + rng.choice(WORDS) + rng.choice(['', 's', '_v2']))
+            continue
+        name = rng.choice(WORDS) + '_' + rng.choice(WORDS) + rng.choice(EXTENSIONS)
+        paths.add((parent + '/' if parent else '') + name)
+    return sorted(paths)
+
+
+def bench_quick_open(files=200000):
+    index = FileIndex()
+    index.paths = synthetic_paths(files)
+
+    start = time.perf_counter()
+    index.search_tables()
+    elapsed = time.perf_counter() - start
+    print(f"quick_open[prepare]: {files} paths in {elapsed:.3f}s")
+
+    # Each query is typed one character at a time, the way the palette sees it
+    results = {'prepare': Metric(elapsed, 's')}
+    for query in ['main', 'parser_tok', 'widget_view.py', 'coreutil', 'ui/render', 'zzz']:
+        timings = []
+        for size in range(1, len(query) + 1):
+            start = time.perf_counter()
+            index.search(query[:size])
+            timings.append((time.perf_counter() - start) * 1000)
+        results[query] = Metric(max(timings), 'ms')
+        print(f"quick_open[{query}]: worst keystroke {max(timings):.2f} ms, mean {sum(timings) / len(timings):.2f} ms")
+    return results
+
+
+def write_fixture_tree(root, files, lines=400):
+    sources = {
+        '.py': synthetic_source(PYTHON_SNIPPET, lines),
+        '.c': synthetic_source(C_SNIPPET, lines),
+    }
+    for index, rel_path in enumerate(synthetic_paths(files, files_per_dir=20)):
+        path = os.path.join(root, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        ext = '.py' if index % 2 else '.c'
+        with open(path, 'w') as f:
+            # A rare token so that only a handful of files match
+            f.write(sources[ext] + (f'\nneedle_{index}\n' if index % 97 == 0 else '\n'))
+
+
+def run_search(search, root, query, use_regex):
+    loop = QEventLoop()
+    stats = {}
+    first_result = []
+    start = time.perf_counter()
+
+    def found(generation, batch):
+        if not first_result:
+            first_result.append(time.perf_counter() - start)
+
+    def finished(generation, result):
+        stats.update(result)
+        loop.quit()
+
+    search.results_found.connect(found)
+    search.search_finished.connect(finished)
+    search.start(root, compile_query(query, use_regex))
+    loop.exec_()
+    search.results_found.disconnect(found)
+    search.search_finished.disconnect(finished)
+    stats['first_result'] = first_result[0] if first_result else float('nan')
+    return stats
+
+
+def bench_search(files=5000):
+    root = tempfile.mkdtemp(prefix='aidanide-search-')
+    index = TrigramIndex()
+    try:
+        write_fixture_tree(root, files)
+        # Warm the worker processes so spawn time is not counted
+        executor().submit(len, '').result()
+
+        loop = QEventLoop()
+        index.built.connect(loop.quit)
+        index.open_root(root)
+        loop.exec_()
+        build = index.last_build
+        print(
+            f"search[index]: {build['files']} files indexed in {build['seconds']:.3f}s, "
+            f"{build['trigrams']} trigrams, {build['bytes'] / 1e6:.1f} MB on disk"
+        )
+
+        results = {'index': Metric(build['seconds'], 's')}
+        for name, query, use_regex in [
+            ("literal", "needle_", False),
+            ("regex", r"needle_\d*7\b", True),
+        ]:
+            for label, search in [(name, ProjectSearch()), (name + "+index", ProjectSearch(index=index))]:
+                stats = run_search(search, root, query, use_regex)
+                seconds = stats['seconds']
+                results[label] = Metric(seconds, 's')
+                print(
+                    f"search[{label}]: {stats['files']}/{stats['total_files']} files, "
+                    f"{stats['bytes'] / 1e6:.1f} MB in {seconds:.3f}s "
+                    f"({stats['total_files'] / seconds:,.0f} files/s, {stats['bytes'] / 1e6 / seconds:.1f} MB/s), "
+                    f"{stats['matches']} matches, first result after {stats['first_result'] * 1000:.1f} ms"
+                )
+        return results
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+        if index.index_file:
+            shutil.rmtree(os.path.dirname(index.index_file), ignore_errors=True)
+
+
+def run_replace(replace, root, pattern, template):
+    # Previews, then applies to every previewed file
+    loop = QEventLoop()
+    previewed = {}
+    stats = {}
+    first_result = []
+    start = time.perf_counter()
+
+    def found(generation, batch):
+        if not first_result:
+            first_result.append(time.perf_counter() - start)
+        for rel_path, count, hunks, content_hash in batch:
+            previewed[rel_path] = content_hash
+
+    def finished(generation, *result):
+        stats[len(stats)] = result[-1]
+        loop.quit()
+
+    replace.preview_found.connect(found)
+    replace.preview_finished.connect(finished)
+    replace.apply_finished.connect(finished)
+    replace.preview(root, pattern, template)
+    loop.exec_()
+    replace.apply(root, pattern, template, list(previewed.items()))
+    loop.exec_()
+    replace.preview_found.disconnect(found)
+    replace.preview_finished.disconnect(finished)
+    replace.apply_finished.disconnect(finished)
+    return stats[0], stats[1], first_result[0] if first_result else float('nan')
+
+
+def bench_replace(files=5000):
+    root = tempfile.mkdtemp(prefix='aidanide-replace-')
+    try:
+        write_fixture_tree(root, files)
+        executor().submit(len, '').result()
+
+        results = {}
+        for name, query, template in [
+            # A handful of files change, then about every file
+            ("rare", r"needle_(\d+)", r"pin_\1"),
+            ("common", r"\brender\b", "draw"),
+        ]:
+            preview, applied, first_result = run_replace(
+                ProjectReplace(), root, compile_query(query, True, True), template
+            )
+            results[f"{name} preview"] = Metric(preview['files_per_second'], 'files/s')
+            results[f"{name} apply"] = Metric(applied['files_per_second'], 'files/s')
+            print(
+                f"replace[{name} preview]: {preview['replacements']} replacements, {preview['files']} files "
+                f"in {preview['seconds']:.3f}s ({preview['files_per_second']:,.0f} files/s), "
+                f"first diff after {first_result * 1000:.1f} ms"
+            )
+            print(
+                f"replace[{name} apply]: {applied['files']} files, {applied['bytes'] / 1e6:.1f} MB written "
+                f"in {applied['seconds']:.3f}s ({applied['files_per_second']:,.0f} files/s)"
+            )
+        return results
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def synthetic_build_output(lines):
+    # Mostly compiler chatter, with a diagnostic or traceback now and then
+    chunks = []
+    for index in range(lines):
+        if index % 1000 == 0:
+            chunks.append(f"src/module_{index % 7}.c:{index}:5: warning: unused variable 'x{index}' [-Wunused-variable]")
+        elif index % 777 == 0:
+            chunks.append('Traceback (most recent call last):')
+            chunks.append(f'  File "tools/gen_{index}.py", line {index}, in <module>')
+            chunks.append('    main()')
+            chunks.append(f'ValueError: bad input {index}')
+        else:
+            chunks.append(f"gcc -c -O2 -Wall src/module_{index % 7}.c -o build/module_{index % 7}.o  # step {index}")
+    return '\n'.join(chunks) + '\n'
+
+
+def synthetic_c_program(functions):
+    # A valid program, unlike synthetic_source's repeated mains
+    lines = ['#include <stdio.h>']
+    for index in range(functions):
+        lines.append(f'static int step_{index}(int x) {{ return x * {index % 7 + 1} + {index}; }}')
+    lines.append('int main(void) {\n    int x = 0;')
+    for index in range(functions):
+        lines.append(f'    x = step_{index}(x) % 1000003;')
+    lines.append('    printf("%d\\n", x);\n    return 0;\n}\n')
+    return '\n'.join(lines)
+
+
+def run_build(runner, path):
+    loop = QEventLoop()
+    stats = {}
+
+    def finished(result):
+        stats.update(result)
+        loop.quit()
+
+    runner.run_finished.connect(finished)
+    runner.run_file(path)
+    loop.exec_()
+    runner.run_finished.disconnect(finished)
+    return stats
+
+
+def bench_run(lines=200000, chunk_size=4096):
+    # Problem matching over streamed output, then a C build from scratch
+    # and again with the sources unchanged
+    text = synthetic_build_output(lines)
+    parser = ProblemParser('/tmp')
+    start = time.perf_counter()
+    found = 0
+    for offset in range(0, len(text), chunk_size):
+        found += len(parser.feed(text[offset:offset + chunk_size]))
+    found += len(parser.finish())
+    elapsed = time.perf_counter() - start
+    results = {'parse': Metric(len(text) / 1e6 / elapsed, 'MB/s')}
+    print(
+        f"run[parse]: {len(text) / 1e6:.1f} MB of output in {chunk_size} byte chunks, {found} problems "
+        f"in {elapsed:.3f}s ({len(text) / 1e6 / elapsed:.1f} MB/s)"
+    )
+
+    directory = tempfile.mkdtemp(prefix='aidanide-run-')
+    try:
+        path = os.path.join(directory, 'main.c')
+        with open(path, 'w') as f:
+            f.write(synthetic_c_program(2000))
+        with temporary_cache():
+            runner = BuildRunner()
+            for label in ("cold", "cached"):
+                stats = run_build(runner, path)
+                results[f"build {label}"] = Metric(stats['seconds'], 's')
+                print(f"run[build {label}]: exit status {stats['status']}, {stats['problems']} problems in {stats['seconds']:.3f}s")
+        return results
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def wait_for_diagnostics(service, editor, action):
+    # Runs action and waits for editor's next diagnostics; a cache hit
+    # delivers them before action returns
+    loop = QEventLoop()
+    delivered = []
+
+    def changed(changed_editor):
+        if changed_editor is editor:
+            delivered.append(time.perf_counter())
+            loop.quit()
+
+    service.diagnostics_changed.connect(changed)
+    action()
+    if not delivered:
+        loop.exec_()
+    service.diagnostics_changed.disconnect(changed)
+    return delivered[0]
+
+
+def bench_diagnostics(lines=20000, edits=30, interval_ms=50):
+    # A check of a whole file, a burst of typing faster than the debounce,
+    # and the GUI thread's share of a check answered from the cache
+    directory = tempfile.mkdtemp(prefix='aidanide-diagnostics-')
+    service = DiagnosticsService()
+    executor().submit(len, '').result()
+    results = {}
+    try:
+        sources = [
+            ("python", 'main.py', synthetic_source(PYTHON_SNIPPET, lines) + '\ndef broken(:\n'),
+            ("c", 'main.c', synthetic_c_program(lines // 4) + 'int broken(void) { return ; }\n'),
+        ]
+        for label, name, text in sources:
+            editor = CodeEditor()
+            editor.setPlainText(text)
+            wait_for_diagnostics(service, editor, lambda: service.watch(editor, os.path.join(directory, name)))
+            state = service.states[editor]
+            run_ms, total_ms = service.latencies[state.checker.__name__][-1]
+            results[f"{label} check"] = Metric(run_ms, 'ms')
+            print(
+                f"diagnostics[{label} check]: {editor.document().blockCount()} lines, "
+                f"{len(state.diagnostics)} diagnostics, {run_ms:.1f} ms in the checker, "
+                f"{total_ms:.1f} ms including the queue"
+            )
+
+            checks = len(service.latencies[state.checker.__name__])
+            cursor = QTextCursor(editor.document())
+            cursor.movePosition(QTextCursor.End)
+
+            last_edit = []
+
+            def type_burst():
+                for index in range(edits):
+                    if index:
+                        QTest.qWait(interval_ms)
+                    cursor.insertText('x')
+                last_edit.append(time.perf_counter())
+
+            delivered = wait_for_diagnostics(service, editor, type_burst)
+            last_edit = last_edit[0]
+            checks = len(service.latencies[state.checker.__name__]) - checks
+            results[f"{label} burst"] = Metric((delivered - last_edit) * 1000, 'ms')
+            print(
+                f"diagnostics[{label} burst]: {edits} edits {interval_ms} ms apart, {checks} checks, "
+                f"diagnostics {(delivered - last_edit) * 1000:.0f} ms after the last edit"
+            )
+
+            editor.setPlainText(text)
+            state.timer.stop()
+            start = time.perf_counter()
+            service.run_check(state)
+            elapsed = (time.perf_counter() - start) * 1000
+            results[f"{label} cached"] = Metric(elapsed, 'ms')
+            print(f"diagnostics[{label} cached]: {elapsed:.1f} ms on the GUI thread")
+            service.unwatch(editor)
+        return results
+    finally:
+        service.wait()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def bench_profiler(lines=100000):
+    # What the timing hooks cost: the same full highlight with recording
+    # off and on, the on run leaving a span per line to export
+    document = QTextDocument()
+    document.setPlainText(synthetic_source(PYTHON_SNIPPET, lines))
+    highlighter = PythonTreeHighlighter(document, SyntaxTree(document, PythonTreeHighlighter.parser))
+    # The first pass parses the tree; both measured runs then only format
+    highlighter.rehighlight()
+    enabled = profiler.enabled
+    results = {}
+    try:
+        for label, recording in (("off", False), ("on", True)):
+            profiler.reset()
+            profiler.enabled = recording
+            start = time.perf_counter()
+            highlighter.rehighlight()
+            elapsed = time.perf_counter() - start
+            results[f"recording {label}"] = Metric(lines / elapsed, 'lines/s')
+            print(f"profiler[recording {label}]: {lines} lines highlighted in {elapsed:.3f}s ({lines / elapsed:,.0f} lines/s)")
+
+        start = time.perf_counter()
+        trace = profiler.chrome_trace()
+        elapsed = time.perf_counter() - start
+        results['trace'] = Metric(elapsed, 's')
+        print(f"profiler[trace]: {len(trace['traceEvents'])} events in {elapsed:.3f}s")
+        return results
+    finally:
+        profiler.enabled = enabled
+        profiler.reset()
+
+
+def build_symbols(index, root):
+    loop = QEventLoop()
+    index.built.connect(loop.quit)
+    if index.root_path is None:
+        index.open_root(root)
+    else:
+        index.rebuild()
+    loop.exec_()
+    index.built.disconnect(loop.quit)
+    return index.last_build
+
+
+def bench_symbols(files=5000, lookups=1000):
+    root = tempfile.mkdtemp(prefix='aidanide-symbols-')
+    index = SymbolIndex()
+    try:
+        write_fixture_tree(root, files)
+        executor().submit(len, '').result()
+
+        results = {}
+        for label in ("build", "unchanged"):
+            build = build_symbols(index, root)
+            results[label] = Metric(build['seconds'], 's')
+            print(
+                f"symbols[{label}]: {build['files']} files, {build['changed']} parsed, "
+                f"{build['symbols']} symbols in {build['seconds']:.3f}s"
+            )
+
+        for name in ("render", "point", "missing"):
+            timings = []
+            for _ in range(lookups):
+                start = time.perf_counter()
+                found = index.lookup(name)
+                timings.append((time.perf_counter() - start) * 1000)
+            results[f"lookup {name}"] = Metric(statistics.median(timings), 'ms')
+            print(
+                f"symbols[lookup {name}]: {len(found)} definitions, median {statistics.median(timings):.3f} ms, "
+                f"worst {max(timings):.3f} ms"
+            )
+        return results
+    finally:
+        index.wait()
+        shutil.rmtree(root, ignore_errors=True)
+        if index.index_file:
+            shutil.rmtree(os.path.dirname(index.index_file), ignore_errors=True)
+
+
+def expand_tree(window):
+    # Expands every directory until none is left unlisted, the way a user
+    # opening each folder in turn would; returns how many were listed
+    scanned = set()
+    window.tree_scanner.scanned.connect(lambda path, entries: scanned.add(path))
+    requested = set()
+    while True:
+        unlisted = [path for path, item in window.tree_items.items() if not item.data(0, TREE_LOADED_ROLE)]
+        if not unlisted:
+            break
+        requested.update(unlisted)
+        for path in unlisted:
+            window.tree_items[path].setExpanded(True)
+        wait_until(lambda: requested <= scanned and not window.pending_tree_updates)
+    return len(window.tree_items)
+
+
+def tree_snapshot(window):
+    # What MainWindow.save_session stores for the next start
+    return {
+        path: [
+            (item.child(i).text(0), bool(item.child(i).data(0, TREE_IS_DIR_ROLE)))
+            for i in range(item.childCount())
+        ]
+        for path, item in window.tree_items.items() if item.data(0, TREE_LOADED_ROLE)
+    }
+
+
+def bench_tree(files=20000):
+    # MainWindow.build_tree on a generated project: the first listing of the
+    # root, every directory expanded, and the whole tree rebuilt from its
+    # snapshot the way a restored session shows it
+    root = tempfile.mkdtemp(prefix='aidanide-tree-')
+    results = {}
+    try:
+        for rel_path in synthetic_paths(files, files_per_dir=20):
+            path = os.path.join(root, rel_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path, 'w').close()
+
+        with temporary_cache():
+            window = MainWindow()
+            try:
+                start = time.perf_counter()
+                window.build_tree(root)
+                root_item = window.tree_items[root]
+                wait_until(lambda: root_item.childCount() > 0)
+                elapsed = time.perf_counter() - start
+                results['root'] = Metric(elapsed * 1000, 'ms')
+                print(f"tree[root]: {root_item.childCount()} entries listed in {elapsed * 1000:.1f} ms")
+
+                start = time.perf_counter()
+                dirs = expand_tree(window)
+                elapsed = time.perf_counter() - start
+                results['expand all'] = Metric(dirs / elapsed, 'dirs/s')
+                print(
+                    f"tree[expand all]: {dirs} directories, {files} files in {elapsed:.3f}s "
+                    f"({dirs / elapsed:,.0f} dirs/s)"
+                )
+
+                snapshot = tree_snapshot(window)
+                window.sidebar.clear()
+                start = time.perf_counter()
+                window.build_tree(root, snapshot, list(snapshot))
+                elapsed = time.perf_counter() - start
+                results['snapshot'] = Metric(elapsed * 1000, 'ms')
+                print(f"tree[snapshot]: {len(window.tree_items)} directories shown in {elapsed * 1000:.1f} ms")
+                # The rescans the snapshot starts are let finish before the
+                # window goes
+                wait_until(lambda: not window.pending_tree_updates and not window.tree_update_timer.isActive())
+            finally:
+                window.shutdown()
+                window.deleteLater()
+        return results
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def bench_files(sizes_mb=(1, 16)):
+    # Opening a file into a tab through MainWindow.open_in_editor and saving
+    # it back through save_document, checking the bytes come back the same
+    directory = tempfile.mkdtemp(prefix='aidanide-files-')
+    results = {}
+    try:
+        with temporary_cache():
+            window = MainWindow()
+            saved = []
+            window.file_saver.saved.connect(lambda path, content_hash: saved.append(path))
+            try:
+                for size in sizes_mb:
+                    path = os.path.join(directory, f'{size}mb.py')
+                    write_large_file(path, size * 1024 * 1024)
+                    with open(path, 'rb') as f:
+                        original = f.read()
+                    megabytes = len(original) / 1e6
+
+                    start = time.perf_counter()
+                    window.open_in_editor(path)
+                    editor = window.current_editor()
+                    wait_until(lambda: getattr(editor, 'loader', None) is None)
+                    elapsed = time.perf_counter() - start
+                    results[f"open {size} MB"] = Metric(megabytes / elapsed, 'MB/s')
+                    print(f"files[open {size} MB]: {megabytes:.1f} MB in {elapsed:.3f}s ({megabytes / elapsed:.1f} MB/s)")
+
+                    start = time.perf_counter()
+                    window.save_document(editor)
+                    wait_until(lambda: path in saved)
+                    elapsed = time.perf_counter() - start
+                    results[f"save {size} MB"] = Metric(megabytes / elapsed, 'MB/s')
+                    with open(path, 'rb') as f:
+                        same = f.read() == original
+                    print(
+                        f"files[save {size} MB]: {megabytes:.1f} MB in {elapsed:.3f}s ({megabytes / elapsed:.1f} MB/s), "
+                        f"{'unchanged' if same else 'CHANGED'} on disk"
+                    )
+                    if not same:
+                        raise SystemExit(f"files: saving {path} changed its contents")
+                    window.close_tab(window.tabs.indexOf(editor))
+            finally:
+                window.shutdown()
+                window.deleteLater()
+        return results
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def terminal_output(lines, width=100):
+    line = ('x' * (width - 1) + '\n').encode()
+    return line * lines
+
+
+def bench_terminal(lines=200000, chunk_size=4096):
+    # Output ingest: bytes handed straight to a terminal's OutputBuffer in
+    # the chunks a pty read returns, then a command's output through a real
+    # shell and pty into a TerminalPane
+    data = terminal_output(lines)
+    megabytes = len(data) / 1e6
+    widget = QPlainTextEdit()
+    widget.setReadOnly(True)
+    output = OutputBuffer(widget)
+    start = time.perf_counter()
+    for offset in range(0, len(data), chunk_size):
+        output.write(data[offset:offset + chunk_size])
+        # The notifier would hand over one read per event loop pass
+        QApplication.processEvents()
+    output.flush()
+    elapsed = time.perf_counter() - start
+    results = {'buffer': Metric(megabytes / elapsed, 'MB/s')}
+    print(
+        f"terminal[buffer]: {megabytes:.1f} MB in {chunk_size} byte chunks in {elapsed:.3f}s "
+        f"({megabytes / elapsed:.1f} MB/s), {widget.document().blockCount()} lines kept"
+    )
+
+    pane = TerminalPane(tempfile.gettempdir())
+    try:
+        pane.start_shell()
+        wait_until(lambda: pane.shell is not None and pane.shell.ready)
+        busy = []
+        pane.busy_changed.connect(busy.append)
+        start = time.perf_counter()
+        pane.run(f"head -c {len(data)} /dev/zero | tr '\\0' x | fold -w 99")
+        wait_until(lambda: busy and not busy[-1])
+        pane.output.flush()
+        elapsed = time.perf_counter() - start
+        results['shell'] = Metric(megabytes / elapsed, 'MB/s')
+        print(f"terminal[shell]: {megabytes:.1f} MB through a pty in {elapsed:.3f}s ({megabytes / elapsed:.1f} MB/s)")
+    finally:
+        pane.close_shell()
+    return results
+
+
+def memory_status():
+    # Resident memory in MB: all of it, and the anonymous part that isn't
+    # file pages the kernel can drop and read back
+    status = {}
+    with open('/proc/self/status') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            if key in ('VmRSS', 'RssAnon', 'VmHWM'):
+                status[key] = int(value.split()[0]) / 1024
+    return status
+
+
+def write_large_file(path, size):
+    block = (synthetic_source(PYTHON_SNIPPET, 10000) + '\n').encode()
+    with open(path, 'wb') as f:
+        for _ in range(size // len(block) + 1):
+            f.write(block)
+
+
+def open_plain_editor(path):
+    # What MainWindow.stream_file does for a large file: decoded chunks
+    # appended to a CodeEditor with no undo stack and no highlighting
+    editor = CodeEditor()
+    document = editor.document()
+    document.setUndoRedoEnabled(False)
+    cursor = QTextCursor(document)
+    decoder = make_decoder()
+    for chunk in iter_file_chunks(path):
+        cursor.insertText(decoder.decode(chunk))
+    cursor.insertText(decoder.decode(b'', final=True))
+    return editor
+
+
+def run_large_file(mode, path, scrolls=50, keys=100):
+    # Runs in its own process, so each mode's memory is measured from a
+    # fresh start
+    app = QApplication.instance() or QApplication([])
+    results = {'before': memory_status()}
+
+    start = time.perf_counter()
+    if mode == 'piece_table':
+        widget = BufferView.open(path)
+    else:
+        widget = open_plain_editor(path)
+    widget.resize(800, 600)
+    widget.show()
+    app.processEvents()
+    results['open'] = time.perf_counter() - start
+
+    # Jumps through the file, painting each position
+    scrollbar = widget.verticalScrollBar()
+    rng = random.Random(1)
+    timings = []
+    for _ in range(scrolls):
+        start = time.perf_counter()
+        scrollbar.setValue(rng.randrange(scrollbar.maximum() + 1))
+        widget.viewport().repaint()
+        timings.append((time.perf_counter() - start) * 1000)
+    results['scroll'] = statistics.median(timings)
+
+    # Types in the middle of the file
+    if mode == 'piece_table':
+        widget.go_to_line(widget.table.line_count() // 2)
+    else:
+        block = widget.document().findBlockByNumber(widget.document().blockCount() // 2)
+        widget.setTextCursor(QTextCursor(block))
+    timings = []
+    for i in range(keys):
+        start = time.perf_counter()
+        QTest.keyClick(widget, Qt.Key_X if i % 10 else Qt.Key_Return, Qt.NoModifier)
+        widget.viewport().repaint()
+        timings.append((time.perf_counter() - start) * 1000)
+    results['key'] = statistics.median(timings)
+    results['worst key'] = max(timings)
+
+    saved_path = path + '.' + mode
+    start = time.perf_counter()
+    if mode == 'piece_table':
+        atomic_write(saved_path, widget.table.chunks())
+    else:
+        atomic_write(saved_path, widget.toPlainText().encode('utf-8'))
+    results['save'] = time.perf_counter() - start
+    os.remove(saved_path)
+
+    results['after'] = memory_status()
+    return results
+
+
+def bench_large_file(size_mb=500, editor_size_mb=64):
+    # The piece table against the QPlainTextEdit path. A QTextDocument needs
+    # several times the file size in memory, so the editor gets a smaller
+    # file by default; compare the per-MB numbers.
+    directory = tempfile.mkdtemp(prefix='aidanide-large-')
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    try:
+        for mode, size in [("piece_table", size_mb), ("plain_text_edit", editor_size_mb)]:
+            path = os.path.join(directory, f'{size}mb.py')
+            if not os.path.exists(path):
+                write_large_file(path, size * 1024 * 1024)
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                stats = pool.submit(run_large_file, mode, path).result()
+            before, after = stats['before'], stats['after']
+            results[f"{mode} open"] = Metric(stats['open'], 's')
+            results[f"{mode} scroll"] = Metric(stats['scroll'], 'ms')
+            results[f"{mode} key"] = Metric(stats['key'], 'ms')
+            results[f"{mode} save"] = Metric(stats['save'], 's')
+            # Anonymous memory, since mapped file pages come and go with the
+            # page cache
+            results[f"{mode} memory"] = Metric((after['RssAnon'] - before['RssAnon']) / size, 'MB/file MB')
+            print(
+                f"large_file[{mode}]: {size} MB file, open {stats['open']:.2f}s, "
+                f"scroll median {stats['scroll']:.2f} ms, key median {stats['key']:.2f} ms "
+                f"(worst {stats['worst key']:.2f} ms), save {stats['save']:.2f}s"
+            )
+            print(
+                f"large_file[{mode} memory]: RSS +{after['VmRSS'] - before['VmRSS']:.0f} MB "
+                f"({(after['VmRSS'] - before['VmRSS']) / size:.2f} per file MB), "
+                f"anonymous +{after['RssAnon'] - before['RssAnon']:.0f} MB, peak {after['VmHWM']:.0f} MB"
+            )
+        return results
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+
+# Time to first paint, median of several cold starts; the benchmark fails
+# when startup grows past this
+STARTUP_BUDGET_MS = 350
+STARTUP_LINE = re.compile(r'^startup\[(.+)\]: ([\d.]+) ms$', re.MULTILINE)
+
+
+def bench_startup(runs=5, budget_ms=STARTUP_BUDGET_MS):
+    main_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+    cache = tempfile.mkdtemp(prefix='aidanide-startup-')
+    # An empty cache directory, so no saved session is restored
+    env = dict(os.environ, XDG_CACHE_HOME=cache, QT_QPA_PLATFORM='offscreen')
+    env[TRACE_ENV] = 'exit'
+    phases = {}
+    try:
+        for _ in range(runs):
+            result = subprocess.run(
+                [sys.executable, main_path], env=env, stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE, text=True, timeout=60
+            )
+            for phase, ms in STARTUP_LINE.findall(result.stderr):
+                phases.setdefault(phase, []).append(float(ms))
+    finally:
+        shutil.rmtree(cache, ignore_errors=True)
+
+    if 'total' not in phases:
+        raise SystemExit("startup: the IDE exited without reporting a first paint")
+    results = {phase: Metric(statistics.median(times), 'ms') for phase, times in phases.items()}
+    for phase, metric in results.items():
+        print(f"startup[{phase}]: {metric.value:.1f} ms (median of {len(phases[phase])})")
+    if results['total'].value > budget_ms:
+        raise SystemExit(f"startup: time to first paint {results['total'].value:.1f} ms is over the {budget_ms} ms budget")
+    return results
+
+
+BENCHMARKS = {
+    "highlighter": bench_highlighter,
+    "syntax": bench_syntax,
+    "typing": bench_typing,
+    "tree": bench_tree,
+    "files": bench_files,
+    "terminal": bench_terminal,
+    "quick_open": bench_quick_open,
+    "search": bench_search,
+    "replace": bench_replace,
+    "run": bench_run,
+    "diagnostics": bench_diagnostics,
+    "profiler": bench_profiler,
+    "symbols": bench_symbols,
+    "large_file": bench_large_file,
+    "startup": bench_startup,
+}
+
+
+def environment():
+    # Enough to tell whether two result files are comparable at all
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, timeout=10
+        ).stdout.strip() or None
+    except (OSError, subprocess.TimeoutExpired):
+        commit = None
+    return {
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'qt': QT_VERSION_STR,
+        'pyqt': PYQT_VERSION_STR,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'qpa': os.environ.get('QT_QPA_PLATFORM'),
+    }
+
+
+def better(unit, a, b):
+    if unit in HIGHER_IS_BETTER:
+        return max(a, b)
+    return min(a, b)
+
+
+def run_benchmarks(names, repeat=1):
+    # Each metric keeps its best value over the repeats, which is the least
+    # disturbed by whatever else the machine was doing
+    results = {}
+    failures = {}
+    for name in names:
+        for _ in range(repeat):
+            try:
+                metrics = BENCHMARKS[name]()
+            except SystemExit as e:
+                failures[name] = str(e)
+                print(e, file=sys.stderr)
+                break
+            except Exception as e:
+                failures[name] = f"{type(e).__name__}: {e}"
+                print(f"{name}: failed with {failures[name]}", file=sys.stderr)
+                break
+            best = results.setdefault(name, {})
+            for label, metric in metrics.items():
+                previous = best.get(label)
+                best[label] = metric if previous is None else Metric(better(metric.unit, previous.value, metric.value), metric.unit)
+    return {
+        'environment': environment(),
+        'benchmarks': {
+            name: {label: metric._asdict() for label, metric in metrics.items()}
+            for name, metrics in results.items()
+        },
+        'failures': failures,
+    }
+
+
+def compare(baseline, current, threshold=REGRESSION_THRESHOLD):
+    # Prints each metric both runs have next to its baseline and returns the
+    # ones that got worse by more than threshold percent
+    regressions = []
+    for name, metrics in current['benchmarks'].items():
+        for label, metric in metrics.items():
+            old = baseline['benchmarks'].get(name, {}).get(label)
+            if old is None or old['unit'] != metric['unit'] or not old['value']:
+                continue
+            change = (metric['value'] - old['value']) / old['value'] * 100
+            worse = -change if metric['unit'] in HIGHER_IS_BETTER else change
+            if worse > threshold:
+                verdict = "REGRESSION"
+                regressions.append((name, label, old['value'], metric['value'], metric['unit']))
+            elif worse < -threshold:
+                verdict = "improved"
+            else:
+                verdict = "same"
+            print(
+                f"compare[{name} {label}]: {old['value']:.4g} -> {metric['value']:.4g} {metric['unit']} "
+                f"({change:+.1f}%) {verdict}"
+            )
+    for name, message in current['failures'].items():
+        print(f"compare[{name}]: failed, {message}")
+    return regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description="Headless benchmarks of the IDE's hot paths. Results are printed as name[label] "
+                    "lines and can be saved as JSON and compared against an earlier run."
+    )
+    parser.add_argument('names', nargs='*', metavar='name',
+                        help=f"benchmarks to run, from: {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument('--json', metavar='PATH', help="write the results to PATH as JSON")
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help="compare against the JSON results of an earlier run and exit with status 1 "
+                             "on any regression")
+    parser.add_argument('--results', metavar='PATH',
+                        help="with --compare, take the results from PATH instead of running anything")
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD, metavar='PERCENT',
+                        help="how much worse a metric may get before it is a regression (default: %(default)s)")
+    parser.add_argument('--repeat', type=int, default=1, metavar='N',
+                        help="run each benchmark N times and keep each metric's best value")
+    args = parser.parse_args(argv)
+
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+
+    if args.results:
+        if not args.compare:
+            parser.error("--results needs --compare")
+        with open(args.results) as f:
+            report = json.load(f)
+    else:
+        report = run_benchmarks(args.names or list(BENCHMARKS), max(args.repeat, 1))
+        if args.json:
+            atomic_write(args.json, json.dumps(report, indent=2) + '\n')
+
+    status = 1 if report['failures'] else 0
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regressions over {args.threshold:g}% against {args.compare}", file=sys.stderr)
+            status = 1
+    return status
+
+
+if __name__ == "__main__":
+    app = QApplication(sys.argv[:1])
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,335 @@
+import os
+from pathlib import Path
+from PyQt5.QtWidgets import QAbstractScrollArea
+from PyQt5.QtGui import QColor, QFont, QKeySequence, QPainter
+from PyQt5.QtCore import Qt, pyqtSignal
+from codeeditor import BLOCK_OPENERS
+from piecetable import PieceTable
+
+TAB_WIDTH = 4
+# Bytes of a line that are shown; the rest of a longer line is never read
+DISPLAY_LIMIT = 64 * 1024
+MARGIN = 6
+
+BACKGROUND_COLOR = QColor("#282a36")
+TEXT_COLOR = QColor("#f8f8f2")
+CURRENT_LINE_COLOR = QColor("#44475a")
+GUTTER_COLOR = QColor("#6272a4")
+CARET_COLOR = QColor("#f8f8f2")
+
+
+class BufferView(QAbstractScrollArea):
+    # A plain text view over a PieceTable for files too big for a
+    # QTextDocument. Nothing is laid out ahead of time: each paint reads and
+    # draws only the lines on screen, so opening, scrolling and typing cost
+    # the same at any file size. There is no selection, highlighting or
+    # wrapping; the cursor is a line and a character column.
+    modificationChanged = pyqtSignal(bool)
+
+    def __init__(self, table, parent=None):
+        super().__init__(parent)
+        self.table = table
+        self.path = table.path
+        self.line = 0
+        self.column = 0
+        # The column Up and Down try to keep to across shorter lines
+        self.goal_column = None
+        self.saved_pieces = list(table.pieces)
+        self.modified = False
+        self.line_cache = {}
+        self.cache_revision = table.revision
+
+        font = QFont("Consolas")
+        font.setStyleHint(QFont.Monospace)
+        font.setPixelSize(14)
+        self.setFont(font)
+        self.viewport().setCursor(Qt.IBeamCursor)
+        self.setFocusPolicy(Qt.StrongFocus)
+        self.update_scrollbars()
+
+    @classmethod
+    def open(cls, path, encoding='utf-8', parent=None):
+        return cls(PieceTable(path, encoding), parent)
+
+    @property
+    def name(self):
+        return Path(self.path).name
+
+    def is_modified(self):
+        # Undoing back to the saved pieces counts as unmodified again
+        return self.table.pieces != self.saved_pieces
+
+    def mark_saved(self):
+        self.saved_pieces = list(self.table.pieces)
+        self.update_modified()
+
+    def mark_modified(self):
+        self.saved_pieces = None
+        self.update_modified()
+
+    def update_modified(self):
+        modified = self.is_modified()
+        if modified != self.modified:
+            self.modified = modified
+            self.modificationChanged.emit(modified)
+
+    def memory_usage(self):
+        return self.table.memory_usage()
+
+    def text(self, line):
+        if self.cache_revision != self.table.revision:
+            self.line_cache = {}
+            self.cache_revision = self.table.revision
+        text = self.line_cache.get(line)
+        if text is None:
+            text = self.table.line(line, DISPLAY_LIMIT)
+            self.line_cache[line] = text
+        return text
+
+    def line_height(self):
+        return max(1, self.fontMetrics().lineSpacing())
+
+    def visible_rows(self):
+        return max(1, self.viewport().height() // self.line_height())
+
+    def gutter_width(self):
+        return self.fontMetrics().horizontalAdvance('9' * len(str(self.table.line_count()))) + 2 * MARGIN
+
+    def column_x(self, text, column):
+        return self.fontMetrics().horizontalAdvance(text[:column].expandtabs(TAB_WIDTH))
+
+    def update_scrollbars(self):
+        rows = self.visible_rows()
+        vertical = self.verticalScrollBar()
+        vertical.setRange(0, max(0, self.table.line_count() - rows))
+        vertical.setPageStep(rows)
+        # Only the lines on screen are measured, so the range grows as
+        # longer lines scroll into view
+        first = vertical.value()
+        width = max(
+            (self.column_x(self.text(line), len(self.text(line)))
+             for line in range(first, min(first + rows + 1, self.table.line_count()))),
+            default=0
+        )
+        horizontal = self.horizontalScrollBar()
+        horizontal.setRange(0, max(0, width + self.gutter_width() + 2 * MARGIN - self.viewport().width()))
+        horizontal.setPageStep(self.viewport().width())
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.update_scrollbars()
+
+    def scrollContentsBy(self, dx, dy):
+        # The line cache only ever needs what is on screen
+        if len(self.line_cache) > 4 * self.visible_rows():
+            self.line_cache = {}
+        self.viewport().update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self.viewport())
+        painter.fillRect(event.rect(), BACKGROUND_COLOR)
+        metrics = self.fontMetrics()
+        line_height = self.line_height()
+        gutter = self.gutter_width()
+        first = self.verticalScrollBar().value()
+        left = gutter + MARGIN - self.horizontalScrollBar().value()
+        width = self.viewport().width()
+
+        for row in range(self.visible_rows() + 1):
+            line = first + row
+            if line >= self.table.line_count():
+                break
+            top = row * line_height
+            text = self.text(line)
+            if line == self.line:
+                painter.fillRect(0, top, width, line_height, CURRENT_LINE_COLOR)
+                if self.hasFocus():
+                    x = left + self.column_x(text, self.column)
+                    if x >= gutter:
+                        painter.fillRect(x, top, 2, line_height, CARET_COLOR)
+            painter.setClipRect(gutter, top, width - gutter, line_height)
+            painter.setPen(TEXT_COLOR)
+            painter.drawText(left, top + metrics.ascent(), text.expandtabs(TAB_WIDTH))
+            painter.setClipping(False)
+            painter.setPen(GUTTER_COLOR)
+            number = str(line + 1)
+            painter.drawText(gutter - MARGIN - metrics.horizontalAdvance(number), top + metrics.ascent(), number)
+        painter.end()
+
+    def go_to_line(self, line, column=0):
+        # line is 1-based, like the editor's
+        self.set_cursor(max(line - 1, 0), column)
+        self.center_cursor()
+        self.setFocus()
+
+    def column_limit(self, line):
+        # A line cut off at DISPLAY_LIMIT isn't measured in characters; its
+        # length in bytes is never short of its end
+        length = self.table.line_end(line) - self.table.line_start(line)
+        return len(self.text(line)) if length < DISPLAY_LIMIT else length
+
+    def set_cursor(self, line, column, keep_goal=False):
+        self.line = min(max(line, 0), self.table.line_count() - 1)
+        self.column = min(max(column, 0), self.column_limit(self.line))
+        if not keep_goal:
+            self.goal_column = None
+        self.ensure_cursor_visible()
+        self.viewport().update()
+
+    def center_cursor(self):
+        self.verticalScrollBar().setValue(self.line - self.visible_rows() // 2)
+
+    def ensure_cursor_visible(self):
+        vertical = self.verticalScrollBar()
+        rows = self.visible_rows()
+        if self.line < vertical.value():
+            vertical.setValue(self.line)
+        elif self.line >= vertical.value() + rows:
+            vertical.setValue(self.line - rows + 1)
+        self.update_scrollbars()
+
+        horizontal = self.horizontalScrollBar()
+        x = self.column_x(self.text(self.line), self.column)
+        visible = self.viewport().width() - self.gutter_width() - 2 * MARGIN
+        if x < horizontal.value():
+            horizontal.setValue(x)
+        elif x > horizontal.value() + visible:
+            horizontal.setValue(x - visible)
+
+    def mousePressEvent(self, event):
+        if event.button() != Qt.LeftButton:
+            return super().mousePressEvent(event)
+        line = self.verticalScrollBar().value() + event.pos().y() // self.line_height()
+        line = min(line, self.table.line_count() - 1)
+        text = self.text(line)
+        x = event.pos().x() - self.gutter_width() - MARGIN + self.horizontalScrollBar().value()
+        # column_x only grows with the column, so the last column left of
+        # the click is bisected for rather than measured one by one
+        low, high = 0, len(text)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.column_x(text, middle) <= x:
+                low = middle
+            else:
+                high = middle - 1
+        self.set_cursor(line, low)
+
+    def edit(self, action, *args):
+        # Every edit goes through here, so the view and the modified flag
+        # follow the table
+        action(*args, cursor=(self.line, self.column))
+        self.update_scrollbars()
+        self.update_modified()
+
+    def insert_text(self, text):
+        offset = self.table.offset_of(self.line, self.column)
+        self.edit(self.table.insert, offset, text)
+        lines = text.split('\n')
+        if len(lines) == 1:
+            self.set_cursor(self.line, self.column + len(text))
+        else:
+            self.set_cursor(self.line + len(lines) - 1, len(lines[-1]))
+
+    def delete_backward(self):
+        if self.column > 0:
+            end = self.table.offset_of(self.line, self.column)
+            start = self.table.offset_of(self.line, self.column - 1)
+            self.edit(self.table.delete, start, end)
+            self.set_cursor(self.line, self.column - 1)
+        elif self.line > 0:
+            # Joins with the line above, \r included. The offsets come from
+            # the table, since the line above can be longer than is shown.
+            previous = self.table.line_length(self.line - 1)
+            start = self.table.line_end(self.line - 1)
+            self.edit(self.table.delete, start, self.table.line_start(self.line))
+            self.set_cursor(self.line - 1, previous)
+
+    def delete_forward(self):
+        start = self.table.offset_of(self.line, self.column)
+        if start < self.table.line_end(self.line):
+            end = self.table.offset_of(self.line, self.column + 1)
+            self.edit(self.table.delete, start, end)
+        elif self.line + 1 < self.table.line_count():
+            self.edit(self.table.delete, start, self.table.line_start(self.line + 1))
+        self.viewport().update()
+
+    def undo(self):
+        cursor = self.table.undo((self.line, self.column))
+        if cursor is not None:
+            self.update_scrollbars()
+            self.update_modified()
+            self.set_cursor(*cursor)
+
+    def redo(self):
+        cursor = self.table.redo((self.line, self.column))
+        if cursor is not None:
+            self.update_scrollbars()
+            self.update_modified()
+            self.set_cursor(*cursor)
+
+    def move_vertically(self, lines):
+        if self.goal_column is None:
+            self.goal_column = self.column
+        goal = self.goal_column
+        self.set_cursor(self.line + lines, goal, keep_goal=True)
+
+    def keyPressEvent(self, event):
+        key = event.key()
+        control = event.modifiers() & Qt.ControlModifier
+        text = self.text(self.line)
+
+        if event.matches(QKeySequence.Undo):
+            self.undo()
+        elif event.matches(QKeySequence.Redo):
+            self.redo()
+        elif key == Qt.Key_Left:
+            if self.column > 0:
+                self.set_cursor(self.line, self.column - 1)
+            elif self.line > 0:
+                self.set_cursor(self.line - 1, len(self.text(self.line - 1)))
+        elif key == Qt.Key_Right:
+            if self.column < len(text):
+                self.set_cursor(self.line, self.column + 1)
+            elif self.line + 1 < self.table.line_count():
+                self.set_cursor(self.line + 1, 0)
+        elif key == Qt.Key_Up:
+            self.move_vertically(-1)
+        elif key == Qt.Key_Down:
+            self.move_vertically(1)
+        elif key == Qt.Key_PageUp:
+            self.move_vertically(-self.visible_rows())
+        elif key == Qt.Key_PageDown:
+            self.move_vertically(self.visible_rows())
+        elif key == Qt.Key_Home:
+            self.set_cursor(0 if control else self.line, 0)
+        elif key == Qt.Key_End:
+            line = self.table.line_count() - 1 if control else self.line
+            self.set_cursor(line, len(self.text(line)))
+        elif key in (Qt.Key_Return, Qt.Key_Enter):
+            # Same auto-indent as the editor
+            stripped = text.lstrip(' \t')
+            indent = text[:len(text) - len(stripped)]
+            if stripped.rstrip().endswith(BLOCK_OPENERS):
+                indent += "\t"
+            self.insert_text('\n' + indent)
+        elif key == Qt.Key_Backspace:
+            self.delete_backward()
+        elif key == Qt.Key_Delete:
+            self.delete_forward()
+        elif key == Qt.Key_Tab:
+            self.insert_text('\t')
+        elif event.text() and event.text().isprintable() and not control:
+            self.insert_text(event.text())
+        else:
+            super().keyPressEvent(event)
+
+    def focusInEvent(self, event):
+        super().focusInEvent(event)
+        self.viewport().update()
+
+    def focusOutEvent(self, event):
+        super().focusOutEvent(event)
+        self.viewport().update()
+
+    def same_file(self, path):
+        return os.path.abspath(path) == os.path.abspath(self.path)
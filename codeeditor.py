@@ -1,39 +1,266 @@
-from PyQt5.QtWidgets import QPlainTextEdit
-from PyQt5.QtGui import QTextCursor
-from PyQt5.QtCore import Qt
+from PyQt5.QtWidgets import QPlainTextEdit, QTextEdit, QWidget, QToolTip
+from PyQt5.QtGui import QTextCursor, QTextCharFormat, QColor, QPainter
+from PyQt5.QtCore import Qt, QTimer, QEvent, QRect, QSize
+
+AUTO_PAIRS = {
+    '"': '"',
+    "'": "'",
+    '(': ')',
+    '[': ']',
+    '{': '}'
+}
+AUTO_CLOSERS = frozenset(AUTO_PAIRS.values())
+BLOCK_OPENERS = (':', '{', '[', '(')
+
+MATCHED_BRACKET_FORMAT = QTextCharFormat()
+MATCHED_BRACKET_FORMAT.setBackground(QColor("#44475a"))
+MATCHED_BRACKET_FORMAT.setForeground(QColor("#50fa7b"))
+
+UNMATCHED_BRACKET_FORMAT = QTextCharFormat()
+UNMATCHED_BRACKET_FORMAT.setBackground(QColor("#ff5555"))
+UNMATCHED_BRACKET_FORMAT.setForeground(QColor("#f8f8f2"))
+
+DIAGNOSTIC_COLORS = {
+    'error': QColor("#ff5555"),
+    'warning': QColor("#f1fa8c"),
+}
+DIAGNOSTIC_FORMATS = {}
+for severity, color in DIAGNOSTIC_COLORS.items():
+    DIAGNOSTIC_FORMATS[severity] = QTextCharFormat()
+    DIAGNOSTIC_FORMATS[severity].setUnderlineStyle(QTextCharFormat.WaveUnderline)
+    DIAGNOSTIC_FORMATS[severity].setUnderlineColor(color)
+
+GUTTER_WIDTH = 12
+GUTTER_COLOR = QColor("#21222c")
+
+
+class DiagnosticGutter(QWidget):
+    # The strip left of the text with a marker on each line that has a
+    # diagnostic; the editor does the painting
+    def __init__(self, editor):
+        super().__init__(editor)
+        self.editor = editor
+
+    def sizeHint(self):
+        return QSize(GUTTER_WIDTH, 0)
+
+    def paintEvent(self, event):
+        self.editor.paint_gutter(event)
+
+    def event(self, event):
+        if event.type() == QEvent.ToolTip:
+            block = self.editor.cursorForPosition(event.pos()).block()
+            self.editor.show_diagnostics_tooltip(event.globalPos(), block.blockNumber())
+            return True
+        return super().event(event)
+
 
 class CodeEditor(QPlainTextEdit):
     def __init__(self, parent=None):
         super().__init__(parent)
+        self.syntax_tree = None
+        self.bracket_selections = []
+        # A keystroke can move the cursor more than once, auto-pairing for
+        # one, and only where it ends up is matched
+        self.bracket_timer = QTimer(self)
+        self.bracket_timer.setSingleShot(True)
+        self.bracket_timer.setInterval(0)
+        self.bracket_timer.timeout.connect(self.update_bracket_match)
+        self.cursorPositionChanged.connect(self.bracket_timer.start)
+
+        # (selection, diagnostic) pairs. The selections' cursors move with
+        # edits, so underlines and markers stay on their text until the
+        # next check replaces them.
+        self.diagnostics = []
+        self.diagnostic_selections = []
+        self.gutter = DiagnosticGutter(self)
+        self.setViewportMargins(GUTTER_WIDTH, 0, 0, 0)
+        self.updateRequest.connect(self.update_gutter)
+
+    def update_extra_selections(self):
+        self.setExtraSelections(self.diagnostic_selections + self.bracket_selections)
+
+    def update_bracket_match(self):
+        # Only the lines between the pair are looked at, and only those whose
+        # cached depth shows they could hold the other bracket
+        selections = []
+        match = self.syntax_tree.match_bracket(self.textCursor().position()) if self.syntax_tree else None
+        if match is not None:
+            own, other, matches = match
+            char_format = MATCHED_BRACKET_FORMAT if matches else UNMATCHED_BRACKET_FORMAT
+            for position in (own, other):
+                selection = QTextEdit.ExtraSelection()
+                selection.format = char_format
+                selection.cursor = QTextCursor(self.document())
+                selection.cursor.setPosition(position)
+                selection.cursor.movePosition(QTextCursor.Right, QTextCursor.KeepAnchor)
+                selections.append(selection)
+        if selections or self.bracket_selections:
+            self.bracket_selections = selections
+            self.update_extra_selections()
+
+    def set_diagnostics(self, diagnostics):
+        # diagnostics are Diagnostic tuples from the diagnostics service
+        if not diagnostics and not self.diagnostics:
+            return
+        document = self.document()
+        self.diagnostics = []
+        for diagnostic in diagnostics:
+            block = document.findBlockByNumber(diagnostic.line - 1)
+            if not block.isValid():
+                continue
+            last = block.length() - 1
+            cursor = QTextCursor(block)
+            cursor.setPosition(block.position() + min(diagnostic.column, last))
+            if diagnostic.end_column > diagnostic.column:
+                cursor.setPosition(block.position() + min(diagnostic.end_column, last), QTextCursor.KeepAnchor)
+            else:
+                # Underlines the word at the column, or the rest of the line
+                cursor.movePosition(QTextCursor.EndOfWord, QTextCursor.KeepAnchor)
+                if not cursor.hasSelection():
+                    cursor.movePosition(QTextCursor.EndOfBlock, QTextCursor.KeepAnchor)
+            selection = QTextEdit.ExtraSelection()
+            selection.cursor = cursor
+            selection.format = DIAGNOSTIC_FORMATS.get(diagnostic.severity, DIAGNOSTIC_FORMATS['error'])
+            self.diagnostics.append((selection, diagnostic))
+        self.diagnostic_selections = [selection for selection, _ in self.diagnostics]
+        self.update_extra_selections()
+        self.gutter.update()
+
+    def diagnostics_at(self, line):
+        # line is a 0-based block number
+        return [
+            diagnostic for selection, diagnostic in self.diagnostics
+            if selection.cursor.block().blockNumber() == line
+        ]
+
+    def show_diagnostics_tooltip(self, position, line):
+        messages = [f"{diagnostic.severity}: {diagnostic.message}" for diagnostic in self.diagnostics_at(line)]
+        if messages:
+            QToolTip.showText(position, "\n".join(messages), self)
+        else:
+            QToolTip.hideText()
+
+    def viewportEvent(self, event):
+        if event.type() == QEvent.ToolTip and self.diagnostics:
+            block = self.cursorForPosition(event.pos()).block()
+            self.show_diagnostics_tooltip(event.globalPos(), block.blockNumber())
+            return True
+        return super().viewportEvent(event)
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        rect = self.contentsRect()
+        self.gutter.setGeometry(QRect(rect.left(), rect.top(), GUTTER_WIDTH, rect.height()))
+
+    def update_gutter(self, rect, dy):
+        if dy:
+            self.gutter.scroll(0, dy)
+        else:
+            self.gutter.update(0, rect.y(), GUTTER_WIDTH, rect.height())
+
+    def paint_gutter(self, event):
+        painter = QPainter(self.gutter)
+        painter.fillRect(event.rect(), GUTTER_COLOR)
+        if not self.diagnostics:
+            return
+        # Errors win over warnings on a line
+        severities = {}
+        for selection, diagnostic in self.diagnostics:
+            line = selection.cursor.block().blockNumber()
+            if severities.get(line) != 'error':
+                severities[line] = diagnostic.severity
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setPen(Qt.NoPen)
+        block = self.firstVisibleBlock()
+        offset = self.contentOffset()
+        bottom = event.rect().bottom()
+        size = GUTTER_WIDTH // 2
+        while block.isValid():
+            geometry = self.blockBoundingGeometry(block).translated(offset)
+            if geometry.top() > bottom:
+                break
+            severity = severities.get(block.blockNumber())
+            if severity is not None and block.isVisible():
+                line_height = self.fontMetrics().height()
+                painter.setBrush(DIAGNOSTIC_COLORS.get(severity, DIAGNOSTIC_COLORS['error']))
+                painter.drawEllipse(
+                    (GUTTER_WIDTH - size) // 2, int(geometry.top()) + (line_height - size) // 2, size, size
+                )
+            block = block.next()
+
+    def jump_to_bracket(self):
+        # Lands before an opening bracket and after a closing one, so that
+        # jumping again goes straight back
+        if self.syntax_tree is None:
+            return
+        cursor = self.textCursor()
+        match = self.syntax_tree.match_bracket(cursor.position())
+        if match is None:
+            return
+        own, other, _ = match
+        cursor.setPosition(other if other < own else other + 1)
+        self.setTextCursor(cursor)
+
+    def toggle_fold(self):
+        # Folds the region the cursor line opens, or the innermost one around it
+        if self.syntax_tree is None:
+            return
+        node = self.syntax_tree.fold_region(self.textCursor().blockNumber())
+        if node is None:
+            return
+        first, last = node.folded_lines()
+        document = self.document()
+        folded = not document.findBlockByNumber(first).isVisible()
+        self.set_lines_visible(first, last, folded)
+        if not folded:
+            cursor = QTextCursor(document.findBlockByNumber(node.start))
+            cursor.movePosition(QTextCursor.EndOfBlock)
+            self.setTextCursor(cursor)
+
+    def unfold_all(self):
+        # Only the folded runs are touched, since dirtying a range re-parses it
+        block = self.document().firstBlock()
+        while block.isValid():
+            if block.isVisible():
+                block = block.next()
+                continue
+            first = block.blockNumber()
+            while block.isValid() and not block.isVisible():
+                block = block.next()
+            last = block.blockNumber() - 1 if block.isValid() else self.document().blockCount() - 1
+            self.set_lines_visible(first, last, True)
+
+    def set_lines_visible(self, first, last, visible):
+        document = self.document()
+        block = document.findBlockByNumber(first)
+        start = end = block.position()
+        while block.isValid() and block.blockNumber() <= last:
+            block.setVisible(visible)
+            end = block.position() + block.length()
+            block = block.next()
+        # A range past the end of the document, or an empty one, changes nothing
+        if end == start:
+            return
+        # The layout only picks up visibility changes for dirtied blocks
+        document.markContentsDirty(start, end - start)
+        self.viewport().update()
 
     def keyPressEvent(self, event):
         key = event.key()
         char = event.text()
         cursor = self.textCursor()
 
-        pairs = {
-            '"': '"',
-            "'": "'",
-            '(': ')',
-            '[': ']',
-            '{': '}'
-        }
-
         if key == Qt.Key_Return or key == Qt.Key_Enter:
             # Get current block (line) text without modifying cursor
-            current_block = cursor.block()
-            current_line = current_block.text()
+            current_line = cursor.block().text()
 
             # Figure out leading whitespace
-            indent = ""
-            for c in current_line:
-                if c in [' ', '\t']:
-                    indent += c
-                else:
-                    break
+            stripped = current_line.lstrip(' \t')
+            indent = current_line[:len(current_line) - len(stripped)]
 
             # Add extra indent if line ends in block opener
-            if current_line.strip().endswith((':', '{', '[', '(')):
+            if stripped.rstrip().endswith(BLOCK_OPENERS):
                 indent += "\t"
 
             super().keyPressEvent(event)
@@ -42,8 +269,8 @@ class CodeEditor(QPlainTextEdit):
             return
 
         # Handle paired characters
-        if char in pairs:
-            closing = pairs[char]
+        if char in AUTO_PAIRS:
+            closing = AUTO_PAIRS[char]
             super().keyPressEvent(event)
             cursor = self.textCursor()
             cursor.insertText(closing)
@@ -51,12 +278,13 @@ class CodeEditor(QPlainTextEdit):
             self.setTextCursor(cursor)
             return
 
-        elif char in pairs.values():
-            next_char = self.toPlainText()[cursor.position():cursor.position()+1]
+        elif char in AUTO_CLOSERS:
+            # Only the cursor's own line is read, never the whole document
+            column = cursor.positionInBlock()
+            next_char = cursor.block().text()[column:column + 1]
             if next_char == char:
                 cursor.movePosition(QTextCursor.Right)
                 self.setTextCursor(cursor)
                 return
 
         super().keyPressEvent(event)
-
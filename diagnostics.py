@@ -0,0 +1,262 @@
+import os
+import time
+import shlex
+import hashlib
+import warnings
+import subprocess
+from collections import namedtuple, OrderedDict, deque
+from concurrent.futures import CancelledError
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+from runner import COMPILERS, COMPILER_PROBLEM
+from search import executor
+from profiler import timed
+
+CHECK_DELAY_MS = 500
+# Larger documents aren't checked; their checks would be too slow to keep
+# up with typing
+CHECK_SIZE_LIMIT = 2 * 1024 * 1024
+C_CHECK_TIMEOUT = 10
+CACHED_RESULTS = 256
+LATENCY_SAMPLES = 100
+MAX_DIAGNOSTICS = 500
+
+# line is 1-based like Problem's; columns are 0-based, and an end_column
+# that isn't past column means the extent is up to the editor
+Diagnostic = namedtuple('Diagnostic', ['line', 'column', 'end_column', 'severity', 'message'])
+
+
+def check_python(text, path):
+    # A compile without writing bytecode, which is what py_compile would
+    # report, plus the warnings the compiler raises along the way
+    diagnostics = []
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        try:
+            compile(text, path or '<string>', 'exec', dont_inherit=True)
+        except SyntaxError as e:
+            line = e.lineno or 1
+            column = max((e.offset or 1) - 1, 0)
+            end = e.end_offset - 1 if e.end_offset and e.end_lineno == e.lineno else column
+            diagnostics.append(Diagnostic(line, column, end, 'error', f"{type(e).__name__}: {e.msg}"))
+        except ValueError as e:
+            diagnostics.append(Diagnostic(1, 0, 0, 'error', str(e)))
+    for warning in caught:
+        if issubclass(warning.category, (SyntaxWarning, DeprecationWarning)):
+            message = f"{warning.category.__name__}: {warning.message}"
+            diagnostics.append(Diagnostic(warning.lineno or 1, 0, 0, 'warning', message))
+    return diagnostics
+
+
+def check_c(text, path):
+    # The text goes in on stdin, so unsaved edits are checked; quoted
+    # includes are still looked up next to the file
+    ext = os.path.splitext(path)[1].lower()
+    variable, default, flags = COMPILERS[ext]
+    language = {'.c': 'c', '.cpp': 'c++', '.h': 'c-header'}[ext]
+    directory = os.path.dirname(os.path.abspath(path))
+    argv = shlex.split(os.environ.get(variable) or default) + flags + [
+        '-fsyntax-only', '-fno-diagnostics-color', '-x', language, '-iquote', directory, '-'
+    ]
+    try:
+        result = subprocess.run(
+            argv, input=text.encode('utf-8', 'surrogateescape'), capture_output=True,
+            timeout=C_CHECK_TIMEOUT, cwd=directory
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return []
+
+    diagnostics = []
+    for line in result.stderr.decode('utf-8', 'replace').splitlines():
+        match = COMPILER_PROBLEM.match(line)
+        if match is None or match['path'] != '<stdin>' or match['severity'] == 'note':
+            continue
+        severity = 'warning' if match['severity'] == 'warning' else 'error'
+        column = int(match['column']) - 1 if match['column'] else 0
+        diagnostics.append(Diagnostic(int(match['line']), column, column, severity, match['message']))
+    return diagnostics
+
+
+CHECKERS = {
+    '.py': check_python,
+    '.c': check_c,
+    '.cpp': check_c,
+    '.h': check_c,
+}
+
+
+def register_checker(extension, checker):
+    # Checkers run in worker processes, so they have to be module-level
+    # functions taking (text, path) and returning a list of Diagnostic
+    CHECKERS[extension.lower()] = checker
+
+
+def checker_for_path(path):
+    if not path:
+        return None
+    return CHECKERS.get(os.path.splitext(path)[1].lower())
+
+
+def run_checker(checker, text, path):
+    started = time.perf_counter()
+    diagnostics = checker(text, path)
+    return diagnostics[:MAX_DIAGNOSTICS], (time.perf_counter() - started) * 1000
+
+
+def submit(function, *args):
+    try:
+        return executor().submit(function, *args)
+    except (OSError, RuntimeError):
+        # Without worker processes the check runs on this thread
+        from concurrent.futures import Future
+        future = Future()
+        future.set_result(function(*args))
+        return future
+
+
+class CheckState:
+    def __init__(self, service, editor, path):
+        self.editor = editor
+        self.path = path
+        self.checker = checker_for_path(path)
+        # Bumped for every check submitted; results of older ones are stale
+        self.generation = 0
+        self.future = None
+        # Newer text arrived while a check was running
+        self.pending = False
+        self.key = None
+        self.diagnostics = []
+        self.latency = None
+        self.timer = QTimer(service)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(CHECK_DELAY_MS)
+        self.timer.timeout.connect(lambda: service.run_check(self))
+
+
+class DiagnosticsService(QObject):
+    # Checks open editors in the search process pool, CHECK_DELAY_MS after
+    # the last edit. Each editor has at most one check running: newer text
+    # replaces a queued check and waits for a running one, whose result is
+    # then dropped. Results are cached by content hash.
+    diagnostics_changed = pyqtSignal(object)
+    # Emitted from the executor's thread and delivered on the GUI thread
+    check_done = pyqtSignal(object, int, object, object, float)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.states = {}
+        self.cache = OrderedDict()
+        # Checker name -> recent (run ms, total ms) samples
+        self.latencies = {}
+        self.check_done.connect(self.apply_result)
+
+    def watch(self, editor, path):
+        state = self.states.get(editor)
+        if state is not None and state.path == path:
+            return
+        self.unwatch(editor)
+        state = CheckState(self, editor, path)
+        self.states[editor] = state
+        if state.checker is None:
+            self.set_diagnostics(state, [], None)
+            return
+        editor.document().contentsChanged.connect(state.timer.start)
+        self.run_check(state)
+
+    def unwatch(self, editor):
+        state = self.states.pop(editor, None)
+        if state is None:
+            return
+        state.timer.stop()
+        state.timer.deleteLater()
+        if state.future is not None:
+            state.future.cancel()
+        if state.checker is not None:
+            try:
+                editor.document().contentsChanged.disconnect(state.timer.start)
+            except (TypeError, RuntimeError):
+                pass
+
+    def diagnostics(self, editor):
+        state = self.states.get(editor)
+        return state.diagnostics if state is not None else []
+
+    @timed("diagnostics")
+    def run_check(self, state):
+        state.timer.stop()
+        editor = state.editor
+        document = editor.document()
+        if document.characterCount() > CHECK_SIZE_LIMIT or editor.property("large_file"):
+            self.set_diagnostics(state, [], None)
+            return
+        text = document.toPlainText()
+        digest = hashlib.sha1(text.encode('utf-8', 'surrogatepass')).hexdigest()
+        # C checks depend on the headers next to the file as well
+        key = (state.checker.__module__, state.checker.__name__, os.path.dirname(state.path), digest)
+        if key == state.key and state.future is None:
+            return
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.cache.move_to_end(key)
+            state.generation += 1
+            state.key = key
+            self.set_diagnostics(state, cached, 0.0)
+            return
+
+        if state.future is not None:
+            if not state.future.cancel():
+                # Can't stop a running check; this text is checked after it
+                state.pending = True
+                return
+        state.generation += 1
+        state.key = key
+        state.pending = False
+        submitted = time.perf_counter()
+        future = submit(run_checker, state.checker, text, state.path)
+        state.future = future
+        generation = state.generation
+        future.add_done_callback(
+            lambda future: self.check_done.emit(editor, generation, key, future, submitted)
+        )
+
+    def apply_result(self, editor, generation, key, future, submitted):
+        state = self.states.get(editor)
+        if state is None:
+            return
+        if state.future is future:
+            state.future = None
+        try:
+            diagnostics, run_ms = future.result()
+        except (CancelledError, Exception):
+            diagnostics = None
+        if diagnostics is not None:
+            total_ms = (time.perf_counter() - submitted) * 1000
+            self.cache[key] = diagnostics
+            if len(self.cache) > CACHED_RESULTS:
+                self.cache.popitem(last=False)
+            samples = self.latencies.setdefault(state.checker.__name__, deque(maxlen=LATENCY_SAMPLES))
+            samples.append((run_ms, total_ms))
+            if generation == state.generation:
+                self.set_diagnostics(state, diagnostics, run_ms)
+        if state.pending and state.future is None:
+            state.pending = False
+            self.run_check(state)
+
+    def set_diagnostics(self, state, diagnostics, latency):
+        state.diagnostics = diagnostics
+        state.latency = latency
+        state.editor.set_diagnostics(diagnostics)
+        self.diagnostics_changed.emit(state.editor)
+
+    def latency_summary(self):
+        # Checker name -> (checks, median run ms, worst run ms, median total ms)
+        summary = {}
+        for name, samples in self.latencies.items():
+            run = sorted(sample[0] for sample in samples)
+            total = sorted(sample[1] for sample in samples)
+            summary[name] = (len(samples), run[len(run) // 2], run[-1], total[len(total) // 2])
+        return summary
+
+    def wait(self):
+        for editor in list(self.states):
+            self.unwatch(editor)
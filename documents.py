@@ -0,0 +1,203 @@
+import os
+import zlib
+from collections import namedtuple
+from pathlib import Path
+from PyQt5.QtCore import QObject, pyqtSignal
+from highlighter import DummyHighlighter, attach_highlighter
+from syntax import detach_syntax_tree
+
+MB = 1024 * 1024
+# Live documents beyond this budget are hibernated, least recently used first
+TAB_MEMORY_BUDGET = 256 * MB
+# Measured for QTextDocument: UTF-16 text plus roughly this much per block
+# for the block, its layout and the highlighter's formats
+CHAR_SIZE = 2
+BLOCK_OVERHEAD = 440
+
+Hibernated = namedtuple('Hibernated', ['text', 'dirty', 'position', 'scroll'])
+
+
+def release_memory():
+    # Freed QTextDocument blocks stay in the C heap until it is trimmed;
+    # ctypes is only imported once there is something to give back
+    import ctypes
+    import ctypes.util
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'))
+        libc.malloc_trim(0)
+    except (OSError, AttributeError, TypeError):
+        pass
+
+
+class Document:
+    def __init__(self, editor, path=None, encoding='utf-8'):
+        self.editor = editor
+        self.path = path
+        self.encoding = encoding
+        self.highlighter = DummyHighlighter
+        self.syntax_enabled = True
+        # Text streamed in by a loader is never mistaken for an edit
+        self.loading = False
+        # Hash of the bytes on disk as of the last load or save
+        self.content_hash = None
+        self.saved_revision = editor.document().revision()
+        self.hibernated = None
+
+    @property
+    def name(self):
+        return Path(self.path).name if self.path else "Untitled"
+
+    def is_dirty(self):
+        # QTextDocument bumps its revision on every edit, so this never
+        # looks at the text; undoing back to the saved state clears the
+        # modified flag and counts as clean again
+        if self.hibernated is not None:
+            return self.hibernated.dirty
+        if self.loading:
+            return False
+        document = self.editor.document()
+        return document.revision() != self.saved_revision and document.isModified()
+
+    def mark_clean(self, content_hash=None):
+        if content_hash is not None:
+            self.content_hash = content_hash
+        if self.hibernated is not None:
+            # Saved from its hibernated text; the text is kept until the
+            # tab is shown again, in case the write fails
+            self.hibernated = self.hibernated._replace(dirty=False)
+            return
+        self.loading = False
+        self.saved_revision = self.editor.document().revision()
+        self.editor.document().setModified(False)
+
+    def mark_dirty(self):
+        if self.hibernated is not None:
+            self.hibernated = self.hibernated._replace(dirty=True)
+            return
+        self.saved_revision = -1
+        self.editor.document().setModified(True)
+
+    def memory_usage(self):
+        if self.hibernated is not None:
+            return len(self.hibernated.text or b'')
+        document = self.editor.document()
+        tree = self.editor.syntax_tree
+        return (
+            document.characterCount() * CHAR_SIZE + document.blockCount() * BLOCK_OVERHEAD
+            + (tree.memory_usage() if tree is not None else 0)
+        )
+
+    def can_hibernate(self):
+        # Clean documents need a file to be reloaded from
+        return (
+            self.hibernated is None and not self.loading
+            and (self.path is not None or self.is_dirty())
+        )
+
+    def hibernate(self):
+        # Clean documents are dropped and reloaded from disk later; dirty
+        # ones are kept as compressed text. Either way the undo history goes.
+        editor = self.editor
+        dirty = self.is_dirty()
+        text = zlib.compress(editor.toPlainText().encode('utf-8'), 1) if dirty else None
+        self.hibernated = Hibernated(text, dirty, *self.view_state())
+        attach_highlighter(DummyHighlighter, editor)
+        detach_syntax_tree(editor)
+        document = editor.document()
+        document.setUndoRedoEnabled(False)
+        document.clear()
+
+    def defer_load(self, position=0, scroll=0):
+        # Opened without reading the file: the tab loads like a hibernated
+        # clean document the first time it is activated
+        self.hibernated = Hibernated(None, False, position, scroll)
+
+    def view_state(self):
+        if self.hibernated is not None:
+            return self.hibernated.position, self.hibernated.scroll
+        return self.editor.textCursor().position(), self.editor.verticalScrollBar().value()
+
+    def hibernated_text(self):
+        return zlib.decompress(self.hibernated.text).decode('utf-8')
+
+    def thaw(self):
+        # Returns the hibernated state; the caller restores the text, from
+        # here when it was kept or from disk when it wasn't
+        state = self.hibernated
+        text = self.hibernated_text() if state.text is not None else None
+        self.hibernated = None
+        if text is not None:
+            document = self.editor.document()
+            self.editor.setPlainText(text)
+            document.setUndoRedoEnabled(not self.editor.property("large_file"))
+            if state.dirty:
+                self.mark_dirty()
+            else:
+                self.mark_clean()
+        return state
+
+
+class DocumentRegistry(QObject):
+    dirty_changed = pyqtSignal(object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.documents = {}
+        self.paths = {}
+        # Least recently activated first
+        self.recent = []
+
+    def register(self, editor, path=None, encoding='utf-8'):
+        document = Document(editor, None, encoding)
+        self.documents[editor] = document
+        self.recent.append(document)
+        self.set_path(document, path)
+        editor.document().modificationChanged.connect(lambda modified: self.dirty_changed.emit(editor))
+        return document
+
+    def get(self, editor):
+        return self.documents.get(editor)
+
+    def find(self, path):
+        return self.paths.get(os.path.abspath(path)) if path else None
+
+    def set_path(self, document, path):
+        if document.path:
+            self.paths.pop(os.path.abspath(document.path), None)
+        document.path = path
+        if path:
+            self.paths[os.path.abspath(path)] = document
+
+    def remove(self, editor):
+        document = self.documents.pop(editor, None)
+        if document is not None:
+            self.recent.remove(document)
+            if document.path:
+                self.paths.pop(os.path.abspath(document.path), None)
+        return document
+
+    def touch(self, document):
+        self.recent.remove(document)
+        self.recent.append(document)
+
+    def memory_usage(self):
+        return sum(document.memory_usage() for document in self.documents.values())
+
+    def enforce_budget(self, budget=TAB_MEMORY_BUDGET):
+        # The most recently used document always stays live
+        usage = self.memory_usage()
+        hibernated = []
+        for document in self.recent[:-1]:
+            if usage <= budget:
+                break
+            if document.can_hibernate():
+                before = document.memory_usage()
+                document.hibernate()
+                usage -= before - document.memory_usage()
+                hibernated.append(document)
+        if hibernated:
+            release_memory()
+        return hibernated
+
+    def dirty_documents(self):
+        return [document for document in self.documents.values() if document.is_dirty()]
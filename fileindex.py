@@ -0,0 +1,562 @@
+import os
+import re
+import bisect
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, QTimer, pyqtSignal
+from filetree import IgnoreRules, scan_directory
+from fileio import atomic_write
+from storage import project_cache_file
+
+INDEX_CACHE_NAME = 'files.idx'
+MAX_RESULTS = 50
+# Only this many matches are scored per query; basename matches are
+# collected first so they are never crowded out by deep path matches
+MAX_CANDIDATES = 1000
+# Path matching walks the files of at most this many matching directories
+# before switching to starting from matching basenames instead
+MAX_DIRECTORY_WALK = 200
+# Directory and basename matches kept for the query prefixes and suffixes
+# the next keystroke splits into again
+MAX_CACHED_HITS = 512
+PERSIST_DELAY_MS = 2000
+TABLE_REBUILD_DELAY_MS = 200
+
+
+def walk_project(root_path, rules, rel_dir=''):
+    paths = []
+    stack = [rel_dir]
+    while stack:
+        current = stack.pop()
+        for name, is_dir in scan_directory(os.path.join(root_path, current), rules):
+            rel_path = current + '/' + name if current else name
+            if is_dir:
+                stack.append(rel_path)
+            else:
+                paths.append(rel_path)
+    paths.sort()
+    return paths
+
+
+def load_index_cache(cache_file):
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            content = f.read()
+    except (OSError, UnicodeDecodeError):
+        return None
+    return content.split('\n') if content else []
+
+
+def line_offsets(lines):
+    offsets = []
+    position = 0
+    for line in lines:
+        offsets.append(position)
+        position += len(line) + 1
+    return offsets
+
+
+def build_search_tables(paths):
+    # Real trees repeat the same basenames and directories many times, so
+    # matching runs over the distinct names and directories only, each
+    # joined into one string the regex engine scans in C
+    names = []
+    name_ids = {}
+    name_lines = []
+    dirs = []
+    dir_ids = {}
+    dir_lines = []
+    line_names = []
+    line_dirs = []
+    lowered = []
+    for line, path in enumerate(paths):
+        path = path.lower()
+        lowered.append(path)
+        slash = path.rfind('/')
+        name = path[slash + 1:]
+        name_id = name_ids.get(name)
+        if name_id is None:
+            name_id = name_ids[name] = len(names)
+            names.append(name)
+            name_lines.append([])
+        name_lines[name_id].append(line)
+        line_names.append(name_id)
+
+        dir_id = -1
+        if slash >= 0:
+            directory = path[:slash + 1]
+            dir_id = dir_ids.get(directory)
+            if dir_id is None:
+                dir_id = dir_ids[directory] = len(dirs)
+                dirs.append(directory)
+                dir_lines.append([])
+            dir_lines[dir_id].append(line)
+        line_dirs.append(dir_id)
+
+    return {
+        'names': ('\n'.join(names), line_offsets(names), name_lines),
+        'dirs': ('\n'.join(dirs), line_offsets(dirs), dir_lines),
+        'name_list': names,
+        'lowered': lowered,
+        'line_names': line_names,
+        'line_dirs': line_dirs,
+    }
+
+
+class BuildTask(QRunnable):
+    def __init__(self, index, generation, from_cache):
+        super().__init__()
+        self.index = index
+        self.generation = generation
+        self.from_cache = from_cache
+        self.root_path = index.root_path
+        self.rules = index.rules
+        self.cache_file = index.cache_file
+
+    def run(self):
+        if self.from_cache:
+            paths = load_index_cache(self.cache_file)
+            if paths is None:
+                return
+        else:
+            paths = walk_project(self.root_path, self.rules)
+            try:
+                atomic_write(self.cache_file, '\n'.join(paths))
+            except OSError:
+                pass
+        self.index.built.emit(self.generation, self.from_cache, paths)
+
+
+class RefreshTask(QRunnable):
+    def __init__(self, index, generation, rel_dirs, known_dirs):
+        super().__init__()
+        self.index = index
+        self.generation = generation
+        self.rel_dirs = rel_dirs
+        self.known_dirs = known_dirs
+        self.root_path = index.root_path
+        self.rules = index.rules
+
+    def run(self):
+        listings = []
+        for rel_dir in self.rel_dirs:
+            files = []
+            dirs = []
+            new_files = []
+            for name, is_dir in scan_directory(os.path.join(self.root_path, rel_dir), self.rules):
+                rel_path = rel_dir + '/' + name if rel_dir else name
+                if is_dir:
+                    dirs.append(name)
+                    # Directories the index hasn't seen yet are walked in full
+                    if rel_path not in self.known_dirs:
+                        new_files.extend(walk_project(self.root_path, self.rules, rel_path))
+                else:
+                    files.append(name)
+            listings.append((rel_dir, files, dirs, new_files))
+        self.index.refreshed.emit(self.generation, listings)
+
+
+class TableTask(QRunnable):
+    def __init__(self, index, version, paths):
+        super().__init__()
+        self.index = index
+        self.version = version
+        self.paths = paths
+
+    def run(self):
+        self.index.tables_built.emit(self.version, build_search_tables(self.paths))
+
+
+class FileIndex(QObject):
+    ready = pyqtSignal()
+    built = pyqtSignal(int, bool, list)
+    refreshed = pyqtSignal(int, list)
+    tables_built = pyqtSignal(int, dict)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self.root_path = None
+        self.rules = None
+        self.cache_file = None
+        self.generation = 0
+        self.fresh = False
+        self.paths = []
+        self.tables = None
+        # Version of the paths a TableTask is building tables for
+        self.tables_pending = None
+        self.narrowed = {}
+        self.hits = {}
+        self.version = 0
+
+        self.built.connect(self.apply_build)
+        self.refreshed.connect(self.apply_refresh)
+        self.tables_built.connect(self.apply_tables)
+
+        # Search tables are rebuilt off the GUI thread once changes settle
+        self.table_pool = QThreadPool(self)
+        self.table_pool.setMaxThreadCount(1)
+        self.tables_timer = QTimer(self)
+        self.tables_timer.setSingleShot(True)
+        self.tables_timer.setInterval(TABLE_REBUILD_DELAY_MS)
+        self.tables_timer.timeout.connect(self.prepare_tables)
+
+        self.persist_timer = QTimer(self)
+        self.persist_timer.setSingleShot(True)
+        self.persist_timer.setInterval(PERSIST_DELAY_MS)
+        self.persist_timer.timeout.connect(self.persist)
+
+    def open_root(self, root_path, patterns=None):
+        # The cached index is served first so quick-open works straight
+        # away; a full walk then replaces it in the background
+        self.root_path = os.path.abspath(root_path)
+        self.rules = IgnoreRules(self.root_path, patterns)
+        self.cache_file = project_cache_file(self.root_path, INDEX_CACHE_NAME)
+        self.generation += 1
+        self.fresh = False
+        self.paths = []
+        self.paths_changed()
+
+        self.pool.start(BuildTask(self, self.generation, True))
+        self.pool.start(BuildTask(self, self.generation, False))
+
+    def apply_build(self, generation, from_cache, paths):
+        if generation != self.generation or (from_cache and self.fresh):
+            return
+        self.fresh = not from_cache
+        self.paths = paths
+        self.paths_changed()
+        self.ready.emit()
+
+    def relative_path(self, path):
+        if self.root_path is None:
+            return None
+        rel_path = os.path.relpath(os.path.abspath(path), self.root_path)
+        if rel_path == '.':
+            return ''
+        if rel_path.startswith('..'):
+            return None
+        return rel_path.replace(os.sep, '/')
+
+    def absolute_path(self, rel_path):
+        return os.path.join(self.root_path, *rel_path.split('/'))
+
+    def prefix_range(self, rel_dir):
+        if not rel_dir:
+            return 0, len(self.paths)
+        prefix = rel_dir + '/'
+        lo = bisect.bisect_left(self.paths, prefix)
+        hi = bisect.bisect_left(self.paths, prefix + '\uffff', lo)
+        return lo, hi
+
+    def refresh_directories(self, paths):
+        rel_dirs = []
+        for path in paths:
+            rel_dir = self.relative_path(path)
+            if rel_dir is not None and not (self.rules and self.rules.is_ignored(path, True)):
+                rel_dirs.append(rel_dir)
+        if not rel_dirs:
+            return
+
+        known_dirs = set()
+        for rel_dir in rel_dirs:
+            lo, hi = self.prefix_range(rel_dir)
+            start = len(rel_dir) + 1 if rel_dir else 0
+            for rel_path in self.paths[lo:hi]:
+                slash = rel_path.find('/', start)
+                if slash >= 0:
+                    known_dirs.add(rel_path[:slash])
+        self.pool.start(RefreshTask(self, self.generation, rel_dirs, known_dirs))
+
+    def apply_refresh(self, generation, listings):
+        if generation != self.generation:
+            return
+
+        for rel_dir, files, dirs, new_files in listings:
+            lo, hi = self.prefix_range(rel_dir)
+            start = len(rel_dir) + 1 if rel_dir else 0
+            files = set(files)
+            dirs = set(dirs)
+
+            kept = []
+            for rel_path in self.paths[lo:hi]:
+                slash = rel_path.find('/', start)
+                if slash < 0:
+                    if rel_path[start:] in files:
+                        kept.append(rel_path)
+                        files.discard(rel_path[start:])
+                elif rel_path[start:slash] in dirs:
+                    kept.append(rel_path)
+
+            prefix = rel_dir + '/' if rel_dir else ''
+            kept.extend(prefix + name for name in files)
+            kept.extend(new_files)
+            kept.sort()
+            self.paths[lo:hi] = kept
+
+        self.paths_changed()
+        self.persist_timer.start()
+
+    def add_file(self, path):
+        rel_path = self.relative_path(path)
+        if not rel_path or (self.rules and self.rules.is_ignored(path, False)):
+            return
+        index = bisect.bisect_left(self.paths, rel_path)
+        if index < len(self.paths) and self.paths[index] == rel_path:
+            return
+        self.paths.insert(index, rel_path)
+        self.paths_changed()
+        self.persist_timer.start()
+
+    def persist(self):
+        if self.cache_file is None:
+            return
+        try:
+            atomic_write(self.cache_file, '\n'.join(self.paths))
+        except OSError:
+            pass
+
+    def wait(self):
+        self.generation += 1
+        self.pool.waitForDone()
+        self.table_pool.waitForDone()
+
+    def search_tables(self):
+        # Builds the tables on this thread, for callers that can't wait
+        if self.tables is None:
+            self.tables = build_search_tables(self.paths)
+            self.narrowed = {}
+            self.hits = {}
+        return self.tables
+
+    def paths_changed(self):
+        self.version += 1
+        self.tables = None
+        self.narrowed = {}
+        self.hits = {}
+        self.tables_timer.start()
+
+    def prepare_tables(self):
+        self.tables_timer.stop()
+        if self.tables is None and self.tables_pending != self.version:
+            self.tables_pending = self.version
+            self.table_pool.start(TableTask(self, self.version, list(self.paths)))
+
+    def apply_tables(self, version, tables):
+        if version == self.version and self.tables is None:
+            self.tables = tables
+            self.narrowed = {}
+            self.hits = {}
+            # Searches made while the tables were building only got a prefix
+            # of the paths; this has the palette search again
+            self.ready.emit()
+
+    @staticmethod
+    def subsequence_pattern(query):
+        # Each gap excludes the character that follows it, so the earliest
+        # subsequence match is found without the engine backtracking
+        chars = [re.escape(c) for c in query]
+        return re.compile(chars[0] + ''.join('[^%s\n]*%s' % (c, c) for c in chars[1:]))
+
+    @staticmethod
+    def iter_matches(pattern, blob, offsets):
+        pos = 0
+        while True:
+            match = pattern.search(blob, pos)
+            if match is None:
+                return
+            entry = bisect.bisect_right(offsets, match.start()) - 1
+            yield entry, match
+            end = blob.find('\n', match.end())
+            if end < 0:
+                return
+            pos = end + 1
+
+    def search(self, query, limit=MAX_RESULTS):
+        query = query.strip().lower().replace('\\', '/').replace('\n', '')
+        if not query:
+            return self.paths[:limit]
+        if self.tables is None:
+            # A keystroke never waits on the tables, which take ~0.4s for
+            # 200k paths; ready is emitted once they are in
+            self.prepare_tables()
+            return self.paths[:limit]
+        if len(self.hits) > MAX_CACHED_HITS:
+            self.hits = {}
+
+        # While typing, each query usually extends the last one; once a
+        # query's complete match set is small, longer queries only recheck it
+        candidates = None
+        for size in range(len(query) - 1, 0, -1):
+            candidates = self.narrowed.get(query[:size])
+            if candidates is not None:
+                break
+
+        if candidates is not None:
+            scores = self.rescore(query, candidates)
+            complete = True
+        else:
+            scores = {}
+            complete = self.match_names(query, scores)
+            # Plenty of basename hits make directory matches irrelevant
+            if '/' in query or len(scores) < limit:
+                complete = self.match_paths(query, scores) and complete
+            else:
+                complete = False
+
+        if complete:
+            self.narrowed[query] = list(scores)
+
+        ranked = sorted(scores, key=scores.get, reverse=True)[:limit]
+        return [self.paths[line] for line in ranked]
+
+    def match_names(self, query, scores):
+        if '/' in query:
+            return True
+        blob, offsets, name_lines = self.tables['names']
+        for name_id, match in self.iter_matches(self.subsequence_pattern(query), blob, offsets):
+            span = match.end() - match.start()
+            start = match.start() - offsets[name_id]
+            for line in name_lines[name_id]:
+                scores[line] = self.score(line, span, start, True)
+            if len(scores) >= MAX_CANDIDATES:
+                return False
+        return True
+
+    def match_paths(self, query, scores):
+        # A path matches when some prefix of the query matches its directory
+        # and the rest matches its basename. Longer directory prefixes are
+        # tried first, so the scan can stop once enough paths are found
+        tables = self.tables
+        dir_blob, dir_offsets, dir_lines = tables['dirs']
+        name_lines = tables['names'][2]
+        lowered = tables['lowered']
+        line_names = tables['line_names']
+        line_dirs = tables['line_dirs']
+        names = tables['name_list']
+
+        # Basenames never contain a slash, so neither can the rest
+        shortest = query.rfind('/') + 1
+        for size in range(len(query), max(shortest, 1) - 1, -1):
+            dir_pattern = self.subsequence_pattern(query[:size])
+            rest = query[size:]
+
+            if not rest:
+                for dir_id, match in self.iter_matches(dir_pattern, dir_blob, dir_offsets):
+                    span = match.end() - match.start()
+                    for line in dir_lines[dir_id]:
+                        if line not in scores:
+                            scores[line] = self.score(line, span, -1, False)
+                    if len(scores) >= MAX_CANDIDATES:
+                        return False
+                continue
+
+            # When few directories fit the prefix, walk their files directly
+            matched_dirs = self.dir_hits(query[:size])
+            if matched_dirs is not None:
+                rest_pattern = self.subsequence_pattern(rest)
+                # Many of these files share basenames, so each is checked once
+                name_spans = {}
+                for dir_id, dir_span in matched_dirs:
+                    for line in dir_lines[dir_id]:
+                        name_id = line_names[line]
+                        name_span = name_spans.get(name_id)
+                        if name_span is None:
+                            match = rest_pattern.search(names[name_id])
+                            name_span = name_spans[name_id] = match.end() - match.start() if match else 0
+                        if name_span and line not in scores:
+                            scores[line] = self.score(line, dir_span + name_span, -1, False)
+                            if len(scores) >= MAX_CANDIDATES:
+                                return False
+                continue
+
+            # Otherwise start from the basenames that fit the rest and check
+            # each of their directories once
+            dir_spans = {}
+            for name_id, name_span in self.name_hits(rest):
+                for line in name_lines[name_id]:
+                    if line in scores:
+                        continue
+                    dir_id = line_dirs[line]
+                    if dir_id < 0:
+                        continue
+                    dir_span = dir_spans.get(dir_id)
+                    if dir_span is None:
+                        path = lowered[line]
+                        match = dir_pattern.search(path, 0, path.rfind('/') + 1)
+                        dir_span = dir_spans[dir_id] = match.end() - match.start() if match else 0
+                    if dir_span:
+                        scores[line] = self.score(line, dir_span + name_span, -1, False)
+                        if len(scores) >= MAX_CANDIDATES:
+                            return False
+        return True
+
+    def dir_hits(self, prefix):
+        # Directories matching a query prefix with the span of each match,
+        # or None when there are more than MAX_DIRECTORY_WALK. Typing only
+        # adds a prefix, so each is scanned for once.
+        key = ('dirs', prefix)
+        if key in self.hits:
+            return self.hits[key]
+        blob, offsets, _ = self.tables['dirs']
+        hits = []
+        for dir_id, match in self.iter_matches(self.subsequence_pattern(prefix), blob, offsets):
+            hits.append((dir_id, match.end() - match.start()))
+            if len(hits) > MAX_DIRECTORY_WALK:
+                hits = None
+                break
+        self.hits[key] = hits
+        return hits
+
+    def name_hits(self, rest):
+        # Basenames matching the rest of a query with the span of each
+        # match. Any name that matches it also matches the rest one
+        # character shorter at either end: the rest the last query was split
+        # into, or the one tried just before in this query. So the names are
+        # usually filtered from a short list rather than scanned for.
+        key = ('names', rest)
+        hits = self.hits.get(key)
+        if hits is not None:
+            return hits
+        pattern = self.subsequence_pattern(rest)
+        shorter = [self.hits.get(('names', rest[:-1])), self.hits.get(('names', rest[1:]))]
+        shorter = [hits for hits in shorter if hits is not None]
+        if shorter:
+            names = self.tables['name_list']
+            hits = []
+            for name_id, _ in min(shorter, key=len):
+                match = pattern.search(names[name_id])
+                if match is not None:
+                    hits.append((name_id, match.end() - match.start()))
+        else:
+            blob, offsets, _ = self.tables['names']
+            hits = [
+                (name_id, match.end() - match.start())
+                for name_id, match in self.iter_matches(pattern, blob, offsets)
+            ]
+        self.hits[key] = hits
+        return hits
+
+    def rescore(self, query, candidates):
+        lowered = self.tables['lowered']
+        pattern = self.subsequence_pattern(query)
+        scores = {}
+        for line in candidates:
+            path = lowered[line]
+            slash = path.rfind('/')
+            match = None if '/' in query else pattern.search(path, slash + 1)
+            if match is not None:
+                scores[line] = self.score(line, match.end() - match.start(), match.start() - slash - 1, True)
+                continue
+            match = pattern.search(path)
+            if match is not None:
+                scores[line] = self.score(line, match.end() - match.start(), -1, False)
+        return scores
+
+    def score(self, line, span, start, in_name):
+        # Tight matches in the file name win, then shorter paths
+        score = -span * 2 - len(self.paths[line]) * 0.05
+        if in_name:
+            score += 100
+            if start == 0:
+                score += 20
+        return score
@@ -0,0 +1,231 @@
+import os
+import io
+import codecs
+import hashlib
+import shutil
+import tempfile
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, QCoreApplication, QEvent, pyqtSignal, pyqtSlot
+from profiler import timed
+
+CHUNK_SIZE = 1024 * 1024
+# Files above this size open in large-file mode: no undo stack and no
+# highlighting
+LARGE_FILE_THRESHOLD = 64 * 1024 * 1024
+# Files above this size are not loaded into a QTextDocument at all; they open
+# in a piece table over the mapped file, shown by a view that only lays out
+# the lines on screen
+PIECE_TABLE_THRESHOLD = 256 * 1024 * 1024
+
+# Read once at import; os.umask can only be queried by setting it
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+def make_decoder(encoding='utf-8'):
+    # Matches open(..., 'r') newline handling while still accepting chunks
+    # that split a multibyte character or a \r\n pair
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    return io.IncrementalNewlineDecoder(decoder, translate=True)
+
+
+def iter_file_chunks(path):
+    # Every chunk ends up decoded in the QTextDocument, so there is nothing
+    # to gain from mapping the file; files too big to hold in memory open in
+    # a piece table instead
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+class LoadTask(QRunnable):
+    def __init__(self, loader):
+        super().__init__()
+        self.loader = loader
+
+    def run(self):
+        try:
+            self.load()
+        finally:
+            # Last thing the worker does with the loader, so it can go now
+            self.loader.done.emit()
+
+    def load(self):
+        loader = self.loader
+        decoder = make_decoder(loader.encoding)
+        digest = hashlib.sha1()
+        done = 0
+        try:
+            for chunk in iter_file_chunks(loader.path):
+                if loader.cancelled:
+                    return
+                done += len(chunk)
+                digest.update(chunk)
+                text = decoder.decode(chunk)
+                if text:
+                    loader.chunk_loaded.emit(text)
+                loader.progress.emit(done, loader.size)
+            tail = decoder.decode(b'', final=True)
+            if tail:
+                loader.chunk_loaded.emit(tail)
+        except (OSError, ValueError) as e:
+            loader.failed.emit(str(e))
+            return
+        loader.content_hash = digest.hexdigest()
+        loader.finished.emit()
+
+
+class FileLoader(QObject):
+    chunk_loaded = pyqtSignal(str)
+    progress = pyqtSignal(int, int)
+    finished = pyqtSignal()
+    failed = pyqtSignal(str)
+    done = pyqtSignal()
+
+    pool = None
+
+    def __init__(self, path, encoding='utf-8', parent=None):
+        size = os.path.getsize(path)
+        super().__init__(parent)
+        self.done.connect(self.deleteLater)
+        self.path = path
+        self.encoding = encoding
+        self.size = size
+        self.large_file = self.size > LARGE_FILE_THRESHOLD
+        self.cancelled = False
+        self.content_hash = None
+
+    def start(self):
+        if FileLoader.pool is None:
+            FileLoader.pool = QThreadPool()
+            FileLoader.pool.setMaxThreadCount(2)
+        FileLoader.pool.start(LoadTask(self))
+
+    def cancel(self):
+        self.cancelled = True
+
+
+def atomic_write(path, text, encoding='utf-8'):
+    # Write next to the target and rename over it, so a crash mid-write
+    # leaves either the old file or the new one, never a truncated mix.
+    # text is a str, bytes, or an iterable of bytes chunks written in turn.
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', suffix='.tmp', dir=directory)
+    try:
+        if isinstance(text, str):
+            f = os.fdopen(fd, 'w', encoding=encoding)
+        else:
+            f = os.fdopen(fd, 'wb')
+        with f:
+            if isinstance(text, (str, bytes)):
+                f.write(text)
+            else:
+                for chunk in text:
+                    f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+
+        try:
+            shutil.copymode(path, tmp_path)
+        except FileNotFoundError:
+            os.chmod(tmp_path, 0o666 & ~UMASK)
+
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
+class SaveTask(QRunnable):
+    def __init__(self, saver, path, text, encoding):
+        super().__init__()
+        self.saver = saver
+        self.path = path
+        self.text = text
+        self.encoding = encoding
+
+    @timed("save write")
+    def run(self):
+        try:
+            if isinstance(self.text, str):
+                data = self.text.encode(self.encoding)
+                digest = hashlib.sha1(data)
+            else:
+                # Already encoded chunks, hashed as they are written
+                digest = hashlib.sha1()
+                data = hashed_chunks(self.text, digest)
+            atomic_write(self.path, data)
+        except (OSError, UnicodeError, ValueError) as e:
+            self.saver.write_done.emit(self.path, str(e), "")
+            return
+        self.saver.write_done.emit(self.path, "", digest.hexdigest())
+
+
+def hashed_chunks(chunks, digest):
+    for chunk in chunks:
+        digest.update(chunk)
+        yield chunk
+
+
+class FileSaver(QObject):
+    saved = pyqtSignal(str, str)
+    failed = pyqtSignal(str, str)
+    write_done = pyqtSignal(str, str, str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(2)
+        self.in_flight = set()
+        self.pending = {}
+        self.write_done.connect(self.finish_write)
+
+    def save(self, path, text, encoding='utf-8'):
+        # While a write to this path is running, newer snapshots replace each
+        # other and only the latest is written once the current one lands.
+        # text is a str, or bytes chunks from a snapshot that stays valid
+        # while it waits, such as PieceTable.chunks().
+        if path in self.in_flight:
+            self.pending[path] = (text, encoding)
+            return
+        self.in_flight.add(path)
+        self.pool.start(SaveTask(self, path, text, encoding))
+
+    # A real slot, so its queued calls are posted to this object and wait()
+    # can deliver them without running anything else in the event queue
+    @pyqtSlot(str, str, str)
+    def finish_write(self, path, error, content_hash):
+        self.in_flight.discard(path)
+        queued = self.pending.pop(path, None)
+        if queued is not None:
+            self.save(path, *queued)
+
+        if error:
+            self.failed.emit(path, error)
+        elif queued is None:
+            self.saved.emit(path, content_hash)
+
+    def wait(self):
+        # Used on shutdown and before runs, when queued follow-up writes can't
+        # wait for the event loop. Finished writes are reported here, which
+        # starts their follow-ups, until nothing is left in flight.
+        self.pool.waitForDone()
+        while self.in_flight:
+            QCoreApplication.sendPostedEvents(self, QEvent.MetaCall)
+            self.pool.waitForDone()
@@ -0,0 +1,169 @@
+import os
+import fnmatch
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, QTimer, QFileSystemWatcher, pyqtSignal
+
+DEFAULT_IGNORE_PATTERNS = [
+    '.git', '.hg', '.svn', 'node_modules', '__pycache__', '.venv', 'venv',
+    '.mypy_cache', '.pytest_cache', '.tox', '*.pyc', '*.pyo', '.DS_Store'
+]
+
+FRAME_INTERVAL_MS = 16
+
+
+class IgnoreRules:
+    def __init__(self, root_path, patterns=None, use_gitignore=True):
+        self.root_path = root_path
+        self.name_patterns = []
+        self.path_patterns = []
+
+        if patterns is None:
+            patterns = DEFAULT_IGNORE_PATTERNS
+        for pattern in patterns:
+            self.add_pattern(pattern)
+
+        if use_gitignore:
+            for pattern in self.read_gitignore(root_path):
+                self.add_pattern(pattern)
+
+    @staticmethod
+    def read_gitignore(root_path):
+        patterns = []
+        try:
+            with open(os.path.join(root_path, '.gitignore'), 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    # Negations are not supported, so they are skipped rather than misapplied
+                    if not line or line.startswith(('#', '!')):
+                        continue
+                    patterns.append(line)
+        except (OSError, UnicodeDecodeError):
+            pass
+        return patterns
+
+    def add_pattern(self, pattern):
+        dir_only = pattern.endswith('/')
+        pattern = pattern.rstrip('/')
+        if not pattern:
+            return
+
+        # A slash anywhere but the end anchors the pattern to the root
+        if '/' in pattern:
+            self.path_patterns.append((pattern.lstrip('/'), dir_only))
+        else:
+            self.name_patterns.append((pattern, dir_only))
+
+    def is_ignored(self, full_path, is_dir):
+        name = os.path.basename(full_path)
+        for pattern, dir_only in self.name_patterns:
+            if dir_only and not is_dir:
+                continue
+            if fnmatch.fnmatchcase(name, pattern):
+                return True
+
+        if self.path_patterns:
+            rel_path = os.path.relpath(full_path, self.root_path).replace(os.sep, '/')
+            for pattern, dir_only in self.path_patterns:
+                if dir_only and not is_dir:
+                    continue
+                if fnmatch.fnmatchcase(rel_path, pattern):
+                    return True
+
+        return False
+
+
+def scan_directory(path, rules=None):
+    # os.scandir hands back the file type from the directory read itself,
+    # so there is no extra stat() per entry like os.path.isdir would do
+    entries = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if rules is not None and rules.is_ignored(entry.path, is_dir):
+                    continue
+                entries.append((entry.name, is_dir))
+    except OSError:
+        pass
+
+    entries.sort()
+    return entries
+
+
+class ScanTask(QRunnable):
+    def __init__(self, scanner, path, rules):
+        super().__init__()
+        self.scanner = scanner
+        self.path = path
+        self.rules = rules
+
+    def run(self):
+        entries = scan_directory(self.path, self.rules)
+        self.scanner.scanned.emit(self.path, entries)
+
+
+class DirectoryScanner(QObject):
+    # Emitted on the GUI thread with (directory path, [(name, is_dir), ...])
+    scanned = pyqtSignal(str, list)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(2)
+        self.rules = None
+
+    def set_root(self, root_path, patterns=None):
+        self.rules = IgnoreRules(root_path, patterns)
+
+    def scan(self, path):
+        self.pool.start(ScanTask(self, path, self.rules))
+
+
+class TreeWatcher(QObject):
+    # Emitted at most once per frame with every directory touched since the last batch
+    directories_changed = pyqtSignal(list)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self.queue_change)
+        self.watched = set()
+        self.pending = set()
+
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.setInterval(FRAME_INTERVAL_MS)
+        self.flush_timer.timeout.connect(self.flush)
+
+    def watch(self, path):
+        if path in self.watched:
+            return
+        if self.watcher.addPath(path):
+            self.watched.add(path)
+
+    def unwatch(self, path):
+        if path in self.watched:
+            self.watched.discard(path)
+            self.watcher.removePath(path)
+
+    def clear(self):
+        if self.watched:
+            self.watcher.removePaths(list(self.watched))
+        self.watched.clear()
+        self.pending.clear()
+        self.flush_timer.stop()
+
+    def queue_change(self, path):
+        # A git checkout fires thousands of these; they all land in one batch
+        self.pending.add(path)
+        if not self.flush_timer.isActive():
+            self.flush_timer.start()
+
+    def flush(self):
+        if not self.pending:
+            return
+        paths = sorted(self.pending)
+        self.pending.clear()
+        self.directories_changed.emit(paths)
@@ -1,76 +1,198 @@
+import os
+import time
 from PyQt5.QtGui import QSyntaxHighlighter, QTextCharFormat, QColor, QFont
-from PyQt5.QtCore import QRegExp
+from PyQt5.QtCore import QObject, QTimer
+from syntax import PythonParser, CParser, attach_syntax_tree
+from profiler import timed
 
-class PythonHighlighter(QSyntaxHighlighter):
-    def __init__(self, document):
-        super().__init__(document)
+# Above this many characters a document is shown without highlighting at all
+HIGHLIGHT_SIZE_LIMIT = 8 * 1024 * 1024
+# Documents with more blocks than this highlight the viewport first and the
+# rest in time-sliced chunks while the event loop is idle
+PROGRESSIVE_BLOCK_THRESHOLD = 2000
+SLICE_BUDGET_MS = 8
 
-        keyword_format = QTextCharFormat()
-        keyword_format.setForeground(QColor("#ff79c6"))
-        keyword_format.setFontWeight(QFont.Bold)
 
-        keywords = [
-            'def', 'class', 'if', 'else', 'elif', 'while', 'for', 'in', 'try',
-            'except', 'with', 'as', 'import', 'from', 'return', 'pass', 'break',
-            'continue', 'True', 'False', 'None', 'and', 'or', 'not', 'is', 'lambda'
-        ]
+def make_format(color, bold=False):
+    fmt = QTextCharFormat()
+    fmt.setForeground(QColor(color))
+    if bold:
+        fmt.setFontWeight(QFont.Bold)
+    return fmt
 
-        self.rules = [(QRegExp(r'\b' + kw + r'\b'), keyword_format) for kw in keywords]
 
-        string_format = QTextCharFormat()
-        string_format.setForeground(QColor("#f1fa8c"))
-        self.rules.append((QRegExp(r'"[^"\\]*(\\.[^"\\]*)*"'), string_format))
-        self.rules.append((QRegExp(r"'[^'\\]*(\\.[^'\\]*)*'"), string_format))
+KEYWORD_FORMAT = make_format("#ff79c6", bold=True)
+STRING_FORMAT = make_format("#f1fa8c")
+COMMENT_FORMAT = make_format("#6272a4")
+NUMBER_FORMAT = make_format("#bd93f9")
+DEFINITION_FORMAT = make_format("#50fa7b")
+DECORATOR_FORMAT = make_format("#ffb86c")
+INTERPOLATION_FORMAT = make_format("#ffb86c", bold=True)
+PREPROCESSOR_FORMAT = make_format("#8be9fd")
 
-        comment_format = QTextCharFormat()
-        comment_format.setForeground(QColor("#6272a4"))
-        self.rules.append((QRegExp(r'#.*'), comment_format))
 
-    def highlightBlock(self, text):
-        for pattern, fmt in self.rules:
-            index = pattern.indexIn(text)
-            while index >= 0:
-                length = pattern.matchedLength()
-                self.setFormat(index, length, fmt)
-                index = pattern.indexIn(text, index + length)
-
-class CHighlighter(QSyntaxHighlighter):
-    def __init__(self, document):
+class TreeHighlighter(QSyntaxHighlighter):
+    # Formats come from the document's syntax tree instead of a regex pass
+    # of its own; subclasses provide the parser the tree is built with
+    parser = None
+    formats = {
+        'keyword': KEYWORD_FORMAT,
+        'string': STRING_FORMAT,
+        'comment': COMMENT_FORMAT,
+        'inactive': COMMENT_FORMAT,
+        'number': NUMBER_FORMAT,
+        'definition': DEFINITION_FORMAT,
+        'decorator': DECORATOR_FORMAT,
+        'interpolation': INTERPOLATION_FORMAT,
+        'preprocessor': PREPROCESSOR_FORMAT,
+    }
+
+    def __init__(self, document, tree):
         super().__init__(document)
+        self.tree = tree
+        self.deferred = False
+        self.ready_until = -1
+        self.visible_range = (0, -1)
+
+    def is_scheduled(self, block_number):
+        first, last = self.visible_range
+        return block_number <= self.ready_until or first <= block_number <= last
 
-        keyword_format = QTextCharFormat()
-        keyword_format.setForeground(QColor("#ff79c6"))
-        keyword_format.setFontWeight(QFont.Bold)
+    @timed("highlightBlock")
+    def highlightBlock(self, text):
+        # While a background pass is running, blocks it hasn't reached are
+        # left alone unless they are on screen; their state stays unchanged
+        # so Qt doesn't cascade into the rest of the document
+        number = self.currentBlock().blockNumber()
+        if self.deferred and not self.is_scheduled(number):
+            return
 
-        keywords = [
-            'int', 'float', 'double', 'char', 'bool', 'void', 'if', 'else',
-            'while', 'for', 'return', 'switch', 'case', 'break', 'continue',
-            'default', 'do', 'struct', 'class', 'public', 'private', 'protected',
-            'true', 'false', 'include', 'define', 'namespace', 'using', 'new', 'delete'
-        ]
+        line = self.tree.line(number)
+        tokens = line.tokens
+        formats = self.formats
+        for i in range(0, len(tokens), 3):
+            self.setFormat(tokens[i], tokens[i + 1], formats[tokens[i + 2]])
+        # Qt carries on into the next block only while this changes, which
+        # follows the tree's own re-parse after an edit
+        self.setCurrentBlockState(self.tree.state_id(line.state))
 
-        self.rules = [(QRegExp(r'\b' + kw + r'\b'), keyword_format) for kw in keywords]
 
-        string_format = QTextCharFormat()
-        string_format.setForeground(QColor("#f1fa8c"))
-        self.rules.append((QRegExp(r'"[^"\\]*(\\.[^"\\]*)*"'), string_format))
-        self.rules.append((QRegExp(r"'[^'\\]*(\\.[^'\\]*)*'"), string_format))
+class PythonTreeHighlighter(TreeHighlighter):
+    parser = PythonParser
 
-        comment_format = QTextCharFormat()
-        comment_format.setForeground(QColor("#6272a4"))
-        self.rules.append((QRegExp(r'//.*'), comment_format))
-        self.rules.append((QRegExp(r'/\*.*\*/'), comment_format))
 
-    def highlightBlock(self, text):
-        for pattern, fmt in self.rules:
-            index = pattern.indexIn(text)
-            while index >= 0:
-                length = pattern.matchedLength()
-                self.setFormat(index, length, fmt)
-                index = pattern.indexIn(text, index + length)
+class CTreeHighlighter(TreeHighlighter):
+    parser = CParser
+
 
 class DummyHighlighter(QSyntaxHighlighter):
     def __init__(self, document):
         super().__init__(document)
     def highlightBlock(self, text):
-        pass  
+        pass
+
+
+class HighlightScheduler(QObject):
+    def __init__(self, highlighter, editor):
+        super().__init__(highlighter)
+        self.highlighter = highlighter
+        self.editor = editor
+
+        highlighter.deferred = True
+        highlighter.ready_until = -1
+        highlighter.visible_range = self.viewport_blocks()
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(0)
+        self.timer.timeout.connect(self.highlight_slice)
+        self.timer.start()
+
+        editor.verticalScrollBar().valueChanged.connect(self.refresh_viewport)
+
+    def viewport_blocks(self):
+        first = self.editor.firstVisibleBlock().blockNumber()
+        line_height = max(1, self.editor.fontMetrics().lineSpacing())
+        return first, first + self.editor.viewport().height() // line_height + 1
+
+    def refresh_viewport(self, *args):
+        highlighter = self.highlighter
+        document = highlighter.document()
+        if document is None:
+            self.stop()
+            return
+        highlighter.visible_range = self.viewport_blocks()
+        first, last = highlighter.visible_range
+        for number in range(max(first, highlighter.ready_until + 1), last + 1):
+            block = document.findBlockByNumber(number)
+            if not block.isValid():
+                break
+            highlighter.rehighlightBlock(block)
+
+    @timed("highlight slice")
+    def highlight_slice(self):
+        highlighter = self.highlighter
+        document = highlighter.document()
+        if document is None:
+            self.stop()
+            return
+
+        deadline = time.perf_counter() + SLICE_BUDGET_MS / 1000
+        # Look the block up by number each slice since edits may have
+        # replaced the block objects since the last one
+        block = document.findBlockByNumber(highlighter.ready_until + 1)
+        while block.isValid():
+            highlighter.ready_until = block.blockNumber()
+            highlighter.rehighlightBlock(block)
+            block = block.next()
+            if time.perf_counter() >= deadline:
+                return
+
+        self.stop()
+
+    def stop(self):
+        self.timer.stop()
+        self.highlighter.deferred = False
+        try:
+            self.editor.verticalScrollBar().valueChanged.disconnect(self.refresh_viewport)
+        except TypeError:
+            pass
+
+
+HIGHLIGHTERS = {
+    '.py': PythonTreeHighlighter,
+    '.c': CTreeHighlighter,
+    '.cpp': CTreeHighlighter,
+    '.h': CTreeHighlighter,
+}
+
+
+def highlighter_for_path(path):
+    if not path:
+        return DummyHighlighter
+    return HIGHLIGHTERS.get(os.path.splitext(path)[1].lower(), DummyHighlighter)
+
+
+def attach_highlighter(cls, editor):
+    document = editor.document()
+
+    # Highlighters are parented to the document, so an old one keeps running
+    # until it is explicitly detached
+    previous = getattr(editor, "highlighter", None)
+    if previous is not None:
+        previous.setDocument(None)
+        previous.deleteLater()
+
+    if editor.property("large_file") or document.characterCount() > HIGHLIGHT_SIZE_LIMIT:
+        cls = DummyHighlighter
+
+    if issubclass(cls, TreeHighlighter):
+        # The tree is connected to contentsChange before the highlighter, so
+        # an edit has always been re-parsed by the time its blocks are redone
+        highlighter = cls(document, attach_syntax_tree(editor, cls.parser))
+    else:
+        highlighter = cls(document)
+    if isinstance(highlighter, TreeHighlighter) and document.blockCount() > PROGRESSIVE_BLOCK_THRESHOLD:
+        highlighter.scheduler = HighlightScheduler(highlighter, editor)
+
+    editor.highlighter = highlighter
+    return highlighter
@@ -1,18 +1,49 @@
+from startup import startup_trace
 import sys
 from pathlib import Path
 from datetime import datetime
-import subprocess 
 import os 
-import shlex
+import time
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
-    QPlainTextEdit, QLabel, QFileDialog, QTreeWidget, QTreeWidgetItem,
+    QLabel, QFileDialog, QTreeWidget, QTreeWidgetItem,
     QSplitter, QMessageBox, QAction, QMenuBar, QLineEdit, QPushButton,
-    QTabWidget
+    QTabWidget, QProgressBar, QInputDialog
 )
-from PyQt5.QtCore import Qt, QProcess, QIODevice, QByteArray
-from highlighter import PythonHighlighter, CHighlighter, DummyHighlighter
+from PyQt5.QtCore import Qt, QTimer, QEvent
+from PyQt5.QtGui import QTextCursor
+from highlighter import DummyHighlighter, attach_highlighter, highlighter_for_path
 from codeeditor import CodeEditor
+from syntax import attach_syntax_tree, detach_syntax_tree, parser_for_path
+from documents import DocumentRegistry, TAB_MEMORY_BUDGET, MB
+from fileio import FileLoader, FileSaver, PIECE_TABLE_THRESHOLD
+from bufferview import BufferView
+from fileindex import FileIndex
+from quickopen import QuickOpenDialog
+from searchpanel import SearchPanel
+from trigramindex import TrigramIndex
+from symbolindex import SymbolIndex
+from outline import OutlinePanel
+from diagnostics import DiagnosticsService
+from profiler import profiler, timed
+from session import load_session, save_session, load_tree_snapshot, save_tree_snapshot
+from filetree import DirectoryScanner, TreeWatcher, DEFAULT_IGNORE_PATTERNS, FRAME_INTERVAL_MS
+
+startup_trace.mark("imports")
+
+TREE_PATH_ROLE = Qt.UserRole
+TREE_IS_DIR_ROLE = Qt.UserRole + 1
+TREE_LOADED_ROLE = Qt.UserRole + 2
+
+CONSOLE_STYLE = """
+    QPlainTextEdit {
+        background-color: #1e1f29;
+        color: #50fa7b;
+        font-family: Consolas, Courier, monospace;
+        font-size: 13px;
+        padding: 10px;
+    }
+"""
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -20,10 +51,34 @@ class MainWindow(QMainWindow):
         self.setWindowTitle("AidanIDE")
         self.showMaximized()
         self.default_save_load_path = str(Path.home())
-        self.process = None
         self.current_dir = os.getcwd()
         self.env = os.environ.copy()
+        self.documents = DocumentRegistry(self)
+        self.documents.dirty_changed.connect(self.update_tab_title)
+        self.tab_memory_budget = TAB_MEMORY_BUDGET
+        self.file_saver = FileSaver(self)
+        self.file_saver.saved.connect(self.save_finished)
+        self.file_saver.failed.connect(self.save_failed)
+        self.tree_ignore_patterns = list(DEFAULT_IGNORE_PATTERNS)
+        self.project_root = None
+        self.file_index = FileIndex(self)
+        self.content_index = TrigramIndex(self)
+        self.symbol_index = SymbolIndex(self)
+        self.diagnostics = DiagnosticsService(self)
+        self.diagnostics.diagnostics_changed.connect(self.update_diagnostics_status)
+        self.tree_items = {}
+        self.tree_scanner = DirectoryScanner(self)
+        self.tree_scanner.scanned.connect(self.queue_tree_update)
+        self.tree_watcher = TreeWatcher(self)
+        self.tree_watcher.directories_changed.connect(self.refresh_tree_dirs)
+        self.pending_tree_updates = {}
+        self.tree_update_timer = QTimer(self)
+        self.tree_update_timer.setSingleShot(True)
+        self.tree_update_timer.setInterval(FRAME_INTERVAL_MS)
+        self.tree_update_timer.timeout.connect(self.apply_tree_updates)
+        startup_trace.mark("services")
         self.init_ui()
+        self.installEventFilter(self)
 
     def init_ui(self):
         main_widget = QWidget()
@@ -32,6 +87,7 @@ class MainWindow(QMainWindow):
         self.tabs = QTabWidget()
         self.tabs.setTabsClosable(True)
         self.tabs.tabCloseRequested.connect(self.close_tab)
+        self.tabs.currentChanged.connect(self.tab_changed)
 
         self.toggle_sidebar_btn = QPushButton("☰")
         self.toggle_sidebar_btn.setFixedWidth(30)
@@ -59,20 +115,31 @@ class MainWindow(QMainWindow):
         self.sidebar.setHeaderHidden(True)
         self.sidebar.setFixedWidth(250)
         self.sidebar.itemDoubleClicked.connect(self.load_file_from_tree)
+        self.sidebar.itemExpanded.connect(self.request_tree_scan)
+
+        self.search_panel = SearchPanel(self.tree_ignore_patterns, self.content_index, self.documents)
+        self.search_panel.open_requested.connect(self.open_in_editor)
+        self.search_panel.documents_replaced.connect(self.save_replaced_documents)
+        self.search_panel.files_replaced.connect(self.update_replaced_files)
+        self.search_panel.hide()
+
+        self.outline_panel = OutlinePanel()
+        self.outline_panel.line_requested.connect(self.go_to_current_line)
+        self.outline_panel.hide()
 
         sidebar_layout = QVBoxLayout()
         sidebar_layout.addWidget(self.toggle_sidebar_btn)
         sidebar_layout.addWidget(self.sidebar)
+        sidebar_layout.addWidget(self.search_panel)
+        sidebar_layout.addWidget(self.outline_panel)
 
         sidebar_widget = QWidget()
         sidebar_widget.setLayout(sidebar_layout)
+        startup_trace.mark("init_ui: sidebar")
 
         self.label = QLabel("Untitled")
-        self.current_file = None
 
-        # Create the first text edit when initializing
-        self.text_edit = CodeEditor()
-        self.text_edit.setStyleSheet("""
+        self.editor_style = """
             QPlainTextEdit {
                 background-color: #282a36;
                 color: #f8f8f2;
@@ -80,7 +147,7 @@ class MainWindow(QMainWindow):
                 font-size: 14px;
                 padding: 10px;
             }
-        """)
+        """
 
         self.syntax_toggle = QPushButton("✓ Syntax Highlighting")
         self.syntax_toggle.setCheckable(True)
@@ -107,69 +174,20 @@ class MainWindow(QMainWindow):
 
         editor_layout = QVBoxLayout()
         editor_layout.addLayout(label_layout)
-        editor_layout.addWidget(self.text_edit)
+        editor_layout.addWidget(self.tabs)
 
         editor_widget = QWidget()
         editor_widget.setLayout(editor_layout)
+        startup_trace.mark("init_ui: editor")
 
-        self.pwd_label = QLabel(f"PWD: {os.getcwd()}")
-        self.pwd_label.setStyleSheet("""
-            color: #50fa7b;
-            font-family: Consolas, Courier, monospace;
-            font-size: 13px;
-            padding: 5px;
-        """)
-
-        self.close_terminal = QPushButton("x")
-        self.close_terminal.setFixedWidth(25)
-        self.close_terminal.setStyleSheet("""
-            QPushButton {
-                background-color: #ff5555;
-                color: white;
-                border: none;
-                font-weight: bold;
-            }
-            QPushButton:hover {
-                background-color: #ff4444;
-            }
-        """)
-        self.close_terminal.clicked.connect(self.toggle_terminal)
-
-        pwd_layout = QHBoxLayout()
-        pwd_layout.addWidget(self.pwd_label)
-        pwd_layout.addStretch()
-        pwd_layout.addWidget(self.close_terminal)
-
-        self.terminal = QPlainTextEdit()
-        self.terminal.setReadOnly(True)
-        self.terminal.setStyleSheet("""
-            QPlainTextEdit {
-                background-color: #1e1f29;
-                color: #50fa7b;
-                font-family: Consolas, Courier, monospace;
-                font-size: 13px;
-                padding: 10px;
-            }
-        """)
-
-        self.terminal_input = QLineEdit()
-        self.terminal_input.returnPressed.connect(self.execute_command)
-
-        terminal_layout = QVBoxLayout()
-        terminal_layout.addLayout(pwd_layout)
-        terminal_layout.addWidget(self.terminal)
-        terminal_layout.addWidget(self.terminal_input)
-
-        terminal_widget = QWidget()
-        terminal_widget.setLayout(terminal_layout)
-        terminal_widget.hide()
-        self.terminal_widget = terminal_widget
-
+        # The terminal and the run panel are built the first time they are opened
         vertical_splitter = QSplitter(Qt.Vertical)
         vertical_splitter.addWidget(editor_widget)
-        vertical_splitter.addWidget(terminal_widget)
-        vertical_splitter.setSizes([800, 200])
         self.vertical_splitter = vertical_splitter
+        self.terminal_widget = None
+        self.terminals = None
+        self.run_panel = None
+        self.profiler_panel = None
 
         splitter = QSplitter(Qt.Horizontal)
         splitter.addWidget(sidebar_widget)
@@ -179,10 +197,13 @@ class MainWindow(QMainWindow):
         main_layout.addWidget(splitter)
         main_widget.setLayout(main_layout)
         self.setCentralWidget(main_widget)
+        startup_trace.mark("init_ui: layout")
 
         menu_bar = QMenuBar(self)
         file_menu = menu_bar.addMenu("File")
         terminal_menu = menu_bar.addMenu("Terminal")
+        run_menu = menu_bar.addMenu("Run")
+        view_menu = menu_bar.addMenu("View")
         help_menu = menu_bar.addMenu("Help")
 
         open_folder_action = QAction("Open Folder", self)
@@ -197,6 +218,22 @@ class MainWindow(QMainWindow):
         load_action.setShortcut("Ctrl+O")
         load_action.triggered.connect(self.load_note)
 
+        quick_open_action = QAction("Go to File", self)
+        quick_open_action.setShortcut("Ctrl+P")
+        quick_open_action.triggered.connect(self.quick_open)
+
+        go_to_definition_action = QAction("Go to Definition", self)
+        go_to_definition_action.setShortcut("F12")
+        go_to_definition_action.triggered.connect(self.go_to_definition)
+
+        find_in_files_action = QAction("Find in Files", self)
+        find_in_files_action.setShortcut("Ctrl+Shift+F")
+        find_in_files_action.triggered.connect(self.find_in_files)
+
+        replace_in_files_action = QAction("Replace in Files", self)
+        replace_in_files_action.setShortcut("Ctrl+Shift+H")
+        replace_in_files_action.triggered.connect(self.replace_in_files)
+
         new_file_action = QAction("New File", self)
         new_file_action.setShortcut("Ctrl+N")
         new_file_action.triggered.connect(self.new_file)
@@ -205,6 +242,48 @@ class MainWindow(QMainWindow):
         terminal_action.setShortcut("Ctrl+T")
         terminal_action.triggered.connect(self.toggle_terminal)
 
+        run_file_action = QAction("Run File", self)
+        run_file_action.setShortcut("F5")
+        run_file_action.triggered.connect(self.run_current_file)
+
+        run_task_action = QAction("Run Task…", self)
+        run_task_action.setShortcut("Ctrl+Shift+B")
+        run_task_action.triggered.connect(self.run_task)
+
+        stop_run_action = QAction("Stop", self)
+        stop_run_action.setShortcut("Shift+F5")
+        stop_run_action.triggered.connect(self.stop_run)
+
+        tab_memory_action = QAction("Tab Memory", self)
+        tab_memory_action.setShortcut("Ctrl+Shift+M")
+        tab_memory_action.triggered.connect(self.show_tab_memory)
+
+        tab_budget_action = QAction("Tab Memory Budget…", self)
+        tab_budget_action.triggered.connect(self.set_tab_memory_budget)
+
+        profiler_action = QAction("Profiler", self)
+        profiler_action.setShortcut("Ctrl+Shift+P")
+        profiler_action.triggered.connect(self.toggle_profiler)
+
+        diagnostics_latency_action = QAction("Diagnostics Latency", self)
+        diagnostics_latency_action.triggered.connect(self.show_diagnostics_latency)
+
+        outline_action = QAction("Outline", self)
+        outline_action.setShortcut("Ctrl+Shift+L")
+        outline_action.triggered.connect(self.toggle_outline)
+
+        jump_to_bracket_action = QAction("Go to Matching Bracket", self)
+        jump_to_bracket_action.setShortcut("Ctrl+Shift+\\")
+        jump_to_bracket_action.triggered.connect(self.jump_to_bracket)
+
+        toggle_fold_action = QAction("Toggle Fold", self)
+        toggle_fold_action.setShortcut("Ctrl+Shift+[")
+        toggle_fold_action.triggered.connect(self.toggle_fold)
+
+        unfold_all_action = QAction("Unfold All", self)
+        unfold_all_action.setShortcut("Ctrl+Shift+]")
+        unfold_all_action.triggered.connect(self.unfold_all)
+
         help_action = QAction("Show shortcuts", self)
         help_action.setShortcut("Ctrl+H")
         help_action.triggered.connect(self.show_shortcuts)
@@ -212,24 +291,79 @@ class MainWindow(QMainWindow):
         file_menu.addAction(open_folder_action)
         file_menu.addAction(save_action)
         file_menu.addAction(load_action)
+        file_menu.addAction(quick_open_action)
+        file_menu.addAction(go_to_definition_action)
+        file_menu.addAction(find_in_files_action)
+        file_menu.addAction(replace_in_files_action)
         file_menu.addAction(new_file_action)
+        new_terminal_action = QAction("New Terminal", self)
+        new_terminal_action.setShortcut("Ctrl+Shift+T")
+        new_terminal_action.triggered.connect(self.new_terminal)
+
+        cancel_command_action = QAction("Cancel Command", self)
+        cancel_command_action.setShortcut("Ctrl+Shift+C")
+        cancel_command_action.triggered.connect(self.cancel_command)
+
+        kill_command_action = QAction("Kill Command", self)
+        kill_command_action.setShortcut("Ctrl+Shift+K")
+        kill_command_action.triggered.connect(self.kill_command)
+
         terminal_menu.addAction(terminal_action)
+        terminal_menu.addAction(new_terminal_action)
+        terminal_menu.addAction(cancel_command_action)
+        terminal_menu.addAction(kill_command_action)
+        run_menu.addAction(run_file_action)
+        run_menu.addAction(run_task_action)
+        run_menu.addAction(stop_run_action)
+        view_menu.addAction(tab_memory_action)
+        view_menu.addAction(tab_budget_action)
+        view_menu.addAction(diagnostics_latency_action)
+        view_menu.addAction(profiler_action)
+        view_menu.addAction(outline_action)
+        view_menu.addAction(jump_to_bracket_action)
+        view_menu.addAction(toggle_fold_action)
+        view_menu.addAction(unfold_all_action)
         help_menu.addAction(help_action)
 
         self.setMenuBar(menu_bar)
+        startup_trace.mark("init_ui: menus")
+
+        self.load_progress = QProgressBar()
+        self.load_progress.setMaximumWidth(200)
+        self.load_progress.setTextVisible(False)
+        self.load_progress.hide()
+        self.statusBar().addPermanentWidget(self.load_progress)
+
+        self.diagnostics_label = QLabel()
+        self.statusBar().addPermanentWidget(self.diagnostics_label)
+
+        self.memory_label = QLabel()
+        self.statusBar().addPermanentWidget(self.memory_label)
+
+        self.new_file()
+        if profiler.enabled:
+            # Started with recording on, so stalls are watched for from here
+            self.init_profiler()
+        startup_trace.mark("init_ui: status bar")
+
+    def eventFilter(self, watched, event):
+        # Only installed until the window first paints
+        if watched is self and event.type() == QEvent.Paint:
+            self.removeEventFilter(self)
+            startup_trace.mark("first paint")
+            startup_trace.finish()
+            # Only now, so a large session never holds up the window
+            QTimer.singleShot(0, self.restore_session)
+        return super().eventFilter(watched, event)
 
     def closeEvent(self, event):
-        editor = self.tabs.currentWidget()
-        
-        if editor is None:
-            event.accept() 
-            return
+        # Files with a name are saved silently; untitled ones ask first
+        for document in self.documents.dirty_documents():
+            if document.path is not None:
+                self.save_document(document.editor)
+                continue
 
-        current_file = editor.property("file_path")
-        is_modified = editor.toPlainText() != editor.document().originalPlainText()
-
-        if current_file is None and is_modified:
-            # If no filename, prompt to save
+            self.tabs.setCurrentWidget(document.editor)
             reply = QMessageBox.question(
                 self,
                 "Save File",
@@ -237,50 +371,351 @@ class MainWindow(QMainWindow):
                 QMessageBox.Save | QMessageBox.Discard | QMessageBox.Cancel,
                 QMessageBox.Save
             )
-            
-            if reply == QMessageBox.Save:
-                self.save_note()
-                event.accept()
-            elif reply == QMessageBox.Discard:
-                event.accept()
-            else:
+
+            if reply == QMessageBox.Cancel:
                 event.ignore()
+                return
+            if reply == QMessageBox.Save and not self.save_document(document.editor):
+                event.ignore()
+                return
 
-        elif current_file is not None:
-            # If file already has a name, auto-save
-            self.save_note()
-            event.accept()
+        # Buffers always have a path
+        for view in self.buffers():
+            if view.is_modified():
+                self.save_buffer(view)
+
+        self.save_session()
+        self.file_saver.wait()
+        # Shells are ended rather than left running past the window
+        if self.terminals is not None:
+            self.terminals.close_all()
+        event.accept()
+
+    def save_session(self):
+        tabs = []
+        active = 0
+        for index in range(self.tabs.count()):
+            widget = self.tabs.widget(index)
+            document = self.documents.get(widget)
+            if isinstance(widget, BufferView):
+                tab = {'path': widget.path, 'line': widget.line + 1, 'column': widget.column}
+            elif document is None or document.path is None:
+                continue
+            else:
+                position, scroll = document.view_state()
+                tab = {'path': document.path, 'position': position, 'scroll': scroll}
+            if index == self.tabs.currentIndex():
+                active = len(tabs)
+            tabs.append(tab)
+
+        save_session({
+            'root': self.project_root,
+            'expanded': [path for path, item in self.tree_items.items() if item.isExpanded()],
+            'tabs': tabs,
+            'active': active,
+        })
+        if self.project_root is not None:
+            save_tree_snapshot(self.project_root, {
+                path: [
+                    (item.child(i).text(0), bool(item.child(i).data(0, TREE_IS_DIR_ROLE)))
+                    for i in range(item.childCount())
+                ]
+                for path, item in self.tree_items.items() if item.data(0, TREE_LOADED_ROLE)
+            })
+
+    def restore_session(self):
+        # Only the active tab is read from disk here; the rest are opened
+        # unloaded and load the first time they are switched to
+        state = load_session()
+        if state is None:
+            return
 
-        else:
-            # No changes to save, just close
-            event.accept()
+        root = state.get('root')
+        if isinstance(root, str) and os.path.isdir(root):
+            self.set_project_root(root, load_tree_snapshot(root), state.get('expanded') or [])
+
+        placeholder = self.current_editor()
+        restored = []
+        active = None
+        for index, tab in enumerate(state.get('tabs') or []):
+            try:
+                path = tab['path']
+                position = int(tab.get('position', 0))
+                scroll = int(tab.get('scroll', 0))
+                line = int(tab.get('line', 1))
+                column = int(tab.get('column', 0))
+            except (KeyError, TypeError, ValueError, AttributeError):
+                continue
+            if not isinstance(path, str) or not os.path.isfile(path) or self.documents.find(path):
+                continue
+            if self.find_buffer(path) is not None:
+                continue
+            if os.path.getsize(path) > PIECE_TABLE_THRESHOLD:
+                # Opening only maps the file and counts its lines, so there
+                # is nothing to defer
+                editor = self.open_buffer(path, line, column)
+                if editor is None:
+                    continue
+            else:
+                editor = self.create_editor(path)
+                self.documents.get(editor).defer_load(position, scroll)
+            restored.append(editor)
+            if index == state.get('active'):
+                active = editor
+
+        if not restored:
+            return
+        self.tabs.setCurrentWidget(active or restored[0])
+
+        document = self.documents.get(placeholder)
+        if document is not None and document.path is None and placeholder.document().isEmpty():
+            self.close_tab(self.tabs.indexOf(placeholder))
+
+    def shutdown(self):
+        # Background work delivers its results to these objects, so it has
+        # to finish before they are destroyed
+        self.search_panel.search.wait()
+        self.search_panel.replace.wait()
+        if self.run_panel is not None:
+            self.run_panel.shutdown()
+        if self.profiler_panel is not None:
+            self.profiler_panel.shutdown()
+        self.diagnostics.wait()
+        self.outline_panel.wait()
+        self.content_index.wait()
+        self.symbol_index.wait()
+        self.file_index.wait()
 
     def toggle_sidebar(self):
         self.sidebar.setVisible(self.toggle_sidebar_btn.isChecked())
 
     def new_file(self):
-        current_editor = self.tabs.currentWidget()
-        if current_editor and current_editor.toPlainText():
-            reply = QMessageBox.question(
-                self,
-                "Confirm",
-                "Discard current note and start a new one?",
-                QMessageBox.Yes | QMessageBox.No,
-                QMessageBox.No
-            )
-            if reply == QMessageBox.No:
-                return
+        editor = self.create_editor()
+        editor.setPlaceholderText("Start typing your note here...")
+        self.tabs.setCurrentWidget(editor)
 
+    def create_editor(self, path=None):
         editor = CodeEditor()
-        editor.setPlaceholderText("Start typing your note here...")
-        editor.setProperty("file_path", None)
-        PythonHighlighter(editor.document())
+        editor.setStyleSheet(self.editor_style)
+        self.documents.register(editor, path)
+        self.tabs.addTab(editor, Path(path).name if path else "Untitled")
+        return editor
+
+    def current_editor(self):
+        # Buffer views have no QTextDocument, so editor actions skip them
+        widget = self.tabs.currentWidget()
+        return widget if isinstance(widget, CodeEditor) else None
+
+    def buffers(self):
+        return [
+            widget for widget in map(self.tabs.widget, range(self.tabs.count()))
+            if isinstance(widget, BufferView)
+        ]
+
+    def find_buffer(self, path):
+        for view in self.buffers():
+            if view.same_file(path):
+                return view
+        return None
+
+    def open_buffer(self, path, line=None, column=0):
+        try:
+            view = BufferView.open(path)
+        except (OSError, ValueError) as e:
+            QMessageBox.critical(self, "Error Loading File", str(e))
+            return None
+        view.modificationChanged.connect(lambda modified: self.update_buffer_title(view))
+        self.tabs.addTab(view, view.name)
+        self.tabs.setCurrentWidget(view)
+        if line is not None:
+            view.go_to_line(line, column)
+        return view
+
+    def update_buffer_title(self, view):
+        index = self.tabs.indexOf(view)
+        if index >= 0:
+            self.tabs.setTabText(index, view.name + (" •" if view.is_modified() else ""))
+
+    def current_document(self):
+        return self.documents.get(self.tabs.currentWidget())
+
+    def tab_changed(self, index):
+        widget = self.tabs.widget(index)
+        document = self.documents.get(widget)
+        if document is None:
+            self.label.setText(widget.name if isinstance(widget, BufferView) else "")
+            self.outline_panel.set_editor(None, None)
+            self.diagnostics_label.clear()
+            return
+        self.outline_panel.set_editor(document.editor, document.path)
+        self.update_diagnostics_status(document.editor)
+        self.label.setText(document.name)
+        self.syntax_toggle.setChecked(document.syntax_enabled)
+        # Touched first, so the budget enforced once the text is back never
+        # picks this document to hibernate again
+        self.documents.touch(document)
+        if document.hibernated is not None:
+            self.restore_document(document)
+        self.enforce_tab_budget()
+
+    def restore_document(self, document, enforce_budget=True):
+        editor = document.editor
+        state = document.thaw()
+
+        def restored():
+            self.apply_highlighter(document, document.syntax_enabled)
+            cursor = editor.textCursor()
+            cursor.setPosition(min(state.position, editor.document().characterCount() - 1))
+            editor.setTextCursor(cursor)
+            editor.verticalScrollBar().setValue(state.scroll)
+            if enforce_budget:
+                self.enforce_tab_budget()
+
+        if state.text is not None:
+            restored()
+        else:
+            self.stream_file(editor, document.path, restored)
+
+    def enforce_tab_budget(self):
+        self.documents.enforce_budget(self.tab_memory_budget)
+        self.update_memory_status()
+
+    def update_memory_status(self):
+        usage = self.documents.memory_usage()
+        self.memory_label.setText(
+            f"Tabs: {usage / MB:.1f} / {self.tab_memory_budget / MB:.0f} MB"
+        )
+
+    def show_tab_memory(self):
+        lines = []
+        for document in self.documents.recent[::-1]:
+            if document.hibernated is None:
+                state = "live"
+            elif document.hibernated.text is not None:
+                state = "compressed"
+            else:
+                state = "unloaded"
+            lines.append(f"{document.name} — {document.memory_usage() / MB:.2f} MB ({state})")
+        lines.append("")
+        lines.append(f"Total: {self.documents.memory_usage() / MB:.1f} MB of {self.tab_memory_budget / MB:.0f} MB")
+        QMessageBox.information(self, "Tab Memory", "\n".join(lines))
+
+    def set_tab_memory_budget(self):
+        budget, accepted = QInputDialog.getInt(
+            self, "Tab Memory Budget", "Memory for open tabs (MB):",
+            self.tab_memory_budget // MB, 16, 65536
+        )
+        if accepted:
+            self.tab_memory_budget = budget * MB
+            self.enforce_tab_budget()
+
+    def update_diagnostics_status(self, editor):
+        if editor is not self.current_editor():
+            return
+        state = self.diagnostics.states.get(editor)
+        if state is None or state.checker is None:
+            self.diagnostics_label.clear()
+            return
+        counts = {}
+        for diagnostic in state.diagnostics:
+            counts[diagnostic.severity] = counts.get(diagnostic.severity, 0) + 1
+        summary = ", ".join(f"{count} {severity}s" for severity, count in counts.items()) or "No problems"
+        if state.latency is not None:
+            summary += f" ({state.checker.__name__} {state.latency:.1f} ms)"
+        self.diagnostics_label.setText(summary)
+
+    def show_diagnostics_latency(self):
+        # Slowest checker first, so one holding up feedback stands out
+        summary = sorted(self.diagnostics.latency_summary().items(), key=lambda item: -item[1][1])
+        lines = [
+            f"{name} — {checks} checks, median {median:.1f} ms, worst {worst:.1f} ms, "
+            f"median {total:.1f} ms including the queue"
+            for name, (checks, median, worst, total) in summary
+        ]
+        QMessageBox.information(self, "Diagnostics Latency", "\n".join(lines) or "No checks have run yet")
+
+    def update_tab_title(self, editor):
+        document = self.documents.get(editor)
+        index = self.tabs.indexOf(editor)
+        if document is not None and index >= 0:
+            self.tabs.setTabText(index, document.name + (" •" if document.is_dirty() else ""))
+
+    def init_terminal(self):
+        self.pwd_label = QLabel(f"PWD: {self.current_dir}")
+        self.pwd_label.setStyleSheet("""
+            color: #50fa7b;
+            font-family: Consolas, Courier, monospace;
+            font-size: 13px;
+            padding: 5px;
+        """)
+
+        self.close_terminal = QPushButton("x")
+        self.close_terminal.setFixedWidth(25)
+        self.close_terminal.setStyleSheet("""
+            QPushButton {
+                background-color: #ff5555;
+                color: white;
+                border: none;
+                font-weight: bold;
+            }
+            QPushButton:hover {
+                background-color: #ff4444;
+            }
+        """)
+        self.close_terminal.clicked.connect(self.toggle_terminal)
+
+        self.new_terminal_btn = QPushButton("+")
+        self.new_terminal_btn.setFixedWidth(25)
+        self.new_terminal_btn.setToolTip("New terminal")
+        self.new_terminal_btn.clicked.connect(lambda: self.terminals.new_session())
+
+        self.cancel_command_btn = QPushButton("Cancel")
+        self.cancel_command_btn.setToolTip("Interrupt the running command and drop queued ones")
+        self.cancel_command_btn.clicked.connect(self.cancel_command)
+
+        self.kill_command_btn = QPushButton("Kill")
+        self.kill_command_btn.setToolTip("Kill the running command")
+        self.kill_command_btn.clicked.connect(self.kill_command)
+
+        pwd_layout = QHBoxLayout()
+        pwd_layout.addWidget(self.pwd_label)
+        pwd_layout.addStretch()
+        pwd_layout.addWidget(self.new_terminal_btn)
+        pwd_layout.addWidget(self.cancel_command_btn)
+        pwd_layout.addWidget(self.kill_command_btn)
+        pwd_layout.addWidget(self.close_terminal)
+
+        from terminal import TerminalManager
 
-        index = self.tabs.addTab(editor, "Untitled")
-        self.tabs.setCurrentIndex(index)
-        self.label.setText("Untitled")
+        self.terminal_tabs = QTabWidget()
+        self.terminals = TerminalManager(
+            self.terminal_tabs,
+            self.current_dir,
+            self.env,
+            style_sheet=CONSOLE_STYLE,
+            parent=self
+        )
+        self.terminals.cwd_changed.connect(self.terminal_cwd_changed)
+
+        self.terminal_input = QLineEdit()
+        self.terminal_input.returnPressed.connect(self.execute_command)
+
+        terminal_layout = QVBoxLayout()
+        terminal_layout.addLayout(pwd_layout)
+        terminal_layout.addWidget(self.terminal_tabs)
+        terminal_layout.addWidget(self.terminal_input)
+
+        terminal_widget = QWidget()
+        terminal_widget.setLayout(terminal_layout)
+        self.terminal_widget = terminal_widget
+
+        self.vertical_splitter.addWidget(terminal_widget)
+        self.vertical_splitter.setSizes([800, 200])
+        terminal_widget.hide()
 
     def toggle_terminal(self):
+        if self.terminal_widget is None:
+            self.init_terminal()
         if self.terminal_widget.isVisible():
             self.last_splitter_sizes = self.vertical_splitter.sizes()
             self.terminal_widget.hide()
@@ -291,82 +726,191 @@ class MainWindow(QMainWindow):
 
     def execute_command(self):
         command = self.terminal_input.text()
-        self.terminal.appendPlainText(f"$ {command}")
         self.terminal_input.clear()
 
-        # Special handling for directory change
-        if command.startswith('cd '):
-            try:
-                new_dir = command.split(' ', 1)[1]
-                new_path = os.path.expanduser(new_dir)
-                os.chdir(new_path)
-                current_dir = os.getcwd()
-
-                self.pwd_label.setText(f"PWD: {current_dir}")
-                return
-            except Exception as e:
-                self.terminal.appendPlainText(f"Error changing directory: {str(e)}")
-                return
-
-        # Existing QProcess setup
-        if self.process is None:
-            self.process = QProcess()
-            self.process.readyReadStandardOutput.connect(self.handle_stdout)
-            self.process.readyReadStandardError.connect(self.handle_stderr)
-            self.process.finished.connect(self.process_finished)
-
-        # Start the process with shell=True to handle complex commands
-        self.process.start('bash', ['-c', command])
-
-    def handle_stdout(self):
-        data = self.process.readAllStandardOutput()
-        stdout = bytes(data).decode("utf8")
-        self.terminal.appendPlainText(stdout)
+        # Each terminal tab has its own long-lived shell, output buffer and
+        # cwd; commands sent while one is busy wait in that tab's queue
+        self.terminals.run(command)
+
+    def new_terminal(self):
+        if self.terminal_widget is None or not self.terminal_widget.isVisible():
+            self.toggle_terminal()
+        self.terminals.new_session()
+
+    def cancel_command(self):
+        if self.terminals is not None:
+            self.terminals.cancel()
+
+    def kill_command(self):
+        if self.terminals is not None:
+            self.terminals.kill()
+
+    def init_run_panel(self):
+        from runpanel import RunPanel
+
+        self.run_panel = RunPanel(self.env, CONSOLE_STYLE)
+        self.run_panel.open_requested.connect(self.open_in_editor)
+        self.run_panel.close_requested.connect(self.run_panel.hide)
+        self.vertical_splitter.addWidget(self.run_panel)
+
+    def init_profiler(self):
+        from profilerpanel import ProfilerPanel
+
+        self.profiler_panel = ProfilerPanel(self)
+
+    def toggle_profiler(self):
+        if self.profiler_panel is None:
+            self.init_profiler()
+        self.profiler_panel.setVisible(not self.profiler_panel.isVisible())
+
+    def show_run_panel(self):
+        if self.run_panel is None:
+            self.init_run_panel()
+        if not self.run_panel.isVisible():
+            self.run_panel.show()
+            sizes = self.vertical_splitter.sizes()
+            self.vertical_splitter.setSizes(sizes[:-1] + [max(sizes[-1], 200)])
+        return self.run_panel
+
+    def run_current_file(self):
+        from runner import runnable
+
+        editor = self.current_editor()
+        document = self.documents.get(editor)
+        if document is None or document.path is None:
+            self.statusBar().showMessage("Save the file before running it", 3000)
+            return
+        if not runnable(document.path):
+            self.statusBar().showMessage(f"No way to run {document.name}", 3000)
+            return
+        # The run reads the file from disk, so unsaved edits are written first
+        if document.is_dirty():
+            self.save_document(editor)
+            self.file_saver.wait()
+        self.show_run_panel().run_file(document.path)
+
+    def run_task(self):
+        from runner import load_tasks, TASKS_FILE
+
+        root = self.project_root or self.current_dir
+        tasks = load_tasks(root)
+        if not tasks:
+            self.statusBar().showMessage(f"No tasks in {os.path.join(root, TASKS_FILE)}", 3000)
+            return
+        labels = [f"{task.name} — {task.command}" for task in tasks]
+        label, accepted = QInputDialog.getItem(self, "Run Task", "Task:", labels, 0, False)
+        if accepted:
+            self.save_all_documents()
+            self.show_run_panel().run_task(tasks[labels.index(label)])
+
+    def save_all_documents(self):
+        # Tasks can build any file, so every named document is saved first.
+        # Hibernated tabs are written from their compressed text and stay
+        # hibernated, rather than all being brought back at once.
+        for document in self.documents.dirty_documents():
+            if document.path is None:
+                continue
+            if document.hibernated is not None:
+                document.mark_clean()
+                self.update_tab_title(document.editor)
+                self.file_saver.save(document.path, document.hibernated_text(), document.encoding)
+            else:
+                self.save_document(document.editor)
+        self.file_saver.wait()
 
-    def handle_stderr(self):
-        data = self.process.readAllStandardError()
-        stderr = bytes(data).decode("utf8")
-        self.terminal.appendPlainText(stderr)
+    def stop_run(self):
+        if self.run_panel is not None:
+            self.run_panel.runner.stop()
 
-    def process_finished(self):
-        self.process = None
+    def terminal_cwd_changed(self, cwd):
+        self.current_dir = cwd
+        self.pwd_label.setText(f"PWD: {cwd}")
 
     def save_note(self):
-            editor = self.text_edit
-            if not editor:
-                return
-
-            file_path = self.current_file
-            content = editor.toPlainText()
+        widget = self.tabs.currentWidget()
+        if isinstance(widget, BufferView):
+            self.save_buffer(widget)
+        elif widget is not None:
+            self.save_document(widget)
+
+    def save_buffer(self, view):
+        # The pieces are streamed out on the saver's thread; the text is
+        # never joined in memory
+        view.mark_saved()
+        if view is self.tabs.currentWidget():
+            self.label.setText(f"{view.name} (saving…)")
+        self.file_saver.save(view.path, view.table.chunks(), view.table.encoding)
+
+    @timed("save_note")
+    def save_document(self, editor):
+        document = self.documents.get(editor)
+        if document.hibernated is not None:
+            if not document.hibernated.dirty:
+                return True
+            # Enforcing the budget here could hibernate the document again
+            # before its text is read
+            self.restore_document(document, enforce_budget=False)
+        file_path = document.path
+
+        if not file_path:
+            timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+            suggested_filename = f"note_{timestamp}.txt"
+            options = QFileDialog.Options()
+            options |= QFileDialog.DontUseNativeDialog
+
+            file_path, _ = QFileDialog.getSaveFileName(
+                self,
+                "Save Note",
+                str(Path(self.default_save_load_path) / suggested_filename),
+                "All Files (*);;Text Files (*.txt);;Python Files (*.py);;C/C++ Files (*.c *.cpp *.h)",
+                options=options
+            )
 
             if not file_path:
-                timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
-                suggested_filename = f"note_{timestamp}.txt"
-                options = QFileDialog.Options()
-                options |= QFileDialog.DontUseNativeDialog
-
-                file_path, _ = QFileDialog.getSaveFileName(
-                    self,
-                    "Save Note",
-                    str(Path(self.default_save_load_path) / suggested_filename),
-                    "All Files (*);;Text Files (*.txt);;Python Files (*.py);;C/C++ Files (*.c *.cpp *.h)",
-                    options=options
-                )
-
-                if not file_path:
-                    return
-
-                self.current_file = file_path
-
-            try:
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    f.write(content)
-
-                self.label.setText(Path(file_path).name)
-                editor.document().setModified(False)
-
-            except Exception as e:
-                QMessageBox.critical(self, "Error Saving File", str(e))
+                return False
+
+            self.documents.set_path(document, file_path)
+            self.update_tab_title(editor)
+
+        # The snapshot is written, fsynced and renamed into place on a worker
+        # thread; a failed write marks the document dirty again
+        content = editor.toPlainText()
+        document.mark_clean()
+        if editor is self.current_editor():
+            self.label.setText(f"{document.name} (saving…)")
+        self.file_saver.save(file_path, content, document.encoding)
+        return True
+
+    def save_finished(self, file_path, content_hash):
+        self.file_index.add_file(file_path)
+        self.content_index.update_file(file_path)
+        self.symbol_index.update_file(file_path)
+        document = self.documents.find(file_path)
+        if document is None:
+            view = self.find_buffer(file_path)
+            if view is not None and view is self.tabs.currentWidget():
+                self.label.setText(view.name)
+            return
+        document.content_hash = content_hash
+        if document.editor is self.current_editor():
+            self.label.setText(document.name)
+            # Saving an untitled note under a .py name gives it an outline
+            self.outline_panel.set_editor(document.editor, document.path)
+        self.diagnostics.watch(document.editor, document.path)
+
+    def save_failed(self, file_path, message):
+        document = self.documents.find(file_path)
+        if document is not None:
+            document.mark_dirty()
+            self.update_tab_title(document.editor)
+            if document.editor is self.current_editor():
+                self.label.setText(document.name)
+        view = self.find_buffer(file_path)
+        if view is not None:
+            view.mark_modified()
+            if view is self.tabs.currentWidget():
+                self.label.setText(view.name)
+        QMessageBox.critical(self, "Error Saving File", message)
 
     def load_note(self):
         options = QFileDialog.Options()
@@ -381,26 +925,96 @@ class MainWindow(QMainWindow):
         )
 
         if file_path:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-
-            editor = CodeEditor()
-            editor.setPlainText(content)
-            editor.setProperty("file_path", file_path)
-            PythonHighlighter(editor.document())
+            self.open_in_editor(file_path)
+
+    def stream_file(self, editor, file_path, on_loaded):
+        # The file is read and decoded on a worker thread and appended in
+        # chunks, so the whole file never exists as one Python string
+        previous = getattr(editor, "loader", None)
+        if previous is not None:
+            previous.cancel()
+
+        document_state = self.documents.get(editor)
+        try:
+            # Parented to the window rather than the editor, since a closed
+            # tab can be deleted while the worker is still on its last chunk;
+            # the loader deletes itself once the worker is done with it
+            loader = FileLoader(file_path, document_state.encoding, parent=self)
+        except OSError as e:
+            QMessageBox.critical(self, "Error Loading File", str(e))
+            return
+        editor.loader = loader
+        document_state.loading = True
+
+        document = editor.document()
+        editor.setProperty("large_file", loader.large_file)
+        attach_highlighter(DummyHighlighter, editor)
+        detach_syntax_tree(editor)
+        document.setUndoRedoEnabled(False)
+        editor.clear()
+        editor.setReadOnly(True)
+        cursor = QTextCursor(document)
+
+        def append_chunk(text):
+            if loader.cancelled:
+                return
+            cursor.movePosition(QTextCursor.End)
+            cursor.insertText(text)
 
-            index = self.tabs.addTab(editor, Path(file_path).name)
-            self.tabs.setCurrentIndex(index)
-            self.label.setText(Path(file_path).name)
-            self.toggle_syntax()
+        def load_finished():
+            if loader.cancelled:
+                return
+            editor.loader = None
+            editor.setReadOnly(False)
+            # Large files stay without an undo stack to keep memory close to the file size
+            document.setUndoRedoEnabled(not loader.large_file)
+            document_state.mark_clean(loader.content_hash)
+            editor.moveCursor(QTextCursor.Start)
+            self.load_progress.hide()
+            on_loaded()
+
+        def load_failed(message):
+            editor.loader = None
+            # Whatever did load is not treated as an edit to save back
+            document_state.mark_clean()
+            editor.setReadOnly(False)
+            self.load_progress.hide()
+            QMessageBox.critical(self, "Error Loading File", message)
+
+        loader.chunk_loaded.connect(append_chunk)
+        loader.progress.connect(self.show_load_progress)
+        loader.finished.connect(load_finished)
+        loader.failed.connect(load_failed)
+        loader.start()
+
+    def show_load_progress(self, done, total):
+        self.load_progress.setMaximum(max(total, 1))
+        self.load_progress.setValue(done)
+        self.load_progress.setVisible(done < total)
 
     def show_shortcuts(self):
         shortcuts = [
             "Ctrl+S — Save Note",
             "Ctrl+O — Load Note",
+            "Ctrl+P — Go to File",
+            "F12 — Go to Definition",
+            "Ctrl+Shift+F — Find in Files",
+            "Ctrl+Shift+H — Replace in Files",
+            "F5 — Run File",
+            "Ctrl+Shift+B — Run Task",
+            "Shift+F5 — Stop",
             "Ctrl+N — New File",
             "Ctrl+H — Show Shortcuts",
             "Ctrl+T — Toggle Terminal",
+            "Ctrl+Shift+T — New Terminal",
+            "Ctrl+Shift+C — Cancel Command",
+            "Ctrl+Shift+K — Kill Command",
+            "Ctrl+Shift+M — Tab Memory",
+            "Ctrl+Shift+P — Profiler",
+            "Ctrl+Shift+L — Outline",
+            "Ctrl+Shift+\\ — Go to Matching Bracket",
+            "Ctrl+Shift+[ — Toggle Fold",
+            "Ctrl+Shift+] — Unfold All",
         ]
         QMessageBox.information(
             self,
@@ -408,22 +1022,35 @@ class MainWindow(QMainWindow):
             "\n".join(shortcuts)
         )
 
+    def toggle_fold(self):
+        editor = self.current_editor()
+        if editor is not None:
+            editor.toggle_fold()
+
+    def unfold_all(self):
+        editor = self.current_editor()
+        if editor is not None:
+            editor.unfold_all()
+
+    def jump_to_bracket(self):
+        editor = self.current_editor()
+        if editor is not None:
+            editor.jump_to_bracket()
+
     def toggle_syntax(self):
-        if not self.syntax_toggle.isChecked():
-            self.highlighter = DummyHighlighter(self.text_edit.document())
+        editor = self.current_editor()
+        if editor is None:
             return
+        self.apply_highlighter(self.documents.get(editor), self.syntax_toggle.isChecked())
 
-        if self.current_file:
-            file_ext = Path(self.current_file).suffix.lower()
-        else:
-            file_ext = ''
-
-        if file_ext in [".py"]:
-            self.highlighter = PythonHighlighter(self.text_edit.document())
-        elif file_ext in [".c", ".cpp", ".h"]:
-            self.highlighter = CHighlighter(self.text_edit.document())
-        else:
-            self.highlighter = DummyHighlighter(self.text_edit.document())
+    def apply_highlighter(self, document, enabled=True):
+        document.syntax_enabled = enabled
+        document.highlighter = highlighter_for_path(document.path) if enabled else DummyHighlighter
+        attach_highlighter(document.highlighter, document.editor)
+        # Folding and bracket matching use the tree even with highlighting off
+        if not document.editor.property("large_file"):
+            attach_syntax_tree(document.editor, parser_for_path(document.path))
+        self.diagnostics.watch(document.editor, document.path)
 
     def open_folder(self):
         dialog = QFileDialog(self, "Open Folder")
@@ -442,38 +1069,315 @@ class MainWindow(QMainWindow):
 
         if dialog.exec_() == QFileDialog.Accepted:
             folder_path = dialog.selectedFiles()[0]
-            self.sidebar.clear()
-            self.build_tree(folder_path)
-
-    def build_tree(self, root_path):
-        def add_items(parent_item, path):
-            for entry in sorted(os.listdir(path)):
-                full_path = os.path.join(path, entry)
-                item = QTreeWidgetItem([entry])
-                item.setData(0, Qt.UserRole, full_path)
-                parent_item.addChild(item)
-                if os.path.isdir(full_path):
-                    add_items(item, full_path)
-        root_item = QTreeWidgetItem([os.path.basename(root_path)])
-        root_item.setData(0, Qt.UserRole, root_path)
+            self.set_project_root(folder_path)
+
+    def set_project_root(self, folder_path, snapshot=None, expanded=()):
+        self.project_root = folder_path
+        self.sidebar.clear()
+        self.build_tree(folder_path, snapshot, expanded)
+        self.file_index.open_root(folder_path, self.tree_ignore_patterns)
+        self.content_index.open_root(folder_path, self.tree_ignore_patterns)
+        self.symbol_index.open_root(folder_path, self.tree_ignore_patterns)
+        self.search_panel.set_root(folder_path)
+
+    def quick_open(self):
+        dialog = QuickOpenDialog(self.file_index, self)
+        if dialog.exec_() == QuickOpenDialog.Accepted and dialog.selected_path:
+            self.open_in_editor(dialog.selected_path)
+
+    def toggle_outline(self):
+        self.outline_panel.setVisible(not self.outline_panel.isVisible())
+
+    def go_to_definition(self):
+        editor = self.current_editor()
+        if editor is None:
+            return
+        cursor = editor.textCursor()
+        cursor.select(QTextCursor.WordUnderCursor)
+        name = cursor.selectedText()
+        if not name.isidentifier():
+            return
+
+        # The open file's own definitions come from its current text, so
+        # they are right even before it is saved; the project index covers
+        # every other file
+        started = time.perf_counter()
+        document = self.documents.get(editor)
+        path = os.path.abspath(document.path) if document.path else None
+        locations = []
+        if self.outline_panel.editor is editor:
+            locations = [(path, symbol) for symbol in self.outline_panel.definitions(name)]
+        local = bool(locations)
+        for other_path, symbol in self.symbol_index.lookup(name):
+            if not (local and other_path == path):
+                locations.append((other_path, symbol))
+        elapsed = (time.perf_counter() - started) * 1000
+
+        if not locations:
+            self.statusBar().showMessage(f"No definition found for {name} ({elapsed:.1f} ms)", 3000)
+            return
+        self.statusBar().showMessage(f"{len(locations)} definitions of {name} ({elapsed:.1f} ms)", 3000)
+
+        if len(locations) > 1:
+            labels = [
+                f"{self.display_path(location_path)}:{symbol.line} — {symbol.kind} "
+                f"{symbol.container + '.' if symbol.container else ''}{symbol.name}"
+                for location_path, symbol in locations
+            ]
+            label, accepted = QInputDialog.getItem(self, "Go to Definition", name, labels, 0, False)
+            if not accepted:
+                return
+            locations = [locations[labels.index(label)]]
+
+        location_path, symbol = locations[0]
+        if location_path is None or location_path == path:
+            self.go_to_line(editor, symbol.line, symbol.column)
+        else:
+            self.open_in_editor(location_path, symbol.line, symbol.column)
+
+    def display_path(self, path):
+        if path is None:
+            return "Untitled"
+        if self.project_root is not None:
+            rel_path = os.path.relpath(path, self.project_root)
+            if not rel_path.startswith('..'):
+                return rel_path
+        return path
+
+    def go_to_current_line(self, line, column):
+        editor = self.current_editor()
+        if editor is not None:
+            self.go_to_line(editor, line, column)
+
+    def find_in_files(self):
+        if self.search_panel.isVisible() and self.search_panel.query_input.hasFocus():
+            self.search_panel.hide()
+            return
+        self.search_panel.show()
+        self.search_panel.query_input.setFocus()
+        self.search_panel.query_input.selectAll()
+
+    def replace_in_files(self):
+        panel = self.search_panel
+        panel.show()
+        # Straight to the replacement when there is already a query
+        field = panel.replace_input if panel.query_input.text() else panel.query_input
+        field.setFocus()
+        field.selectAll()
+
+    def save_replaced_documents(self, editors):
+        for editor in editors:
+            self.save_document(editor)
+
+    def update_replaced_files(self, paths):
+        # Saved tabs update the indexes from save_finished; these were
+        # written by the replace workers
+        for path in paths:
+            self.content_index.update_file(path)
+            self.symbol_index.update_file(path)
+
+    @timed("build_tree")
+    def build_tree(self, root_path, snapshot=None, expanded=()):
+        # Only the root level is listed up front; every other directory is
+        # scanned on a worker thread the first time it is expanded
+        self.tree_items = {}
+        self.pending_tree_updates = {}
+        self.tree_watcher.clear()
+        self.tree_scanner.set_root(root_path, self.tree_ignore_patterns)
+        root_item = self.make_tree_item(os.path.basename(root_path), root_path, True)
         self.sidebar.addTopLevelItem(root_item)
-        add_items(root_item, root_path)
+        if snapshot:
+            self.restore_tree_snapshot(snapshot, expanded)
         root_item.setExpanded(True)
+        self.request_tree_scan(root_item)
+
+    def restore_tree_snapshot(self, snapshot, expanded):
+        # The cached listings are shown straight away and every directory in
+        # them is rescanned in the background; the usual patching then fixes
+        # up whatever changed on disk since the snapshot was taken
+        paths = sorted(snapshot)
+        self.sidebar.setUpdatesEnabled(False)
+        try:
+            # Sorted, so a directory is always listed before its subdirectories
+            for path in paths:
+                item = self.tree_items.get(path)
+                if item is not None:
+                    item.setData(0, TREE_LOADED_ROLE, True)
+                    self.patch_tree_item(item, path, snapshot[path])
+            for path in expanded:
+                item = self.tree_items.get(path)
+                if item is not None:
+                    item.setExpanded(True)
+        finally:
+            self.sidebar.setUpdatesEnabled(True)
+
+        for path in paths:
+            if path in self.tree_items:
+                self.tree_scanner.scan(path)
+
+    def make_tree_item(self, name, full_path, is_dir):
+        item = QTreeWidgetItem([name])
+        item.setData(0, TREE_PATH_ROLE, full_path)
+        item.setData(0, TREE_IS_DIR_ROLE, is_dir)
+        if is_dir:
+            item.setChildIndicatorPolicy(QTreeWidgetItem.ShowIndicator)
+            self.tree_items[full_path] = item
+        return item
+
+    def request_tree_scan(self, item):
+        if not item.data(0, TREE_IS_DIR_ROLE) or item.data(0, TREE_LOADED_ROLE):
+            return
+        item.setData(0, TREE_LOADED_ROLE, True)
+        self.tree_scanner.scan(item.data(0, TREE_PATH_ROLE))
+
+    def refresh_tree_dirs(self, paths):
+        self.file_index.refresh_directories(paths)
+        self.content_index.schedule_rebuild()
+        self.symbol_index.schedule_rebuild()
+
+        # Only directories that were already listed need patching; the rest
+        # will be read fresh when they are first expanded
+        for path in paths:
+            item = self.tree_items.get(path)
+            if item is None or not item.data(0, TREE_LOADED_ROLE):
+                continue
+            if os.path.isdir(path):
+                self.tree_scanner.scan(path)
+            else:
+                self.queue_tree_update(path, [])
+
+    def queue_tree_update(self, path, entries):
+        self.pending_tree_updates[path] = entries
+        if not self.tree_update_timer.isActive():
+            self.tree_update_timer.start()
+
+    @timed("tree updates")
+    def apply_tree_updates(self):
+        updates = self.pending_tree_updates
+        self.pending_tree_updates = {}
+
+        self.sidebar.setUpdatesEnabled(False)
+        try:
+            for path in sorted(updates):
+                item = self.tree_items.get(path)
+                if item is None:
+                    # The tree was cleared or rebuilt while this scan was running
+                    continue
+                self.patch_tree_item(item, path, updates[path])
+        finally:
+            self.sidebar.setUpdatesEnabled(True)
+
+    def patch_tree_item(self, item, path, entries):
+        self.tree_watcher.watch(path)
+
+        if item.childCount() == 0:
+            item.addChildren([
+                self.make_tree_item(name, os.path.join(path, name), is_dir)
+                for name, is_dir in entries
+            ])
+        else:
+            # Children and entries share the same (name, is_dir) ordering, so
+            # removing stale children and then walking both lists together
+            # leaves untouched nodes (and their expansion state) alone
+            wanted = set(entries)
+            for i in reversed(range(item.childCount())):
+                child = item.child(i)
+                if (child.text(0), bool(child.data(0, TREE_IS_DIR_ROLE))) not in wanted:
+                    self.remove_tree_item(item, child)
+
+            for i, (name, is_dir) in enumerate(entries):
+                child = item.child(i)
+                if child is None or child.text(0) != name or bool(child.data(0, TREE_IS_DIR_ROLE)) != is_dir:
+                    item.insertChild(i, self.make_tree_item(name, os.path.join(path, name), is_dir))
+
+        if item.childCount() == 0:
+            item.setChildIndicatorPolicy(QTreeWidgetItem.DontShowIndicatorWhenChildless)
+        else:
+            item.setChildIndicatorPolicy(QTreeWidgetItem.ShowIndicator)
+
+    def remove_tree_item(self, parent, child):
+        path = child.data(0, TREE_PATH_ROLE)
+        if child.data(0, TREE_IS_DIR_ROLE):
+            prefix = path + os.sep
+            for known in [p for p in self.tree_items if p == path or p.startswith(prefix)]:
+                del self.tree_items[known]
+                self.tree_watcher.unwatch(known)
+        parent.removeChild(child)
 
     def load_file_from_tree(self, item, column):
-        path = item.data(0, Qt.UserRole)
-        if os.path.isfile(path):
-            with open(path, 'r') as f:
-                self.text_edit.setPlainText(f.read())
-            self.current_file = path
-            self.label.setText(Path(path).name)
-            self.toggle_syntax()
+        path = item.data(0, TREE_PATH_ROLE)
+        if not item.data(0, TREE_IS_DIR_ROLE):
+            self.open_in_editor(path)
+
+    def open_in_editor(self, path, line=None, column=0):
+        if not os.path.isfile(path):
+            return
+
+        view = self.find_buffer(path)
+        if view is not None:
+            self.tabs.setCurrentWidget(view)
+            if line is not None:
+                view.go_to_line(line, column)
+            return
+        if os.path.getsize(path) > PIECE_TABLE_THRESHOLD:
+            self.open_buffer(path, line, column)
+            return
+
+        document = self.documents.find(path)
+        if document is not None:
+            # Already open, so only the cursor has to move
+            self.tabs.setCurrentWidget(document.editor)
+            if line is None:
+                return
+            loader = getattr(document.editor, "loader", None)
+            if loader is None:
+                self.go_to_line(document.editor, line, column)
+            else:
+                # Still loading, or being reloaded after hibernation
+                loader.finished.connect(lambda: self.go_to_line(document.editor, line, column))
+            return
+
+        # An empty, untouched Untitled tab is reused instead of kept around
+        editor = self.current_editor()
+        document = self.documents.get(editor)
+        if document is not None and document.path is None and editor.document().isEmpty():
+            self.documents.set_path(document, path)
+            self.update_tab_title(editor)
+            self.outline_panel.set_editor(editor, path)
+        else:
+            editor = self.create_editor(path)
+            document = self.documents.get(editor)
+        self.tabs.setCurrentWidget(editor)
+        self.label.setText(document.name)
+
+        def loaded():
+            self.apply_highlighter(document, document.syntax_enabled)
+            if line is not None:
+                self.go_to_line(editor, line, column)
+            self.enforce_tab_budget()
+
+        self.stream_file(editor, path, loaded)
+
+    def go_to_line(self, editor, line, column=0):
+        block = editor.document().findBlockByNumber(max(line - 1, 0))
+        if not block.isValid():
+            return
+        cursor = QTextCursor(block)
+        cursor.movePosition(QTextCursor.Right, QTextCursor.MoveAnchor, min(column, block.length() - 1))
+        editor.setTextCursor(cursor)
+        editor.centerCursor()
+        editor.setFocus()
 
     def close_tab(self, index):
-        tab_widget = self.tabs.widget(index) 
-        current_file = tab_widget.property("file_path")
+        editor = self.tabs.widget(index)
+        document = self.documents.get(editor)
+        if isinstance(editor, BufferView):
+            dirty = editor.is_modified()
+        else:
+            dirty = document is not None and document.is_dirty()
 
-        if tab_widget.toPlainText() != tab_widget.document().originalPlainText():
+        if dirty:
+            self.tabs.setCurrentIndex(index)
             reply = QMessageBox.question(
                 self,
                 "Save File",
@@ -482,16 +1386,27 @@ class MainWindow(QMainWindow):
                 QMessageBox.Save
             )
 
-            if reply == QMessageBox.Save:
-                self.save_note()
-            elif reply == QMessageBox.Cancel:
+            if reply == QMessageBox.Cancel:
                 return
+            if reply == QMessageBox.Save:
+                if isinstance(editor, BufferView):
+                    self.save_buffer(editor)
+                elif not self.save_document(editor):
+                    return
+
+        loader = getattr(editor, "loader", None)
+        if loader is not None:
+            loader.cancel()
 
-        self.tabs.removeTab(index) 
+        self.diagnostics.unwatch(editor)
+        self.documents.remove(editor)
+        self.tabs.removeTab(self.tabs.indexOf(editor))
+        editor.deleteLater()
 
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
+    startup_trace.mark("QApplication")
 
     app.setStyleSheet("""
         QWidget {
@@ -534,6 +1449,10 @@ if __name__ == "__main__":
         }
     """)
 
+    startup_trace.mark("stylesheet")
+
     window = MainWindow()
+    app.aboutToQuit.connect(window.shutdown)
     window.show()
+    startup_trace.mark("show")
     sys.exit(app.exec_())
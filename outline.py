@@ -0,0 +1,152 @@
+from PyQt5.QtWidgets import QWidget, QVBoxLayout, QTreeWidget, QTreeWidgetItem, QLabel
+from PyQt5.QtCore import Qt, QObject, QRunnable, QThreadPool, QTimer, pyqtSignal
+from symbolindex import extractor_for_path
+
+OUTLINE_DELAY_MS = 300
+# Larger documents get no outline; parsing them would hold the GIL long
+# enough to stall typing
+OUTLINE_SIZE_LIMIT = 2 * 1024 * 1024
+SYMBOL_ROLE = Qt.UserRole
+KIND_LABELS = {
+    'class': 'C',
+    'function': 'ƒ',
+    'method': 'm',
+    'type': 'T',
+    'macro': '#',
+}
+
+
+class OutlineTask(QRunnable):
+    def __init__(self, signals, generation, extractor, text):
+        super().__init__()
+        self.signals = signals
+        self.generation = generation
+        self.extractor = extractor
+        self.text = text
+
+    def run(self):
+        self.signals.extracted.emit(self.generation, self.extractor(self.text))
+
+
+class OutlineSignals(QObject):
+    extracted = pyqtSignal(int, object)
+
+
+class OutlinePanel(QWidget):
+    line_requested = pyqtSignal(int, int)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.editor = None
+        self.path = None
+        self.generation = 0
+        # The definitions in the current editor's text as of the last parse,
+        # also what go to definition checks before the project index
+        self.symbols = []
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self.signals = OutlineSignals(self)
+        self.signals.extracted.connect(self.show_symbols)
+
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setSingleShot(True)
+        self.refresh_timer.setInterval(OUTLINE_DELAY_MS)
+        self.refresh_timer.timeout.connect(self.refresh)
+
+        self.tree = QTreeWidget()
+        self.tree.setHeaderHidden(True)
+        self.tree.itemActivated.connect(self.open_symbol)
+        self.tree.itemDoubleClicked.connect(self.open_symbol)
+
+        self.status = QLabel()
+        self.status.setStyleSheet("color: #6272a4;")
+
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.tree)
+        layout.addWidget(self.status)
+        self.setLayout(layout)
+
+    def set_editor(self, editor, path):
+        if editor is self.editor and path == self.path:
+            return
+        if self.editor is not None:
+            try:
+                self.editor.document().contentsChanged.disconnect(self.schedule_refresh)
+            except (TypeError, RuntimeError):
+                pass
+        self.editor = editor
+        self.path = path
+        if editor is not None:
+            editor.document().contentsChanged.connect(self.schedule_refresh)
+        self.refresh()
+
+    def schedule_refresh(self):
+        self.refresh_timer.start()
+
+    def refresh(self):
+        self.refresh_timer.stop()
+        self.generation += 1
+        extractor = extractor_for_path(self.path)
+        if self.editor is None or extractor is None:
+            self.show_symbols(self.generation, [], "No outline for this file")
+            return
+        document = self.editor.document()
+        if document.characterCount() > OUTLINE_SIZE_LIMIT:
+            self.show_symbols(self.generation, [], "File too large for an outline")
+            return
+        self.pool.start(OutlineTask(self.signals, self.generation, extractor, document.toPlainText()))
+
+    def wait(self):
+        self.refresh_timer.stop()
+        self.pool.waitForDone()
+
+    def show_symbols(self, generation, symbols, message=None):
+        if generation != self.generation:
+            return
+        # Expanded containers stay expanded across refreshes
+        expanded = set()
+        for item in self.items():
+            if item.isExpanded():
+                expanded.add(self.qualified_name(self.symbols[item.data(0, SYMBOL_ROLE)]))
+        self.symbols = symbols
+
+        self.tree.setUpdatesEnabled(False)
+        try:
+            self.tree.clear()
+            parents = {}
+            for index, symbol in enumerate(symbols):
+                item = QTreeWidgetItem([f"{KIND_LABELS.get(symbol.kind, '·')}  {symbol.name}"])
+                item.setData(0, SYMBOL_ROLE, index)
+                item.setToolTip(0, f"{symbol.kind} {self.qualified_name(symbol)}, line {symbol.line}")
+                parent = parents.get(symbol.container)
+                if parent is None:
+                    self.tree.addTopLevelItem(item)
+                else:
+                    parent.addChild(item)
+                qualified = self.qualified_name(symbol)
+                parents[qualified] = item
+                item.setExpanded(qualified in expanded or symbol.kind == 'class')
+        finally:
+            self.tree.setUpdatesEnabled(True)
+        self.status.setText(message or f"{len(symbols)} symbols")
+
+    def items(self):
+        stack = [self.tree.topLevelItem(i) for i in range(self.tree.topLevelItemCount())]
+        while stack:
+            item = stack.pop()
+            yield item
+            stack.extend(item.child(i) for i in range(item.childCount()))
+
+    @staticmethod
+    def qualified_name(symbol):
+        return symbol.container + '.' + symbol.name if symbol.container else symbol.name
+
+    def definitions(self, name):
+        return [symbol for symbol in self.symbols if symbol.name == name]
+
+    def open_symbol(self, item, column=0):
+        index = item.data(0, SYMBOL_ROLE)
+        if index is not None:
+            symbol = self.symbols[index]
+            self.line_requested.emit(symbol.line, symbol.column)
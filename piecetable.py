@@ -0,0 +1,297 @@
+import re
+import mmap
+import bisect
+from array import array
+from collections import namedtuple, OrderedDict
+
+# Newlines in the mapped file are counted per chunk when it is opened; the
+# offsets of the lines inside a chunk are only found once it is looked at
+LINE_CHUNK_SIZE = 64 * 1024
+CACHED_CHUNKS = 256
+READ_CHUNK_SIZE = 1024 * 1024
+UNDO_LIMIT = 1000
+
+NEWLINE = re.compile(b'\n')
+# Undecodable bytes round-trip as one lone surrogate each, so a character
+# column always maps back to the same byte offset
+ERRORS = 'surrogateescape'
+ESCAPED = re.compile('[\udc80-\udcff]')
+
+ORIGINAL = 0
+ADDED = 1
+
+# A run of bytes from the mapped file or the append buffer, with the number
+# of newlines in it so that lines can be found without reading the text
+Piece = namedtuple('Piece', ['source', 'start', 'length', 'newlines'])
+
+
+class OriginalText:
+    # The file as it was opened, mapped read-only. Saving writes a new file
+    # and renames it over this one, so the mapping keeps seeing the old
+    # contents for as long as pieces refer to them.
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            try:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files can't be mapped
+                self.map = b''
+        self.size = len(self.map)
+        counts = array('q', [0])
+        total = 0
+        for offset in range(0, self.size, LINE_CHUNK_SIZE):
+            total += self.map[offset:offset + LINE_CHUNK_SIZE].count(b'\n')
+            counts.append(total)
+        # Newlines before the start of each chunk
+        self.chunk_newlines = counts
+        self.chunk_lines = OrderedDict()
+
+    def read(self, start, end):
+        return self.map[start:end]
+
+    def count(self, start, end):
+        # Whole chunks come from the counts taken at open, so at most two
+        # partial chunks are read
+        if end - start <= 2 * LINE_CHUNK_SIZE:
+            return self.map[start:end].count(b'\n')
+        first = -(-start // LINE_CHUNK_SIZE)
+        last = end // LINE_CHUNK_SIZE
+        return (
+            self.map[start:first * LINE_CHUNK_SIZE].count(b'\n')
+            + self.chunk_newlines[last] - self.chunk_newlines[first]
+            + self.map[last * LINE_CHUNK_SIZE:end].count(b'\n')
+        )
+
+    def newline_offsets(self, chunk):
+        offsets = self.chunk_lines.get(chunk)
+        if offsets is None:
+            start = chunk * LINE_CHUNK_SIZE
+            data = self.map[start:start + LINE_CHUNK_SIZE]
+            offsets = array('q', (start + match.start() for match in NEWLINE.finditer(data)))
+            self.chunk_lines[chunk] = offsets
+            if len(self.chunk_lines) > CACHED_CHUNKS:
+                self.chunk_lines.popitem(last=False)
+        else:
+            self.chunk_lines.move_to_end(chunk)
+        return offsets
+
+    def nth_newline(self, start, n):
+        # Offset of the nth newline (from 0) at or after start
+        n += self.chunk_newlines[start // LINE_CHUNK_SIZE]
+        n += bisect.bisect_left(self.newline_offsets(start // LINE_CHUNK_SIZE), start)
+        chunk = bisect.bisect_right(self.chunk_newlines, n) - 1
+        offsets = self.newline_offsets(chunk)
+        return offsets[n - self.chunk_newlines[chunk]]
+
+
+class PieceTable:
+    # The text is the concatenation of the pieces. Edits only ever append
+    # to the add buffer and rearrange pieces, so the mapped file is never
+    # copied and an old piece list stays valid as an undo snapshot or for a
+    # save running on another thread.
+    def __init__(self, path=None, encoding='utf-8'):
+        self.path = path
+        self.encoding = encoding
+        self.original = OriginalText(path) if path else None
+        self.added = bytearray()
+        self.pieces = []
+        if self.original is not None and self.original.size:
+            self.pieces.append(Piece(ORIGINAL, 0, self.original.size, self.original.chunk_newlines[-1]))
+        self.undo_stack = []
+        self.redo_stack = []
+        # Bumped on every edit, undo and redo
+        self.revision = 0
+        self.offsets = None
+        self.line_counts = None
+
+    def memory_usage(self):
+        # The mapped file is paged in and out by the kernel and isn't counted
+        return len(self.added) + len(self.pieces) * 100
+
+    def index(self):
+        # Byte offset and number of newlines before each piece, rebuilt
+        # after an edit the first time anything needs them
+        if self.offsets is None:
+            offsets = [0]
+            line_counts = [0]
+            for piece in self.pieces:
+                offsets.append(offsets[-1] + piece.length)
+                line_counts.append(line_counts[-1] + piece.newlines)
+            self.offsets = offsets
+            self.line_counts = line_counts
+        return self.offsets, self.line_counts
+
+    def __len__(self):
+        return self.index()[0][-1]
+
+    def line_count(self):
+        return self.index()[1][-1] + 1
+
+    def piece_text(self, piece, start=0, end=None):
+        end = piece.length if end is None else end
+        if piece.source == ORIGINAL:
+            return self.original.read(piece.start + start, piece.start + end)
+        return bytes(self.added[piece.start + start:piece.start + end])
+
+    def count_newlines(self, source, start, end):
+        if source == ORIGINAL:
+            return self.original.count(start, end)
+        return self.added.count(b'\n', start, end)
+
+    def line_start(self, line):
+        if line <= 0:
+            return 0
+        offsets, line_counts = self.index()
+        if line > line_counts[-1]:
+            return len(self)
+        # The piece holding the line-th newline
+        i = bisect.bisect_left(line_counts, line) - 1
+        piece = self.pieces[i]
+        n = line - line_counts[i] - 1
+        if piece.source == ORIGINAL:
+            at = self.original.nth_newline(piece.start, n)
+        else:
+            at = piece.start - 1
+            for _ in range(n + 1):
+                at = self.added.index(b'\n', at + 1)
+        return offsets[i] + at - piece.start + 1
+
+    def read(self, start, end):
+        offsets, _ = self.index()
+        end = min(end, offsets[-1])
+        if start >= end:
+            return b''
+        i = bisect.bisect_right(offsets, start) - 1
+        parts = []
+        while start < end:
+            piece = self.pieces[i]
+            piece_end = min(end, offsets[i + 1])
+            parts.append(self.piece_text(piece, start - offsets[i], piece_end - offsets[i]))
+            start = piece_end
+            i += 1
+        return b''.join(parts)
+
+    def line_end(self, line):
+        # Offset of the end of the line's text, before its \n or \r\n
+        start = self.line_start(line)
+        end = self.line_start(line + 1) - 1 if line + 1 < self.line_count() else len(self)
+        if end > start and self.read(end - 1, end) == b'\r':
+            end -= 1
+        return end
+
+    def line_bytes(self, line, limit=None):
+        start = self.line_start(line)
+        end = self.line_start(line + 1) - 1 if line + 1 < self.line_count() else len(self)
+        if limit is not None:
+            end = min(end, start + limit)
+        return self.read(start, end)
+
+    def line_text(self, line, limit=None):
+        text = self.line_bytes(line, limit).decode(self.encoding, ERRORS)
+        return text[:-1] if text.endswith('\r') else text
+
+    def line(self, line, limit=None):
+        # The line's text without its line break; limit caps the bytes read,
+        # for files that are one enormous line. Undecodable bytes are shown
+        # as one replacement character each, keeping columns in step with
+        # offset_of.
+        return ESCAPED.sub('\ufffd', self.line_text(line, limit))
+
+    def line_length(self, line):
+        # In characters, which takes decoding all of the line
+        return len(self.read(self.line_start(line), self.line_end(line)).decode(self.encoding, ERRORS))
+
+    def offset_of(self, line, column):
+        # Byte offset of a character column, which only needs the line up to it
+        start = self.line_start(line)
+        prefix = self.line_text(line, limit=column * 4)[:column]
+        return start + len(prefix.encode(self.encoding, ERRORS))
+
+    def split(self, offset):
+        # Index of the piece starting at offset, splitting one if needed
+        offsets, _ = self.index()
+        i = bisect.bisect_right(offsets, offset) - 1
+        if i >= len(self.pieces) or offsets[i] == offset:
+            return min(i, len(self.pieces))
+        piece = self.pieces[i]
+        cut = offset - offsets[i]
+        newlines = self.count_newlines(piece.source, piece.start, piece.start + cut)
+        self.pieces[i:i + 1] = [
+            Piece(piece.source, piece.start, cut, newlines),
+            Piece(piece.source, piece.start + cut, piece.length - cut, piece.newlines - newlines),
+        ]
+        self.offsets = None
+        return i + 1
+
+    def remember(self, cursor):
+        self.undo_stack.append((list(self.pieces), cursor))
+        del self.undo_stack[:-UNDO_LIMIT]
+        self.redo_stack.clear()
+
+    def changed(self):
+        self.offsets = None
+        self.revision += 1
+
+    def insert(self, offset, text, cursor=None):
+        data = text.encode(self.encoding)
+        if not data:
+            return
+        self.remember(cursor)
+        start = len(self.added)
+        self.added += data
+        newlines = data.count(b'\n')
+
+        # Typing straight on from the last insert grows its piece instead of
+        # adding one per keystroke
+        offsets, _ = self.index()
+        i = bisect.bisect_left(offsets, offset) - 1
+        if 0 <= i < len(self.pieces) and offsets[i + 1] == offset:
+            piece = self.pieces[i]
+            if piece.source == ADDED and piece.start + piece.length == start:
+                self.pieces[i] = Piece(ADDED, piece.start, piece.length + len(data), piece.newlines + newlines)
+                self.changed()
+                return
+        i = self.split(offset)
+        self.pieces.insert(i, Piece(ADDED, start, len(data), newlines))
+        self.changed()
+
+    def delete(self, start, end, cursor=None):
+        end = min(end, len(self))
+        if start >= end:
+            return
+        self.remember(cursor)
+        first = self.split(start)
+        last = self.split(end)
+        del self.pieces[first:last]
+        self.changed()
+
+    def undo(self, cursor=None):
+        # Returns the cursor stored with the edit undone, or None
+        if not self.undo_stack:
+            return None
+        pieces, stored = self.undo_stack.pop()
+        self.redo_stack.append((self.pieces, cursor))
+        self.pieces = pieces
+        self.changed()
+        return stored
+
+    def redo(self, cursor=None):
+        if not self.redo_stack:
+            return None
+        pieces, stored = self.redo_stack.pop()
+        self.undo_stack.append((self.pieces, cursor))
+        self.pieces = pieces
+        self.changed()
+        return stored
+
+    def chunks(self):
+        # The text as it is now, in chunks of at most READ_CHUNK_SIZE bytes.
+        # The piece list is copied here rather than when reading starts, so
+        # edits made while a save streams this on another thread don't
+        # change what it writes.
+        return self.read_pieces(list(self.pieces))
+
+    def read_pieces(self, pieces):
+        for piece in pieces:
+            for start in range(0, piece.length, READ_CHUNK_SIZE):
+                yield self.piece_text(piece, start, min(start + READ_CHUNK_SIZE, piece.length))
@@ -0,0 +1,256 @@
+import os
+import sys
+import json
+import time
+import bisect
+import threading
+from collections import Counter, deque
+from contextlib import contextmanager
+from functools import wraps
+from PyQt5.QtCore import QObject, QTimer
+
+# Set to record from the moment the IDE starts rather than from when
+# recording is switched on in the profiler panel
+PROFILE_ENV = 'AIDANIDE_PROFILE'
+
+# Spans kept for a trace export; older ones are dropped first
+MAX_EVENTS = 200000
+MAX_STALLS = 100
+# Recent durations per subsystem that percentiles are taken from
+SAMPLES_PER_CATEGORY = 2000
+# Upper bounds of the histogram buckets; the last bucket is everything over
+BUCKET_BOUNDS_MS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250)
+
+HEARTBEAT_MS = 16
+# A heartbeat this late means the event loop stalled, and the GUI thread's
+# stack is sampled until it comes back
+STALL_BUDGET_MS = 100
+SAMPLE_INTERVAL_MS = 5
+STACK_DEPTH = 40
+
+
+class CategoryStats:
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+        self.samples = deque(maxlen=SAMPLES_PER_CATEGORY)
+
+    def add(self, ms):
+        self.count += 1
+        self.total_ms += ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+        self.buckets[bisect.bisect_left(BUCKET_BOUNDS_MS, ms)] += 1
+        self.samples.append(ms)
+
+    def percentile(self, fraction):
+        samples = sorted(self.samples)
+        if not samples:
+            return 0.0
+        return samples[min(int(len(samples) * fraction), len(samples) - 1)]
+
+
+class Stall:
+    def __init__(self, start):
+        self.start = start
+        self.end = start
+        # Stack (innermost frame first) -> times it was sampled
+        self.stacks = Counter()
+
+    @property
+    def duration_ms(self):
+        return (self.end - self.start) * 1000
+
+    def top_stacks(self, limit=5):
+        return self.stacks.most_common(limit)
+
+
+def sample_stack(frame):
+    stack = []
+    while frame is not None and len(stack) < STACK_DEPTH:
+        code = frame.f_code
+        stack.append((os.path.basename(code.co_filename), frame.f_lineno, code.co_name))
+        frame = frame.f_back
+    return tuple(stack)
+
+
+def format_frame(frame):
+    filename, line, function = frame
+    return f"{function} ({filename}:{line})"
+
+
+class Profiler:
+    # Timings of the IDE's hot paths, from any thread. Recording is off by
+    # default; while it is, timed() and span() cost one attribute check.
+    def __init__(self):
+        self.enabled = bool(os.environ.get(PROFILE_ENV))
+        self.origin = time.perf_counter()
+        self.gui_thread = threading.get_ident()
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            # (category, start, end, thread id, detail)
+            self.events = deque(maxlen=MAX_EVENTS)
+            self.stats = {}
+            self.stalls = deque(maxlen=MAX_STALLS)
+            self.thread_names = {self.gui_thread: "GUI"}
+
+    def category_stats(self, category):
+        stats = self.stats.get(category)
+        if stats is None:
+            stats = self.stats[category] = CategoryStats()
+        return stats
+
+    def record(self, category, start, end, detail=None):
+        thread = threading.get_ident()
+        with self.lock:
+            self.events.append((category, start, end, thread, detail))
+            self.category_stats(category).add((end - start) * 1000)
+            if thread not in self.thread_names:
+                self.thread_names[thread] = threading.current_thread().name
+
+    def observe(self, category, ms):
+        # A measurement for the histograms only, too frequent to be worth
+        # a span in the trace
+        with self.lock:
+            self.category_stats(category).add(ms)
+
+    def add_stall(self, stall):
+        with self.lock:
+            self.stalls.append(stall)
+            self.events.append(("stall", stall.start, stall.end, self.gui_thread, None))
+            self.category_stats("stall").add(stall.duration_ms)
+
+    @contextmanager
+    def span(self, category, detail=None):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(category, start, time.perf_counter(), detail)
+
+    def snapshot(self):
+        # Copies for the panel to read while other threads keep recording
+        with self.lock:
+            return (
+                {category: (stats.count, stats.total_ms, stats.max_ms, list(stats.buckets),
+                            stats.percentile(0.5), stats.percentile(0.95))
+                 for category, stats in self.stats.items()},
+                list(self.stalls),
+                len(self.events),
+            )
+
+    def chrome_trace(self):
+        # The Trace Event Format that chrome://tracing and Perfetto load:
+        # complete events in microseconds, one track per thread
+        pid = os.getpid()
+        with self.lock:
+            events = list(self.events)
+            stalls = list(self.stalls)
+            thread_names = dict(self.thread_names)
+        trace = [
+            {'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': thread, 'args': {'name': name}}
+            for thread, name in thread_names.items()
+        ]
+        stall_stacks = {(stall.start, stall.end): stall.top_stacks(1) for stall in stalls}
+        for category, start, end, thread, detail in events:
+            event = {
+                'name': category, 'cat': 'stall' if category == 'stall' else 'ide', 'ph': 'X',
+                'ts': (start - self.origin) * 1e6, 'dur': (end - start) * 1e6,
+                'pid': pid, 'tid': thread,
+            }
+            if detail is not None:
+                event['args'] = {'detail': str(detail)}
+            elif category == 'stall':
+                top = stall_stacks.get((start, end))
+                if top:
+                    stack, samples = top[0]
+                    event['args'] = {'samples': samples, 'stack': [format_frame(frame) for frame in stack]}
+            trace.append(event)
+        return {'traceEvents': trace, 'displayTimeUnit': 'ms'}
+
+    def export_chrome_trace(self, path):
+        from fileio import atomic_write
+        atomic_write(path, json.dumps(self.chrome_trace()))
+
+
+profiler = Profiler()
+
+
+def timed(category):
+    # Records each call of the decorated function as a span of category
+    def decorate(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                profiler.record(category, start, time.perf_counter())
+        return wrapper
+    return decorate
+
+
+class StallMonitor(QObject):
+    # A heartbeat timer on the GUI thread and a watchdog thread that checks
+    # on it. When a heartbeat is overdue by more than the budget, the
+    # watchdog samples the GUI thread's Python stack until the event loop
+    # gets back to the timer, so a stall comes with where it was spent.
+    def __init__(self, budget_ms=STALL_BUDGET_MS, parent=None):
+        super().__init__(parent)
+        self.budget_ms = budget_ms
+        self.last_beat = time.perf_counter()
+        self.timer = QTimer(self)
+        self.timer.setInterval(HEARTBEAT_MS)
+        self.timer.timeout.connect(self.beat)
+        self.stopping = threading.Event()
+        self.watchdog = None
+
+    def start(self):
+        if self.watchdog is not None:
+            return
+        self.last_beat = time.perf_counter()
+        self.timer.start()
+        self.stopping.clear()
+        self.watchdog = threading.Thread(target=self.watch, name="stall watchdog", daemon=True)
+        self.watchdog.start()
+
+    def stop(self):
+        if self.watchdog is None:
+            return
+        self.timer.stop()
+        self.stopping.set()
+        self.watchdog.join()
+        self.watchdog = None
+
+    def beat(self):
+        now = time.perf_counter()
+        # How much later than asked for the event loop ran the timer
+        profiler.observe("event loop lag", max((now - self.last_beat) * 1000 - HEARTBEAT_MS, 0.0))
+        self.last_beat = now
+
+    def watch(self):
+        stall = None
+        while not self.stopping.wait(SAMPLE_INTERVAL_MS / 1000):
+            beat = self.last_beat
+            if stall is not None and beat != stall.start:
+                stall.end = beat
+                profiler.add_stall(stall)
+                stall = None
+            if (time.perf_counter() - beat) * 1000 < self.budget_ms:
+                continue
+            if stall is None:
+                stall = Stall(beat)
+            frame = sys._current_frames().get(profiler.gui_thread)
+            if frame is not None:
+                stall.stacks[sample_stack(frame)] += 1
+                del frame
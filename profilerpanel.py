@@ -0,0 +1,182 @@
+import time
+from PyQt5.QtWidgets import (
+    QWidget, QVBoxLayout, QHBoxLayout, QTreeWidget, QTreeWidgetItem, QLabel, QPushButton,
+    QSplitter, QFileDialog, QMessageBox
+)
+from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtGui import QColor
+from profiler import profiler, StallMonitor, BUCKET_BOUNDS_MS, MAX_STALLS, format_frame
+
+REFRESH_INTERVAL_MS = 500
+# One character per histogram bucket, its height scaled to the fullest one
+BARS = " ▁▂▃▄▅▆▇█"
+STALL_COLORS = (QColor("#f1fa8c"), QColor("#ff5555"))
+
+
+def histogram_text(buckets):
+    peak = max(buckets)
+    if not peak:
+        return ""
+    return "".join(
+        BARS[0] if not count else BARS[max(1, round(count / peak * (len(BARS) - 1)))]
+        for count in buckets
+    )
+
+
+def bucket_label(index):
+    if index == 0:
+        return f"≤ {BUCKET_BOUNDS_MS[0]} ms"
+    if index == len(BUCKET_BOUNDS_MS):
+        return f"> {BUCKET_BOUNDS_MS[-1]} ms"
+    return f"{BUCKET_BOUNDS_MS[index - 1]}–{BUCKET_BOUNDS_MS[index]} ms"
+
+
+class ProfilerPanel(QWidget):
+    # A small always-on-top window over the IDE: per-subsystem timings with
+    # a histogram each, and the event-loop stalls with where the GUI thread
+    # was when they were sampled
+    def __init__(self, parent=None):
+        super().__init__(parent, Qt.Tool | Qt.WindowStaysOnTopHint)
+        self.setWindowTitle("Profiler")
+        self.resize(720, 420)
+        self.monitor = StallMonitor(parent=self)
+        # The newest stall in the list; the ones after it are yet to be shown
+        self.last_stall = None
+
+        self.status = QLabel()
+        self.status.setStyleSheet("color: #6272a4; padding: 5px;")
+
+        self.record_btn = QPushButton()
+        self.record_btn.setCheckable(True)
+        self.record_btn.toggled.connect(self.set_recording)
+
+        self.reset_btn = QPushButton("Reset")
+        self.reset_btn.clicked.connect(self.reset)
+
+        self.export_btn = QPushButton("Export Trace…")
+        self.export_btn.clicked.connect(self.export_trace)
+
+        header_layout = QHBoxLayout()
+        header_layout.addWidget(self.status)
+        header_layout.addStretch()
+        header_layout.addWidget(self.record_btn)
+        header_layout.addWidget(self.reset_btn)
+        header_layout.addWidget(self.export_btn)
+
+        self.subsystems = QTreeWidget()
+        self.subsystems.setRootIsDecorated(False)
+        self.subsystems.setHeaderLabels(["Subsystem", "Calls", "Median", "p95", "Max", "Total", "Histogram"])
+        self.subsystems.setColumnWidth(0, 160)
+        self.items = {}
+
+        self.stalls = QTreeWidget()
+        self.stalls.setHeaderHidden(True)
+
+        splitter = QSplitter(Qt.Vertical)
+        splitter.addWidget(self.subsystems)
+        splitter.addWidget(self.stalls)
+        splitter.setSizes([260, 160])
+
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addLayout(header_layout)
+        layout.addWidget(splitter)
+        self.setLayout(layout)
+
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setInterval(REFRESH_INTERVAL_MS)
+        self.refresh_timer.timeout.connect(self.refresh)
+
+        self.record_btn.setChecked(profiler.enabled)
+        self.set_recording(profiler.enabled)
+
+    def set_recording(self, enabled):
+        profiler.enabled = enabled
+        self.record_btn.setText("Stop Recording" if enabled else "Record")
+        if enabled:
+            self.monitor.start()
+        else:
+            self.monitor.stop()
+        self.refresh()
+
+    def reset(self):
+        profiler.reset()
+        self.subsystems.clear()
+        self.items = {}
+        self.stalls.clear()
+        self.last_stall = None
+        self.refresh()
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.refresh()
+        self.refresh_timer.start()
+
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        self.refresh_timer.stop()
+
+    def refresh(self):
+        stats, stalls, events = profiler.snapshot()
+        for category, (count, total_ms, max_ms, buckets, median, p95) in sorted(stats.items()):
+            item = self.items.get(category)
+            if item is None:
+                item = self.items[category] = QTreeWidgetItem([category])
+                for column in range(1, 6):
+                    item.setTextAlignment(column, Qt.AlignRight)
+                self.subsystems.addTopLevelItem(item)
+            item.setText(1, str(count))
+            item.setText(2, f"{median:.2f} ms")
+            item.setText(3, f"{p95:.2f} ms")
+            item.setText(4, f"{max_ms:.1f} ms")
+            item.setText(5, f"{total_ms:.0f} ms")
+            item.setText(6, histogram_text(buckets))
+            item.setToolTip(6, "\n".join(
+                f"{bucket_label(index)}: {bucket}" for index, bucket in enumerate(buckets) if bucket
+            ))
+
+        # The profiler only keeps the last MAX_STALLS, so new stalls are
+        # found after the newest one shown rather than by counting
+        new = stalls
+        for index in range(len(stalls) - 1, -1, -1):
+            if stalls[index] is self.last_stall:
+                new = stalls[index + 1:]
+                break
+        for stall in new:
+            self.stalls.insertTopLevelItem(0, self.stall_item(stall))
+        while self.stalls.topLevelItemCount() > MAX_STALLS:
+            self.stalls.takeTopLevelItem(self.stalls.topLevelItemCount() - 1)
+        if stalls:
+            self.last_stall = stalls[-1]
+
+        state = "recording" if profiler.enabled else "stopped"
+        stall_count = stats['stall'][0] if 'stall' in stats else 0
+        self.status.setText(f"{state}, {events} spans, {stall_count} stalls")
+
+    def stall_item(self, stall):
+        at = stall.start - profiler.origin
+        item = QTreeWidgetItem([f"Stall of {stall.duration_ms:.0f} ms at {at:.1f}s"])
+        item.setForeground(0, STALL_COLORS[stall.duration_ms > 2 * self.monitor.budget_ms])
+        samples = sum(stall.stacks.values())
+        for stack, count in stall.top_stacks():
+            # Innermost frame first, with the rest of the stack under it
+            stack_item = QTreeWidgetItem([f"{count}/{samples} samples in {format_frame(stack[0])}"])
+            stack_item.addChildren([QTreeWidgetItem([format_frame(frame)]) for frame in stack[1:]])
+            item.addChild(stack_item)
+        return item
+
+    def export_trace(self):
+        default = f"aidanide-trace-{time.strftime('%Y%m%d-%H%M%S')}.json"
+        path, _ = QFileDialog.getSaveFileName(
+            self, "Export Trace", default, "Chrome Trace (*.json)",
+            options=QFileDialog.DontUseNativeDialog
+        )
+        if not path:
+            return
+        try:
+            profiler.export_chrome_trace(path)
+        except OSError as e:
+            QMessageBox.critical(self, "Error Exporting Trace", str(e))
+
+    def shutdown(self):
+        self.monitor.stop()
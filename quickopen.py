@@ -0,0 +1,72 @@
+from PyQt5.QtWidgets import QDialog, QVBoxLayout, QLineEdit, QListWidget, QLabel
+from PyQt5.QtCore import Qt
+
+
+class QuickOpenDialog(QDialog):
+    def __init__(self, file_index, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Go to File")
+        self.setMinimumWidth(600)
+        self.file_index = file_index
+        self.selected_path = None
+
+        self.query_input = QLineEdit()
+        self.query_input.setPlaceholderText("Type to search files by name...")
+        self.query_input.textChanged.connect(self.update_results)
+        self.query_input.returnPressed.connect(self.accept_current)
+        self.query_input.installEventFilter(self)
+
+        self.results = QListWidget()
+        self.results.itemActivated.connect(lambda item: self.accept_current())
+
+        self.status = QLabel()
+        self.status.setStyleSheet("color: #6272a4;")
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.query_input)
+        layout.addWidget(self.results)
+        layout.addWidget(self.status)
+        self.setLayout(layout)
+
+        self.file_index.ready.connect(self.refresh)
+        self.update_results("")
+
+    def refresh(self):
+        self.update_results(self.query_input.text())
+
+    def update_results(self, query):
+        self.results.clear()
+        if self.file_index.root_path is None:
+            self.status.setText("Open a folder to search its files")
+            return
+
+        self.results.addItems(self.file_index.search(query))
+        if self.results.count():
+            self.results.setCurrentRow(0)
+        status = f"{len(self.file_index.paths)} files indexed"
+        if query.strip() and self.file_index.tables is None:
+            # Searched again once the index emits ready
+            status += ", preparing search…"
+        self.status.setText(status)
+
+    def eventFilter(self, obj, event):
+        # Arrow keys move through the results while focus stays in the query
+        if obj is self.query_input and event.type() == event.KeyPress:
+            if event.key() in (Qt.Key_Down, Qt.Key_Up):
+                step = 1 if event.key() == Qt.Key_Down else -1
+                row = self.results.currentRow() + step
+                if 0 <= row < self.results.count():
+                    self.results.setCurrentRow(row)
+                return True
+        return super().eventFilter(obj, event)
+
+    def accept_current(self):
+        item = self.results.currentItem()
+        if item is None:
+            return
+        self.selected_path = self.file_index.absolute_path(item.text())
+        self.accept()
+
+    def done(self, result):
+        self.file_index.ready.disconnect(self.refresh)
+        super().done(result)
@@ -0,0 +1,324 @@
+import os
+import re
+import time
+import hashlib
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+from PyQt5.QtGui import QTextCursor
+from filetree import IgnoreRules
+from fileindex import walk_project
+from fileio import atomic_write
+from search import executor, read_bytes, FILES_PER_TASK, MAX_LINE_PREVIEW
+
+MAX_HUNKS_PER_FILE = 200
+MAX_PREVIEW_LINES = 8
+# Bytes that aren't valid UTF-8 are carried through a replace unchanged
+ERRORS = 'surrogateescape'
+
+
+def literal_template(text):
+    # A replacement typed without regex mode has no group references
+    return text.replace('\\', '\\\\')
+
+
+def replace_text(text, pattern, template):
+    # Returns (new_text, count); the template is compiled once for the
+    # whole text
+    return pattern.subn(template, text)
+
+
+def diff_text(text, pattern, template, max_hunks=MAX_HUNKS_PER_FILE):
+    # Returns (count, hunks) without building the replaced text. Each hunk
+    # is the first line number and the old and new text of the lines one or
+    # more matches touch; past max_hunks, matches are only counted.
+    plain = '\\' not in template
+    hunks = []
+    count = 0
+    line_number = 1
+    counted = 0
+    # The hunk being built: its old line range and its new text so far
+    hunk_start = hunk_end = position = None
+    parts = []
+    matches = pattern.finditer(text)
+    for match in matches:
+        count += 1
+        start, end = match.span()
+        line_start = text.rfind('\n', 0, start) + 1
+        if hunk_start is not None and line_start <= hunk_end:
+            # On a line the previous match already touched
+            parts.append(text[position:start])
+        else:
+            if hunk_start is not None:
+                parts.append(text[position:hunk_end])
+                hunks.append((line_number, text[hunk_start:hunk_end], ''.join(parts)))
+                if len(hunks) >= max_hunks:
+                    hunk_start = None
+                    count += sum(1 for _ in matches)
+                    break
+            line_number += text.count('\n', counted, line_start)
+            counted = line_start
+            hunk_start = line_start
+            parts = [text[line_start:start]]
+        parts.append(template if plain else match.expand(template))
+        position = end
+        hunk_end = text.find('\n', end)
+        if hunk_end < 0:
+            hunk_end = len(text)
+    if hunk_start is not None:
+        parts.append(text[position:hunk_end])
+        hunks.append((line_number, text[hunk_start:hunk_end], ''.join(parts)))
+    return count, hunks
+
+
+def preview_hunks(hunks):
+    # Trimmed for display; the whole change is only ever made on apply
+    return [
+        (
+            line_number,
+            [line[:MAX_LINE_PREVIEW] for line in old.split('\n')[:MAX_PREVIEW_LINES]],
+            [line[:MAX_LINE_PREVIEW] for line in new.split('\n')[:MAX_PREVIEW_LINES]],
+        )
+        for line_number, old, new in hunks
+    ]
+
+
+def preview_files(root_path, rel_paths, pattern_source, flags, template):
+    pattern = re.compile(pattern_source, flags)
+    results = []
+    scanned = 0
+    for rel_path in rel_paths:
+        data = read_bytes(os.path.join(root_path, rel_path))
+        if data is None:
+            continue
+        scanned += len(data)
+        count, hunks = diff_text(data.decode('utf-8', ERRORS), pattern, template)
+        if count:
+            results.append((rel_path, count, preview_hunks(hunks), hashlib.sha1(data).hexdigest()))
+    return results, len(rel_paths), scanned
+
+
+def apply_files(root_path, files, pattern_source, flags, template):
+    # files pairs each path with the hash it had when previewed; a file
+    # changed since then is left alone rather than replaced blind
+    pattern = re.compile(pattern_source, flags)
+    results = []
+    written = 0
+    for rel_path, content_hash in files:
+        path = os.path.join(root_path, rel_path)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            if hashlib.sha1(data).hexdigest() != content_hash:
+                results.append((rel_path, 0, "changed on disk since the preview"))
+                continue
+            new_text, count = replace_text(data.decode('utf-8', ERRORS), pattern, template)
+            if count:
+                new_data = new_text.encode('utf-8', ERRORS)
+                atomic_write(path, new_data)
+                written += len(new_data)
+            results.append((rel_path, count, ""))
+        except (OSError, UnicodeError, re.error) as e:
+            results.append((rel_path, 0, str(e)))
+    return results, written
+
+
+def common_length(limit, same):
+    # The longest n up to limit with same(n), found by bisection so the
+    # comparisons run as whole slices rather than character by character
+    low, high = 0, limit
+    while low < high:
+        middle = (low + high + 1) // 2
+        if same(middle):
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def replace_in_document(document, pattern, template):
+    # Replaces in an open tab's QTextDocument. Only the span from the first
+    # to the last change is rewritten, in one undoable edit, so the cursor,
+    # scroll position and undo history outside it are kept.
+    text = document.toPlainText()
+    new_text, count = replace_text(text, pattern, template)
+    if not count:
+        return 0
+    limit = min(len(text), len(new_text))
+    prefix = common_length(limit, lambda n: text[:n] == new_text[:n])
+    limit -= prefix
+    suffix = common_length(limit, lambda n: text[len(text) - n:] == new_text[len(new_text) - n:])
+    cursor = QTextCursor(document)
+    cursor.setPosition(prefix)
+    cursor.setPosition(len(text) - suffix, QTextCursor.KeepAnchor)
+    cursor.insertText(new_text[prefix:len(new_text) - suffix])
+    return count
+
+
+def submit(function, *args):
+    try:
+        return executor().submit(function, *args)
+    except (OSError, RuntimeError):
+        # Without worker processes the batch runs on the calling thread
+        from concurrent.futures import Future
+        future = Future()
+        future.set_result(function(*args))
+        return future
+
+
+class PreviewTask(QRunnable):
+    def __init__(self, replace, generation, root_path, pattern, template, texts, skipped):
+        super().__init__()
+        self.replace = replace
+        self.generation = generation
+        self.root_path = root_path
+        self.pattern = pattern
+        self.template = template
+        self.texts = texts
+        self.skipped = skipped
+        self.rules = IgnoreRules(root_path, replace.ignore_patterns)
+
+    def cancelled(self):
+        return self.replace.generation != self.generation
+
+    def run(self):
+        from concurrent.futures import FIRST_COMPLETED, wait
+
+        started = time.perf_counter()
+        rel_paths = walk_project(self.root_path, self.rules)
+        total_files = len(rel_paths)
+        if self.replace.index is not None:
+            rel_paths = self.replace.index.candidates(self.root_path, rel_paths, self.pattern)
+
+        # Files open in a tab are previewed from the tab's text, here, since
+        # that is what applying will change
+        on_disk = [
+            rel_path for rel_path in rel_paths
+            if rel_path not in self.texts and rel_path not in self.skipped
+        ]
+        results = []
+        for rel_path, text in self.texts.items():
+            count, hunks = diff_text(text, self.pattern, self.template)
+            if count:
+                results.append((rel_path, count, preview_hunks(hunks), None))
+        files_done = len(self.texts)
+        bytes_scanned = sum(len(text) for text in self.texts.values())
+        replacements = sum(count for _, count, _, _ in results)
+        if results:
+            self.replace.preview_found.emit(self.generation, results)
+
+        pending = set()
+        for offset in range(0, len(on_disk), FILES_PER_TASK):
+            pending.add(submit(
+                preview_files, self.root_path, on_disk[offset:offset + FILES_PER_TASK],
+                self.pattern.pattern, self.pattern.flags, self.template
+            ))
+        while pending:
+            if self.cancelled():
+                for future in pending:
+                    future.cancel()
+                break
+            done, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    results, files, scanned = future.result()
+                except Exception:
+                    continue
+                files_done += files
+                bytes_scanned += scanned
+                if results and not self.cancelled():
+                    replacements += sum(count for _, count, _, _ in results)
+                    self.replace.preview_found.emit(self.generation, results)
+            self.replace.progress.emit(self.generation, files_done, len(on_disk) + len(self.texts))
+
+        seconds = time.perf_counter() - started
+        self.replace.preview_finished.emit(self.generation, {
+            'files': files_done,
+            'total_files': total_files,
+            'replacements': replacements,
+            'skipped': len(self.skipped),
+            'bytes': bytes_scanned,
+            'seconds': seconds,
+            'files_per_second': files_done / seconds if seconds else 0.0,
+            'cancelled': self.cancelled(),
+        })
+
+
+class ApplyTask(QRunnable):
+    def __init__(self, replace, generation, root_path, pattern, template, files):
+        super().__init__()
+        self.replace = replace
+        self.generation = generation
+        self.root_path = root_path
+        self.pattern = pattern
+        self.template = template
+        self.files = files
+
+    def run(self):
+        from concurrent.futures import wait
+
+        # Batches are written by the worker processes side by side; a
+        # started batch is always finished, so no file is left half done
+        started = time.perf_counter()
+        batches = [self.files[offset:offset + FILES_PER_TASK] for offset in range(0, len(self.files), FILES_PER_TASK)]
+        futures = [
+            submit(apply_files, self.root_path, batch, self.pattern.pattern, self.pattern.flags, self.template)
+            for batch in batches
+        ]
+        wait(futures)
+
+        results = []
+        written = 0
+        for batch, future in zip(batches, futures):
+            try:
+                batch, batch_written = future.result()
+            except Exception as e:
+                batch = [(rel_path, 0, str(e)) for rel_path, _ in batch]
+                batch_written = 0
+            results.extend(batch)
+            written += batch_written
+        seconds = time.perf_counter() - started
+        changed = [result for result in results if result[1]]
+        self.replace.apply_finished.emit(self.generation, results, {
+            'files': len(changed),
+            'replacements': sum(count for _, count, _ in changed),
+            'failed': len(results) - len(changed),
+            'bytes': written,
+            'seconds': seconds,
+            'files_per_second': len(results) / seconds if seconds else 0.0,
+        })
+
+
+class ProjectReplace(QObject):
+    preview_found = pyqtSignal(int, list)
+    progress = pyqtSignal(int, int, int)
+    preview_finished = pyqtSignal(int, dict)
+    apply_finished = pyqtSignal(int, list, dict)
+
+    def __init__(self, ignore_patterns=None, index=None, parent=None):
+        super().__init__(parent)
+        self.ignore_patterns = ignore_patterns
+        self.index = index
+        self.generation = 0
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+
+    def preview(self, root_path, pattern, template, texts=None, skipped=()):
+        # texts maps files open in tabs to their current text; skipped files
+        # are neither previewed nor replaced
+        self.generation += 1
+        self.pool.start(PreviewTask(
+            self, self.generation, root_path, pattern, template, dict(texts or {}), set(skipped)
+        ))
+        return self.generation
+
+    def apply(self, root_path, pattern, template, files):
+        # files is a list of (rel_path, content_hash) from the preview
+        self.generation += 1
+        self.pool.start(ApplyTask(self, self.generation, root_path, pattern, template, list(files)))
+        return self.generation
+
+    def cancel(self):
+        self.generation += 1
+
+    def wait(self):
+        self.cancel()
+        self.pool.waitForDone()
@@ -0,0 +1,378 @@
+import os
+import re
+import sys
+import json
+import time
+import shlex
+import shutil
+import hashlib
+from collections import namedtuple
+from PyQt5.QtCore import QObject, QProcess, QProcessEnvironment, pyqtSignal
+from fileio import make_decoder
+from storage import cache_dir
+
+BUILD_CACHE_DIR = 'builds'
+# Least recently used artifacts beyond this many are deleted
+BUILD_CACHE_LIMIT = 64
+TASKS_FILE = os.path.join('.aidanide', 'tasks.json')
+# Lines longer than this can't be a diagnostic worth linking to
+MAX_PROBLEM_LINE = 4096
+MAX_PROBLEMS = 1000
+
+COMPILERS = {
+    '.c': ('CC', 'cc', ['-std=c11', '-Wall', '-Wextra', '-g']),
+    '.cpp': ('CXX', 'c++', ['-std=c++17', '-Wall', '-Wextra', '-g']),
+    '.h': ('CC', 'cc', ['-Wall', '-Wextra']),
+}
+LINK_FLAGS = ['-lm']
+LOCAL_INCLUDE = re.compile(rb'^\s*#\s*include\s*"([^"]+)"', re.MULTILINE)
+
+Problem = namedtuple('Problem', ['path', 'line', 'column', 'severity', 'message'])
+Task = namedtuple('Task', ['name', 'command', 'cwd'])
+# A command to run; a finished build step renames output over artifact
+Step = namedtuple('Step', ['argv', 'cwd', 'output', 'artifact'])
+
+# gcc and clang: path:line:column: severity: message
+COMPILER_PROBLEM = re.compile(
+    r'^(?P<path>[^:\s][^:]*):(?P<line>\d+):(?:(?P<column>\d+):)?\s+'
+    r'(?P<severity>fatal error|error|warning|note):\s+(?P<message>.*)$'
+)
+# Python warnings: path:line: CategoryWarning: message
+PYTHON_WARNING = re.compile(r'^(?P<path>[^:\s][^:]*):(?P<line>\d+): (?P<category>\w*Warning): (?P<message>.*)$')
+PYTHON_FRAME = re.compile(r'^\s+File "(?P<path>[^"]+)", line (?P<line>\d+)')
+# The first unindented line after the frames names the exception
+PYTHON_EXCEPTION = re.compile(r'^(?P<type>[A-Za-z_][\w.]*)(?::\s*(?P<message>.*))?$')
+
+
+class ProblemParser:
+    # Turns output into problems as it streams in. Text is fed in whatever
+    # pieces it arrives in; only complete lines are matched, and a Python
+    # traceback becomes one problem when its exception line arrives, at
+    # the innermost frame in a file under the working directory.
+    def __init__(self, cwd):
+        self.cwd = cwd
+        self.carry = ''
+        self.frames = []
+        self.count = 0
+
+    def feed(self, text):
+        lines = (self.carry + text).split('\n')
+        self.carry = lines.pop()
+        if len(self.carry) > MAX_PROBLEM_LINE:
+            self.carry = ''
+        return self.parse(lines)
+
+    def finish(self):
+        lines = [self.carry] if self.carry else []
+        self.carry = ''
+        return self.parse(lines)
+
+    def parse(self, lines):
+        problems = []
+        for line in lines:
+            if self.count + len(problems) >= MAX_PROBLEMS:
+                break
+            problem = self.parse_line(line.rstrip('\r'))
+            if problem is not None:
+                problems.append(problem)
+        self.count += len(problems)
+        return problems
+
+    def parse_line(self, line):
+        if not line or len(line) > MAX_PROBLEM_LINE:
+            return None
+        if line[0].isspace():
+            match = PYTHON_FRAME.match(line)
+            if match:
+                self.frames.append((self.resolve(match['path']), int(match['line'])))
+            return None
+
+        if self.frames:
+            match = PYTHON_EXCEPTION.match(line)
+            if match:
+                path, line_number = self.innermost_frame()
+                self.frames = []
+                message = match['type'] + (': ' + match['message'] if match['message'] else '')
+                return Problem(path, line_number, 0, 'error', message)
+            if not line.startswith(('Traceback', 'During handling', 'The above exception')):
+                self.frames = []
+
+        if ':' not in line:
+            return None
+        match = COMPILER_PROBLEM.match(line)
+        if match:
+            severity = 'error' if match['severity'] == 'fatal error' else match['severity']
+            column = int(match['column']) - 1 if match['column'] else 0
+            return Problem(self.resolve(match['path']), int(match['line']), column, severity, match['message'])
+        match = PYTHON_WARNING.match(line)
+        if match:
+            message = f"{match['category']}: {match['message']}"
+            return Problem(self.resolve(match['path']), int(match['line']), 0, 'warning', message)
+        return None
+
+    def resolve(self, path):
+        return os.path.normpath(os.path.join(self.cwd, path))
+
+    def innermost_frame(self):
+        # Library frames are skipped when the traceback passes through the
+        # user's own files
+        for path, line in reversed(self.frames):
+            if not os.path.relpath(path, self.cwd).startswith('..'):
+                return path, line
+        return self.frames[-1]
+
+
+def load_tasks(root_path):
+    # .aidanide/tasks.json in the project:
+    # {"tasks": [{"name": ..., "command": ..., "cwd": optional, relative}]}
+    try:
+        with open(os.path.join(root_path, TASKS_FILE), 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        tasks = []
+        for entry in data.get('tasks', []):
+            if isinstance(entry, dict) and isinstance(entry.get('command'), str):
+                cwd = os.path.normpath(os.path.join(root_path, entry.get('cwd') or '.'))
+                tasks.append(Task(str(entry.get('name') or entry['command']), entry['command'], cwd))
+        return tasks
+    except (OSError, ValueError, AttributeError, TypeError):
+        return []
+
+
+def runnable(path):
+    return os.path.splitext(path)[1].lower() in COMPILERS or path.lower().endswith('.py')
+
+
+def compiler_command(path, output, env=None):
+    env = os.environ if env is None else env
+    ext = os.path.splitext(path)[1].lower()
+    variable, default, flags = COMPILERS[ext]
+    compiler = shlex.split(env.get(variable) or default)
+    if ext == '.h':
+        # Headers are only checked, there is nothing to run
+        return compiler + flags + ['-fsyntax-only', '-x', 'c-header' if variable == 'CC' else 'c++-header', path]
+    return compiler + flags + [path, '-o', output] + LINK_FLAGS
+
+
+def source_hash(path, argv):
+    # The build key covers the compiler and its flags, the source, and the
+    # headers it includes with quotes, which are looked up next to the file
+    # including them. System headers are taken to stay put.
+    digest = hashlib.sha1()
+    for arg in argv:
+        digest.update(arg.encode('utf-8', 'surrogateescape') + b'\0')
+    compiler = shutil.which(argv[0])
+    if compiler is not None:
+        stat = os.stat(compiler)
+        digest.update(f'{compiler}:{stat.st_size}:{stat.st_mtime_ns}'.encode('utf-8', 'surrogateescape'))
+
+    seen = set()
+    pending = [os.path.abspath(path)]
+    while pending:
+        current = pending.pop()
+        if current in seen:
+            continue
+        seen.add(current)
+        try:
+            with open(current, 'rb') as f:
+                data = f.read()
+        except OSError:
+            continue
+        digest.update(current.encode('utf-8', 'surrogateescape') + b'\0' + data + b'\0')
+        directory = os.path.dirname(current)
+        for name in LOCAL_INCLUDE.findall(data):
+            pending.append(os.path.normpath(os.path.join(directory, os.fsdecode(name))))
+    return digest.hexdigest()
+
+
+def build_cache_dir():
+    path = os.path.join(cache_dir(), BUILD_CACHE_DIR)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def prune_build_cache(limit=BUILD_CACHE_LIMIT):
+    directory = build_cache_dir()
+    try:
+        entries = [entry for entry in os.scandir(directory) if entry.is_file()]
+    except OSError:
+        return
+    entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in entries[limit:]:
+        try:
+            os.unlink(entry.path)
+        except OSError:
+            pass
+
+
+class BuildRunner(QObject):
+    # Runs a list of steps one after another in a QProcess, streaming the
+    # merged output and the problems found in it
+    output = pyqtSignal(str)
+    problems_found = pyqtSignal(list)
+    run_started = pyqtSignal(str)
+    run_finished = pyqtSignal(dict)
+
+    def __init__(self, env=None, parent=None):
+        super().__init__(parent)
+        self.env = dict(os.environ if env is None else env)
+        self.process = None
+        self.steps = []
+        self.parser = None
+        self.decoder = None
+        self.stats = None
+        self.started = 0.0
+
+    def is_running(self):
+        return self.process is not None
+
+    def run_file(self, path):
+        # Python files run with the interpreter on PATH; C and C++ files are
+        # built into the cache unless an artifact for the same sources is
+        # already there
+        path = os.path.abspath(path)
+        cwd = os.path.dirname(path)
+        if path.lower().endswith('.py'):
+            python = shutil.which('python3', path=self.env.get('PATH')) or sys.executable
+            return self.start(os.path.basename(path), [Step([python, '-u', path], cwd, None, None)], cwd)
+
+        if path.lower().endswith('.h'):
+            return self.start(os.path.basename(path), [Step(compiler_command(path, None, self.env), cwd, None, None)], cwd)
+
+        key = source_hash(path, compiler_command(path, '', self.env))
+        artifact = os.path.join(build_cache_dir(), key)
+        steps = []
+        note = None
+        if os.path.exists(artifact):
+            # Touched so pruning keeps what is still being run
+            os.utime(artifact)
+            note = f"[unchanged since the last build, using {key[:12]}]"
+        else:
+            output = artifact + f'.{os.getpid()}.tmp'
+            steps.append(Step(compiler_command(path, output, self.env), cwd, output, artifact))
+        steps.append(Step([artifact], cwd, None, None))
+        return self.start(os.path.basename(path), steps, cwd, note)
+
+    def run_task(self, task):
+        shell = self.env.get('SHELL') or '/bin/sh'
+        return self.start(task.name, [Step([shell, '-c', task.command], task.cwd, None, None)], task.cwd)
+
+    def start(self, name, steps, cwd, note=None):
+        self.stop()
+        self.steps = list(steps)
+        self.parser = ProblemParser(cwd)
+        self.stats = {'name': name, 'cached': note is not None, 'problems': 0, 'status': 0, 'steps': 0}
+        self.started = time.perf_counter()
+        self.run_started.emit(name)
+        if note is not None:
+            self.output.emit(note + "\n")
+        self.next_step()
+        return True
+
+    def next_step(self):
+        if not self.steps:
+            self.finish()
+            return
+        step = self.steps[0]
+        self.output.emit("$ " + ' '.join(shlex.quote(arg) for arg in step.argv) + "\n")
+        self.decoder = make_decoder()
+
+        process = QProcess(self)
+        process.setProcessChannelMode(QProcess.MergedChannels)
+        process.setWorkingDirectory(step.cwd)
+        environment = QProcessEnvironment()
+        for key, value in self.env.items():
+            environment.insert(key, value)
+        process.setProcessEnvironment(environment)
+        process.readyReadStandardOutput.connect(self.read_output)
+        process.finished.connect(self.step_finished)
+        process.errorOccurred.connect(self.step_failed)
+        self.process = process
+        process.start(step.argv[0], step.argv[1:])
+
+    def read_output(self):
+        if self.process is None:
+            return
+        text = self.decoder.decode(bytes(self.process.readAllStandardOutput()))
+        self.write(text)
+
+    def write(self, text):
+        if not text:
+            return
+        self.output.emit(text)
+        problems = self.parser.feed(text)
+        if problems:
+            self.stats['problems'] += len(problems)
+            self.problems_found.emit(problems)
+
+    def step_finished(self, exit_code, exit_status):
+        process = self.process
+        if process is None or process is not self.sender():
+            return
+        self.read_output()
+        self.write(self.decoder.decode(b'', final=True))
+        self.process = None
+        process.deleteLater()
+
+        step = self.steps.pop(0)
+        self.stats['steps'] += 1
+        status = exit_code if exit_status == QProcess.NormalExit else -1
+        self.stats['status'] = status
+        if status != 0:
+            self.steps = []
+            if step.output is not None:
+                self.discard(step.output)
+        elif step.output is not None:
+            try:
+                os.replace(step.output, step.artifact)
+            except OSError as e:
+                self.output.emit(f"[could not cache the build: {e}]\n")
+                self.steps = []
+            prune_build_cache()
+        self.next_step()
+
+    def step_failed(self, error):
+        # Only a program that never started is handled here; crashes and
+        # kills still end in finished
+        process = self.process
+        if error != QProcess.FailedToStart or process is None or process is not self.sender():
+            return
+        self.output.emit(f"[could not start {self.steps[0].argv[0]}: {process.errorString()}]\n")
+        self.process = None
+        process.deleteLater()
+        self.steps = []
+        self.stats['status'] = -1
+        self.finish()
+
+    def finish(self):
+        problems = self.parser.finish()
+        if problems:
+            self.stats['problems'] += len(problems)
+            self.problems_found.emit(problems)
+        self.stats['seconds'] = time.perf_counter() - self.started
+        self.output.emit(f"[{self.stats['name']} exited with status {self.stats['status']} "
+                         f"in {self.stats['seconds']:.2f}s]\n")
+        self.run_finished.emit(dict(self.stats))
+
+    def stop(self):
+        process = self.process
+        if process is None:
+            return
+        step = self.steps[0] if self.steps else None
+        self.steps = []
+        self.process = None
+        process.finished.disconnect(self.step_finished)
+        process.kill()
+        process.waitForFinished(1000)
+        process.deleteLater()
+        if step is not None and step.output is not None:
+            self.discard(step.output)
+        self.stats['status'] = -1
+        self.output.emit("[stopped]\n")
+        self.finish()
+
+    @staticmethod
+    def discard(path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
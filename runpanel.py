@@ -0,0 +1,121 @@
+import os
+from PyQt5.QtWidgets import (
+    QWidget, QVBoxLayout, QHBoxLayout, QPlainTextEdit, QTreeWidget, QTreeWidgetItem,
+    QLabel, QPushButton, QSplitter
+)
+from PyQt5.QtCore import Qt, pyqtSignal
+from PyQt5.QtGui import QColor
+from runner import BuildRunner
+from terminal import OutputBuffer
+
+PROBLEM_LOCATION_ROLE = Qt.UserRole
+SEVERITY_COLORS = {
+    'error': QColor("#ff5555"),
+    'warning': QColor("#f1fa8c"),
+    'note': QColor("#6272a4"),
+}
+
+
+class RunPanel(QWidget):
+    open_requested = pyqtSignal(str, int, int)
+    close_requested = pyqtSignal()
+
+    def __init__(self, env=None, style_sheet="", parent=None):
+        super().__init__(parent)
+        self.runner = BuildRunner(env, self)
+        self.runner.run_started.connect(self.run_started)
+        self.runner.output.connect(self.write_output)
+        self.runner.problems_found.connect(self.add_problems)
+        self.runner.run_finished.connect(self.run_finished)
+        self.cwd = None
+        self.counts = {}
+
+        self.status = QLabel()
+        self.status.setStyleSheet("color: #6272a4; padding: 5px;")
+
+        self.stop_btn = QPushButton("Stop")
+        self.stop_btn.clicked.connect(self.runner.stop)
+        self.stop_btn.setEnabled(False)
+
+        self.close_btn = QPushButton("x")
+        self.close_btn.setFixedWidth(25)
+        self.close_btn.clicked.connect(self.close_requested)
+
+        header_layout = QHBoxLayout()
+        header_layout.addWidget(self.status)
+        header_layout.addStretch()
+        header_layout.addWidget(self.stop_btn)
+        header_layout.addWidget(self.close_btn)
+
+        # Painted through the same throttled buffer as the terminals, so a
+        # noisy program can't flood the event loop
+        self.console = QPlainTextEdit()
+        self.console.setReadOnly(True)
+        self.console.setStyleSheet(style_sheet)
+        self.console_output = OutputBuffer(self.console)
+
+        self.problems = QTreeWidget()
+        self.problems.setHeaderHidden(True)
+        self.problems.itemActivated.connect(self.open_problem)
+        self.problems.itemDoubleClicked.connect(self.open_problem)
+
+        splitter = QSplitter(Qt.Horizontal)
+        splitter.addWidget(self.console)
+        splitter.addWidget(self.problems)
+        splitter.setSizes([600, 400])
+
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addLayout(header_layout)
+        layout.addWidget(splitter)
+        self.setLayout(layout)
+
+    def run_file(self, path):
+        self.cwd = os.path.dirname(os.path.abspath(path))
+        self.runner.run_file(path)
+
+    def run_task(self, task):
+        self.cwd = task.cwd
+        self.runner.run_task(task)
+
+    def run_started(self, name):
+        self.console_output.flush()
+        self.console.clear()
+        self.problems.clear()
+        self.counts = {}
+        self.stop_btn.setEnabled(True)
+        self.status.setText(f"Running {name}…")
+
+    def write_output(self, text):
+        self.console_output.write_text(text)
+
+    def add_problems(self, problems):
+        items = []
+        for problem in problems:
+            path = os.path.relpath(problem.path, self.cwd) if self.cwd else problem.path
+            if path.startswith('..'):
+                path = problem.path
+            item = QTreeWidgetItem([f"{path}:{problem.line}:{problem.column + 1}  {problem.severity}: {problem.message}"])
+            item.setForeground(0, SEVERITY_COLORS.get(problem.severity, SEVERITY_COLORS['note']))
+            item.setToolTip(0, problem.message)
+            item.setData(0, PROBLEM_LOCATION_ROLE, (problem.path, problem.line, problem.column))
+            items.append(item)
+            self.counts[problem.severity] = self.counts.get(problem.severity, 0) + 1
+        self.problems.addTopLevelItems(items)
+
+    def run_finished(self, stats):
+        self.stop_btn.setEnabled(False)
+        summary = ", ".join(f"{count} {severity}s" for severity, count in self.counts.items()) or "no problems"
+        cached = ", build cached" if stats['cached'] else ""
+        self.status.setText(
+            f"{stats['name']}: exit status {stats['status']} in {stats['seconds']:.2f}s, {summary}{cached}"
+        )
+
+    def open_problem(self, item, column=0):
+        location = item.data(0, PROBLEM_LOCATION_ROLE)
+        if location is not None and os.path.isfile(location[0]):
+            path, line, col = location
+            self.open_requested.emit(path, line, col)
+
+    def shutdown(self):
+        self.runner.stop()
@@ -0,0 +1,201 @@
+import os
+import re
+import time
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+from filetree import IgnoreRules
+from fileindex import walk_project
+
+FILES_PER_TASK = 64
+MAX_FILE_SIZE = 16 * 1024 * 1024
+MAX_MATCHES_PER_FILE = 1000
+MAX_TOTAL_MATCHES = 20000
+MAX_LINE_PREVIEW = 300
+# Files with a NUL byte in their first block are treated as binary
+BINARY_SNIFF_SIZE = 8192
+
+_executor = None
+
+
+def executor():
+    # One pool is kept for the life of the IDE; spawn avoids forking a
+    # process that has Qt threads running
+    global _executor
+    if _executor is None:
+        # Imported here: multiprocessing and concurrent.futures are slow to
+        # import and nothing needs them until the first search or index build
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        _executor = ProcessPoolExecutor(
+            max_workers=max(1, (os.cpu_count() or 2) - 1),
+            mp_context=multiprocessing.get_context('spawn')
+        )
+    return _executor
+
+
+def compile_query(query, use_regex=False, case_sensitive=False):
+    flags = re.MULTILINE
+    if not case_sensitive:
+        flags |= re.IGNORECASE
+    return re.compile(query if use_regex else re.escape(query), flags)
+
+
+def read_bytes(path):
+    try:
+        if os.path.getsize(path) > MAX_FILE_SIZE:
+            return None
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    if b'\0' in data[:BINARY_SNIFF_SIZE]:
+        return None
+    return data
+
+
+def read_text(path):
+    data = read_bytes(path)
+    return None if data is None else data.decode('utf-8', 'replace')
+
+
+def search_text(text, pattern, max_matches=MAX_MATCHES_PER_FILE):
+    # Line numbers are counted between consecutive matches instead of
+    # splitting the whole file into lines
+    matches = []
+    line_number = 1
+    line_start = 0
+    position = 0
+    for match in pattern.finditer(text):
+        start = match.start()
+        if start < line_start:
+            continue
+        line_number += text.count('\n', position, start)
+        line_start = text.rfind('\n', 0, start) + 1
+        line_end = text.find('\n', start)
+        if line_end < 0:
+            line_end = len(text)
+        position = start
+
+        preview = text[line_start:line_end]
+        column = start - line_start
+        length = min(match.end(), line_end) - start
+        matches.append((line_number, column, length, preview[:MAX_LINE_PREVIEW]))
+        if len(matches) >= max_matches:
+            break
+        # One result per line; later matches on it are already visible
+        line_start = line_end + 1
+    return matches
+
+
+def search_files(root_path, rel_paths, pattern_source, flags):
+    pattern = re.compile(pattern_source, flags)
+    results = []
+    scanned = 0
+    for rel_path in rel_paths:
+        text = read_text(os.path.join(root_path, rel_path))
+        if text is None:
+            continue
+        scanned += len(text)
+        matches = search_text(text, pattern)
+        if matches:
+            results.append((rel_path, matches))
+    return results, len(rel_paths), scanned
+
+
+class SearchTask(QRunnable):
+    def __init__(self, search, generation, root_path, pattern, rel_paths=None):
+        super().__init__()
+        self.search = search
+        self.generation = generation
+        self.root_path = root_path
+        self.pattern = pattern
+        self.rel_paths = rel_paths
+        self.rules = IgnoreRules(root_path, search.ignore_patterns)
+
+    def cancelled(self):
+        return self.search.generation != self.generation
+
+    def submit(self, rel_paths):
+        args = (self.root_path, rel_paths, self.pattern.pattern, self.pattern.flags)
+        try:
+            return executor().submit(search_files, *args)
+        except (OSError, RuntimeError):
+            # Without worker processes the batch is searched on this thread
+            from concurrent.futures import Future
+            future = Future()
+            future.set_result(search_files(*args))
+            return future
+
+    def run(self):
+        from concurrent.futures import FIRST_COMPLETED, wait
+
+        started = time.perf_counter()
+        rel_paths = self.rel_paths
+        if rel_paths is None:
+            rel_paths = walk_project(self.root_path, self.rules)
+        total_files = len(rel_paths)
+        # The content index narrows the files down to those that can match;
+        # every candidate is still searched to confirm it
+        if self.search.index is not None:
+            rel_paths = self.search.index.candidates(self.root_path, rel_paths, self.pattern)
+
+        pending = set()
+        for offset in range(0, len(rel_paths), FILES_PER_TASK):
+            pending.add(self.submit(rel_paths[offset:offset + FILES_PER_TASK]))
+
+        files_done = 0
+        matches_found = 0
+        bytes_scanned = 0
+        # Batches are streamed back as they finish, in whatever order that is
+        while pending:
+            if self.cancelled() or matches_found >= MAX_TOTAL_MATCHES:
+                for future in pending:
+                    future.cancel()
+                break
+            done, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    results, files, scanned = future.result()
+                except Exception:
+                    continue
+                files_done += files
+                bytes_scanned += scanned
+                if results and not self.cancelled():
+                    matches_found += sum(len(matches) for _, matches in results)
+                    self.search.results_found.emit(self.generation, results)
+            self.search.progress.emit(self.generation, files_done, len(rel_paths))
+
+        self.search.search_finished.emit(self.generation, {
+            'files': files_done,
+            'total_files': total_files,
+            'matches': matches_found,
+            'bytes': bytes_scanned,
+            'seconds': time.perf_counter() - started,
+            'cancelled': self.cancelled(),
+        })
+
+
+class ProjectSearch(QObject):
+    results_found = pyqtSignal(int, list)
+    progress = pyqtSignal(int, int, int)
+    search_finished = pyqtSignal(int, dict)
+
+    def __init__(self, ignore_patterns=None, index=None, parent=None):
+        super().__init__(parent)
+        self.ignore_patterns = ignore_patterns
+        self.index = index
+        self.generation = 0
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(2)
+
+    def start(self, root_path, pattern, rel_paths=None):
+        # Bumping the generation cancels whatever search is still running
+        self.generation += 1
+        self.pool.start(SearchTask(self, self.generation, root_path, pattern, rel_paths))
+        return self.generation
+
+    def cancel(self):
+        self.generation += 1
+
+    def wait(self):
+        self.cancel()
+        self.pool.waitForDone()
@@ -0,0 +1,359 @@
+import os
+import re
+from PyQt5.QtWidgets import (
+    QWidget, QVBoxLayout, QHBoxLayout, QLineEdit, QCheckBox, QPushButton,
+    QTreeWidget, QTreeWidgetItem, QLabel
+)
+from PyQt5.QtCore import Qt, pyqtSignal
+from PyQt5.QtGui import QColor
+from search import ProjectSearch, compile_query
+from replace import ProjectReplace, literal_template, replace_in_document
+
+RESULT_LOCATION_ROLE = Qt.UserRole
+REMOVED_COLOR = QColor("#ff5555")
+ADDED_COLOR = QColor("#50fa7b")
+
+
+class SearchPanel(QWidget):
+    open_requested = pyqtSignal(str, int, int)
+    # Open tabs changed in place by a replace, and files rewritten on disk
+    documents_replaced = pyqtSignal(list)
+    files_replaced = pyqtSignal(list)
+
+    def __init__(self, ignore_patterns=None, index=None, documents=None, parent=None):
+        super().__init__(parent)
+        self.root_path = None
+        self.documents = documents
+        self.search = ProjectSearch(ignore_patterns, index, self)
+        self.search.results_found.connect(self.add_results)
+        self.search.progress.connect(self.show_progress)
+        self.search.search_finished.connect(self.search_finished)
+        self.generation = None
+        self.file_items = {}
+
+        self.replace = ProjectReplace(ignore_patterns, index, self)
+        self.replace.preview_found.connect(self.add_preview)
+        self.replace.progress.connect(self.show_preview_progress)
+        self.replace.preview_finished.connect(self.preview_finished)
+        self.replace.apply_finished.connect(self.apply_finished)
+        self.replace_generation = None
+        # The pattern and template the shown preview was made with, and the
+        # replacement count and content hash per file
+        self.replace_plan = None
+        self.preview = {}
+        # The running replace: its generation and root, which a project
+        # switch doesn't change, and the tabs, replacements and skipped
+        # files done before it started
+        self.applying = None
+
+        self.query_input = QLineEdit()
+        self.query_input.setPlaceholderText("Search in folder...")
+        self.query_input.returnPressed.connect(self.start_search)
+
+        self.replace_input = QLineEdit()
+        self.replace_input.setPlaceholderText("Replace with...")
+        self.replace_input.returnPressed.connect(self.start_preview)
+
+        self.regex_toggle = QCheckBox("Regex")
+        self.case_toggle = QCheckBox("Match case")
+
+        self.search_btn = QPushButton("Search")
+        self.search_btn.clicked.connect(self.start_search)
+        self.cancel_btn = QPushButton("Cancel")
+        self.cancel_btn.clicked.connect(self.cancel_search)
+        self.cancel_btn.setEnabled(False)
+
+        options_layout = QHBoxLayout()
+        options_layout.addWidget(self.regex_toggle)
+        options_layout.addWidget(self.case_toggle)
+        options_layout.addStretch()
+        options_layout.addWidget(self.search_btn)
+        options_layout.addWidget(self.cancel_btn)
+
+        self.preview_btn = QPushButton("Preview")
+        self.preview_btn.clicked.connect(self.start_preview)
+        self.apply_btn = QPushButton("Replace All")
+        self.apply_btn.clicked.connect(self.apply_replace)
+        self.apply_btn.setEnabled(False)
+
+        replace_layout = QHBoxLayout()
+        replace_layout.addWidget(self.replace_input)
+        replace_layout.addWidget(self.preview_btn)
+        replace_layout.addWidget(self.apply_btn)
+
+        self.results = QTreeWidget()
+        self.results.setHeaderHidden(True)
+        self.results.itemActivated.connect(self.open_result)
+        self.results.itemDoubleClicked.connect(self.open_result)
+
+        self.status = QLabel()
+        self.status.setStyleSheet("color: #6272a4;")
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.query_input)
+        layout.addLayout(options_layout)
+        layout.addLayout(replace_layout)
+        layout.addWidget(self.results)
+        layout.addWidget(self.status)
+        self.setLayout(layout)
+
+    def set_root(self, root_path):
+        self.cancel_search()
+        self.root_path = root_path
+        self.clear_results()
+
+    def clear_results(self):
+        self.results.clear()
+        self.file_items = {}
+        self.replace_plan = None
+        self.preview = {}
+        self.apply_btn.setEnabled(False)
+
+    def compile_pattern(self):
+        query = self.query_input.text()
+        if not query:
+            return None
+        if self.root_path is None:
+            self.status.setText("Open a folder to search it")
+            return None
+        try:
+            return compile_query(query, self.regex_toggle.isChecked(), self.case_toggle.isChecked())
+        except re.error as e:
+            self.status.setText(f"Invalid regex: {e}")
+            return None
+
+    def start_search(self):
+        pattern = self.compile_pattern()
+        if pattern is None:
+            return
+
+        self.cancel_search()
+        self.clear_results()
+        self.generation = self.search.start(self.root_path, pattern)
+        self.cancel_btn.setEnabled(True)
+        self.status.setText("Searching…")
+
+    def cancel_search(self):
+        if self.generation is not None:
+            self.search.cancel()
+            self.generation = None
+            self.cancel_btn.setEnabled(False)
+            self.status.setText("Search cancelled")
+        if self.replace_generation is not None and self.replace_plan is not None:
+            # Only a preview; a running replace always finishes
+            self.replace.cancel()
+            self.replace_generation = None
+            self.cancel_btn.setEnabled(False)
+            self.status.setText("Preview cancelled")
+
+    def add_results(self, generation, results):
+        if generation != self.generation:
+            return
+
+        self.results.setUpdatesEnabled(False)
+        try:
+            for rel_path, matches in results:
+                file_item = self.file_items.get(rel_path)
+                if file_item is None:
+                    file_item = QTreeWidgetItem([rel_path])
+                    self.file_items[rel_path] = file_item
+                    self.results.addTopLevelItem(file_item)
+                    file_item.setExpanded(True)
+
+                path = os.path.join(self.root_path, rel_path)
+                children = []
+                for line, column, length, preview in matches:
+                    child = QTreeWidgetItem([f"{line}: {preview.strip()}"])
+                    child.setData(0, RESULT_LOCATION_ROLE, (path, line, column))
+                    children.append(child)
+                file_item.addChildren(children)
+        finally:
+            self.results.setUpdatesEnabled(True)
+
+    def show_progress(self, generation, done, total):
+        if generation == self.generation:
+            self.status.setText(f"Searching… {done}/{total} files")
+
+    def search_finished(self, generation, stats):
+        if generation != self.generation:
+            return
+        self.generation = None
+        self.cancel_btn.setEnabled(False)
+        self.status.setText(
+            f"{stats['matches']} matches in {len(self.file_items)} files "
+            f"({stats['files']} of {stats['total_files']} files searched, {stats['seconds']:.2f}s)"
+        )
+
+    def open_result(self, item, column=0):
+        location = item.data(0, RESULT_LOCATION_ROLE)
+        if location is not None:
+            path, line, col = location
+            self.open_requested.emit(path, line, col)
+
+    def open_texts(self):
+        # Tabs under the root are previewed and replaced from their own
+        # text; a tab whose text isn't in memory and differs from the file,
+        # or is still loading, is left out rather than guessed at
+        texts = {}
+        skipped = set()
+        if self.documents is None:
+            return texts, skipped
+        root = os.path.abspath(self.root_path)
+        for document in list(self.documents.documents.values()):
+            if not document.path:
+                continue
+            rel_path = os.path.relpath(os.path.abspath(document.path), root)
+            if rel_path.startswith('..'):
+                continue
+            if document.hibernated is None and not document.loading:
+                texts[rel_path] = document.editor.toPlainText()
+            elif document.loading or document.is_dirty():
+                skipped.add(rel_path)
+        return texts, skipped
+
+    def start_preview(self):
+        pattern = self.compile_pattern()
+        if pattern is None:
+            return
+        replacement = self.replace_input.text()
+        template = replacement if self.regex_toggle.isChecked() else literal_template(replacement)
+        try:
+            # Compiles the template, so bad group references show up now
+            pattern.sub(template, '')
+        except (re.error, IndexError) as e:
+            self.status.setText(f"Invalid replacement: {e}")
+            return
+
+        self.cancel_search()
+        self.clear_results()
+        self.replace_plan = (pattern, template)
+        texts, skipped = self.open_texts()
+        self.replace_generation = self.replace.preview(self.root_path, pattern, template, texts, skipped)
+        self.cancel_btn.setEnabled(True)
+        self.status.setText("Previewing…")
+
+    def add_preview(self, generation, results):
+        if generation != self.replace_generation:
+            return
+
+        self.results.setUpdatesEnabled(False)
+        try:
+            for rel_path, count, hunks, content_hash in results:
+                self.preview[rel_path] = (count, content_hash)
+                file_item = QTreeWidgetItem([f"{rel_path} ({count})"])
+                file_item.setFlags(file_item.flags() | Qt.ItemIsUserCheckable)
+                file_item.setCheckState(0, Qt.Checked)
+                file_item.setData(0, RESULT_LOCATION_ROLE, None)
+                self.file_items[rel_path] = file_item
+                self.results.addTopLevelItem(file_item)
+
+                path = os.path.join(self.root_path, rel_path)
+                children = []
+                for line, old_lines, new_lines in hunks:
+                    for prefix, lines, color in (("-", old_lines, REMOVED_COLOR), ("+", new_lines, ADDED_COLOR)):
+                        for offset, text in enumerate(lines):
+                            child = QTreeWidgetItem([f"{line + offset} {prefix} {text}"])
+                            child.setForeground(0, color)
+                            child.setData(0, RESULT_LOCATION_ROLE, (path, line + offset, 0))
+                            children.append(child)
+                file_item.addChildren(children)
+                file_item.setExpanded(len(self.file_items) <= 50)
+        finally:
+            self.results.setUpdatesEnabled(True)
+
+    def show_preview_progress(self, generation, done, total):
+        if generation == self.replace_generation and self.replace_plan is not None:
+            self.status.setText(f"Previewing… {done}/{total} files")
+
+    def preview_finished(self, generation, stats):
+        if generation != self.replace_generation:
+            return
+        self.replace_generation = None
+        self.cancel_btn.setEnabled(False)
+        self.apply_btn.setEnabled(bool(self.preview))
+        skipped = f", {stats['skipped']} open files with unsaved changes skipped" if stats['skipped'] else ""
+        self.status.setText(
+            f"{stats['replacements']} replacements in {len(self.preview)} files "
+            f"({stats['files']} of {stats['total_files']} files read, {stats['seconds']:.2f}s, "
+            f"{stats['files_per_second']:,.0f} files/s){skipped}"
+        )
+
+    def apply_replace(self):
+        if self.replace_plan is None or self.replace_generation is not None:
+            return
+        pattern, template = self.replace_plan
+        on_disk = []
+        edited = []
+        unsaved = 0
+        skipped = []
+        replaced = 0
+        for rel_path, (count, content_hash) in self.preview.items():
+            item = self.file_items[rel_path]
+            if item.checkState(0) != Qt.Checked:
+                continue
+            # Tabs are looked up again, since files can be opened or closed
+            # after the preview; an open file is never rewritten on disk
+            # behind its tab
+            document = self.documents.find(os.path.join(self.root_path, rel_path)) if self.documents else None
+            if document is not None and document.hibernated is None and not document.loading:
+                # Open tabs are edited in place, as one undoable change. Only
+                # tabs without unsaved edits are saved from there; any other
+                # tab keeps the replace as one more unsaved change, so text
+                # the user never chose to save isn't written with it.
+                dirty = document.is_dirty()
+                replaced += replace_in_document(document.editor.document(), pattern, template)
+                if dirty:
+                    unsaved += 1
+                else:
+                    edited.append(document.editor)
+            elif document is not None and (document.loading or document.is_dirty()):
+                skipped.append((item, rel_path, "open with unsaved changes"))
+            elif content_hash is not None:
+                # Hibernated clean tabs reload from disk when next shown
+                on_disk.append((rel_path, content_hash))
+            else:
+                # Previewed from a tab's text, which has gone since
+                skipped.append((item, rel_path, "tab closed since the preview"))
+        if edited:
+            self.documents_replaced.emit(edited)
+        for item, rel_path, reason in skipped:
+            item.setText(0, f"{rel_path} — skipped, {reason}")
+            item.setForeground(0, REMOVED_COLOR)
+
+        self.apply_btn.setEnabled(False)
+        self.replace_plan = None
+        self.replace_generation = self.replace.apply(self.root_path, pattern, template, on_disk)
+        self.applying = (
+            self.replace_generation, self.root_path, len(edited) + unsaved, replaced, len(skipped), unsaved
+        )
+        self.status.setText(f"Replacing in {len(on_disk) + len(edited) + unsaved} files…")
+
+    def apply_finished(self, generation, results, stats):
+        # Matched against the replace itself rather than replace_generation,
+        # so files are still re-indexed after a new preview or a project
+        # switch while the replace ran
+        if self.applying is None or generation != self.applying[0]:
+            return
+        _, root_path, tabs, tab_replacements, skipped, unsaved = self.applying
+        self.applying = None
+        self.files_replaced.emit([
+            os.path.join(root_path, rel_path) for rel_path, count, error in results if count
+        ])
+        if generation != self.replace_generation:
+            return
+        self.replace_generation = None
+        if root_path != self.root_path:
+            return
+        for rel_path, count, error in results:
+            item = self.file_items.get(rel_path)
+            if item is not None and error:
+                item.setText(0, f"{rel_path} — {error}")
+                item.setForeground(0, REMOVED_COLOR)
+        failed = f", {stats['failed']} failed" if stats['failed'] else ""
+        skipped = f", {skipped} skipped" if skipped else ""
+        unsaved = f", {unsaved} tabs with unsaved changes not saved" if unsaved else ""
+        self.status.setText(
+            f"Replaced {stats['replacements'] + tab_replacements} occurrences in "
+            f"{stats['files'] + tabs} files ({stats['seconds']:.2f}s, "
+            f"{stats['files_per_second']:,.0f} files/s){failed}{skipped}{unsaved}"
+        )
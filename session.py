@@ -0,0 +1,62 @@
+import os
+import json
+from fileio import atomic_write
+from storage import cache_dir, project_cache_file
+
+SESSION_FILE_NAME = 'session.json'
+TREE_SNAPSHOT_NAME = 'tree.json'
+# Bumped whenever the layout changes; older files are ignored, not migrated
+SESSION_VERSION = 1
+
+
+def session_file():
+    return os.path.join(cache_dir(), SESSION_FILE_NAME)
+
+
+def read_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(data, dict) or data.get('version') != SESSION_VERSION:
+        return None
+    return data
+
+
+def write_json(path, data):
+    atomic_write(path, json.dumps(dict(data, version=SESSION_VERSION)))
+
+
+def load_session():
+    # {'root': folder or None, 'expanded': [dir, ...], 'active': tab index,
+    #  'tabs': [{'path': ..., 'position': ..., 'scroll': ...}, ...]}
+    return read_json(session_file())
+
+
+def save_session(state):
+    try:
+        write_json(session_file(), state)
+    except OSError:
+        pass
+
+
+def load_tree_snapshot(root_path):
+    # Every directory the sidebar had listed, as {dir: [(name, is_dir), ...]}
+    data = read_json(project_cache_file(root_path, TREE_SNAPSHOT_NAME))
+    if data is None:
+        return {}
+    try:
+        return {
+            path: [(name, bool(is_dir)) for name, is_dir in entries]
+            for path, entries in data['dirs'].items()
+        }
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return {}
+
+
+def save_tree_snapshot(root_path, listings):
+    try:
+        write_json(project_cache_file(root_path, TREE_SNAPSHOT_NAME), {'dirs': listings})
+    except OSError:
+        pass
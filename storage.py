@@ -0,0 +1,18 @@
+import os
+import hashlib
+from pathlib import Path
+
+
+def cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME') or str(Path.home() / '.cache')
+    path = os.path.join(base, 'aidanide')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def project_cache_file(root_path, name):
+    # Each opened folder gets its own cache directory keyed by its absolute path
+    key = hashlib.sha1(os.path.abspath(root_path).encode('utf-8')).hexdigest()[:16]
+    path = os.path.join(cache_dir(), key)
+    os.makedirs(path, exist_ok=True)
+    return os.path.join(path, name)
@@ -0,0 +1,405 @@
+import os
+import re
+import ast
+import json
+import time
+from collections import namedtuple
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, QTimer, pyqtSignal
+from filetree import IgnoreRules
+from fileindex import walk_project
+from fileio import atomic_write
+from search import executor, read_bytes
+from storage import project_cache_file
+from trigramindex import file_stamp
+
+SYMBOL_INDEX_NAME = 'symbols.json'
+# Bumped whenever the layout changes; older indexes are rebuilt from scratch
+SYMBOL_INDEX_VERSION = 1
+REBUILD_DELAY_MS = 5000
+# Files parsed per job handed to a worker process
+EXTRACT_BATCH_SIZE = 64
+# Nobody picks from more definitions than this, however common the name
+MAX_LOOKUP_RESULTS = 500
+
+# line is 1-based like the search results, column 0-based; container is the
+# dotted name of the enclosing class or function, empty at the top level
+Symbol = namedtuple('Symbol', ['name', 'kind', 'line', 'column', 'container'])
+
+PYTHON_DEFINITION = re.compile(r'^[ \t]*(?:async[ \t]+)?(def|class)[ \t]+(\w+)', re.MULTILINE)
+
+# Comments and string literals are blanked out before the C patterns run,
+# keeping every offset, so commented-out code never shows up as a definition
+C_NOISE = re.compile(r'//[^\n]*|/\*.*?\*/|"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'', re.DOTALL)
+NON_NEWLINE = re.compile(r'[^\n]')
+C_DEFINITIONS = [
+    ('macro', re.compile(r'^[ \t]*#[ \t]*define[ \t]+(\w+)', re.MULTILINE)),
+    ('type', re.compile(
+        r'^[ \t]*(?:typedef[ \t]+)?(?:struct|class|union|enum)(?:[ \t]+class)?[ \t]+(\w+)[^;(){}]*\{',
+        re.MULTILINE
+    )),
+    # The name of a typedef'd anonymous struct comes after its body
+    ('type', re.compile(r'^\}[ \t]*(\w+)[ \t]*;', re.MULTILINE)),
+    # A name and parameter list followed by a body rather than a semicolon.
+    # Control statements look the same and are filtered out by name.
+    ('function', re.compile(
+        r'^[ \t]*(?:[A-Za-z_][\w:<>,*&~ \t]*?[\s*&])?([A-Za-z_~][\w:~]*)[ \t]*\([^;{}]*\)[^;{}()=]*\{',
+        re.MULTILINE
+    )),
+]
+# The fields of statements, exception handlers and match cases holding
+# nested statements
+BLOCK_FIELDS = ('body', 'orelse', 'finalbody', 'handlers', 'cases')
+C_STATEMENTS = frozenset((
+    'if', 'else', 'for', 'while', 'do', 'switch', 'return', 'sizeof', 'catch', 'case', 'defined',
+))
+
+
+def python_symbols(text):
+    try:
+        tree = ast.parse(text)
+    except (SyntaxError, ValueError):
+        # Files are often saved mid-edit; a scan of the definition lines
+        # still finds names, only without their containers
+        return regex_python_symbols(text)
+
+    lines = text.split('\n')
+    symbols = []
+    stack = [(tree, '', None)]
+    while stack:
+        node, container, owner = stack.pop()
+        for child in block_statements(node):
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                if isinstance(child, ast.ClassDef):
+                    kind = 'class'
+                else:
+                    kind = 'method' if isinstance(owner, ast.ClassDef) else 'function'
+                # col_offset is where def or class starts; the name follows it
+                line = lines[child.lineno - 1] if child.lineno <= len(lines) else ''
+                column = line.find(child.name, child.col_offset)
+                symbols.append(Symbol(child.name, kind, child.lineno, max(column, 0), container))
+                qualified = container + '.' + child.name if container else child.name
+                stack.append((child, qualified, child))
+            else:
+                # Definitions inside if, try and with blocks still count
+                stack.append((child, container, owner))
+    symbols.sort(key=lambda symbol: symbol.line)
+    return symbols
+
+
+def block_statements(node):
+    # Definitions are statements, so only statement lists are walked and
+    # expressions, which make up most of the tree, are never visited
+    for field in BLOCK_FIELDS:
+        statements = getattr(node, field, None)
+        if statements:
+            yield from statements
+
+
+def regex_python_symbols(text):
+    symbols = []
+    line = 1
+    last = 0
+    for match in PYTHON_DEFINITION.finditer(text):
+        line += text.count('\n', last, match.start())
+        last = match.start()
+        keyword, name = match.groups()
+        symbols.append(Symbol(name, 'class' if keyword == 'class' else 'function', line, match.start(2) - match.start(), ''))
+    return symbols
+
+
+def c_symbols(text):
+    text = C_NOISE.sub(lambda match: NON_NEWLINE.sub(' ', match.group()), text)
+    found = []
+    for kind, pattern in C_DEFINITIONS:
+        for match in pattern.finditer(text):
+            name = match.group(1)
+            if kind == 'function' and name in C_STATEMENTS:
+                continue
+            found.append((match.start(1), kind, name))
+    found.sort()
+
+    symbols = []
+    line = 1
+    last = 0
+    for offset, kind, name in found:
+        line += text.count('\n', last, offset)
+        last = offset
+        column = offset - text.rfind('\n', 0, offset) - 1
+        # Out-of-line C++ members are indexed under their own name
+        container = ''
+        if '::' in name:
+            container, _, name = name.rpartition('::')
+            column += len(container) + 2
+            container = container.replace('::', '.')
+        symbols.append(Symbol(name, kind, line, column, container))
+    return symbols
+
+
+SYMBOL_EXTRACTORS = {
+    '.py': python_symbols,
+    '.c': c_symbols,
+    '.cpp': c_symbols,
+    '.h': c_symbols,
+}
+
+
+def register_extractor(extension, extractor):
+    SYMBOL_EXTRACTORS[extension.lower()] = extractor
+
+
+def extractor_for_path(path):
+    if not path:
+        return None
+    return SYMBOL_EXTRACTORS.get(os.path.splitext(path)[1].lower())
+
+
+def file_symbols(path):
+    extractor = extractor_for_path(path)
+    data = read_bytes(path) if extractor is not None else None
+    if data is None:
+        return []
+    return extractor(data.decode('utf-8', 'replace'))
+
+
+def load_symbol_files(index_file):
+    # {rel_path: [mtime_ns, size, [[name, kind, line, column, container], ...]]}
+    try:
+        with open(index_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(data, dict) or data.get('version') != SYMBOL_INDEX_VERSION:
+        return {}
+    files = data.get('files')
+    return files if isinstance(files, dict) else {}
+
+
+def source_files(root_path, patterns):
+    rules = IgnoreRules(root_path, patterns)
+    return [rel_path for rel_path in walk_project(root_path, rules) if extractor_for_path(rel_path)]
+
+
+def extract_files(root_path, rel_paths):
+    return [[list(symbol) for symbol in file_symbols(os.path.join(root_path, rel_path))] for rel_path in rel_paths]
+
+
+def build_symbol_index(root_path, patterns, index_file, pool=None):
+    # Files whose mtime and size still match the previous index keep their
+    # symbols; the rest are parsed again, in batches spread over the worker
+    # processes when a pool is given, since ast.parse dominates a full build
+    started = time.perf_counter()
+    if pool is not None:
+        rel_paths = pool.submit(source_files, root_path, patterns).result()
+    else:
+        rel_paths = source_files(root_path, patterns)
+    previous = load_symbol_files(index_file)
+
+    files = {}
+    changed = []
+    for rel_path in rel_paths:
+        stamp = list(file_stamp(os.path.join(root_path, rel_path)))
+        entry = previous.get(rel_path)
+        if entry is not None and entry[:2] == stamp:
+            files[rel_path] = entry
+        else:
+            files[rel_path] = stamp
+            changed.append(rel_path)
+
+    batches = [changed[i:i + EXTRACT_BATCH_SIZE] for i in range(0, len(changed), EXTRACT_BATCH_SIZE)]
+    if pool is not None:
+        results = [pool.submit(extract_files, root_path, batch) for batch in batches]
+        results = [future.result() for future in results]
+    else:
+        results = [extract_files(root_path, batch) for batch in batches]
+    for batch, symbol_lists in zip(batches, results):
+        for rel_path, symbols in zip(batch, symbol_lists):
+            files[rel_path] = files[rel_path] + [symbols]
+
+    stats = {'files': len(rel_paths), 'changed': len(changed), 'written': False}
+    if changed or len(files) != len(previous):
+        try:
+            atomic_write(index_file, json.dumps({'version': SYMBOL_INDEX_VERSION, 'files': files}))
+            stats['written'] = True
+        except OSError:
+            pass
+    stats['symbols'] = sum(len(entry[2]) for entry in files.values())
+    stats['seconds'] = time.perf_counter() - started
+    return stats, files
+
+
+class SymbolTable:
+    # Every definition in the project by file and by name. Only ever touched
+    # on the GUI thread once it has been handed over by the loading task.
+    def __init__(self, files=None):
+        self.files = {}
+        self.names = {}
+        for rel_path, symbols in (files or {}).items():
+            self.replace(rel_path, symbols)
+
+    @classmethod
+    def from_index(cls, files):
+        try:
+            return cls({
+                rel_path: [Symbol(*symbol) for symbol in entry[2]]
+                for rel_path, entry in files.items()
+            })
+        except (TypeError, IndexError):
+            return cls()
+
+    def replace(self, rel_path, symbols):
+        for symbol in self.files.pop(rel_path, ()):
+            entries = self.names.get(symbol.name)
+            if entries is None:
+                continue
+            entries[:] = [entry for entry in entries if entry[0] != rel_path]
+            if not entries:
+                del self.names[symbol.name]
+        if symbols:
+            self.files[rel_path] = symbols
+            for symbol in symbols:
+                self.names.setdefault(symbol.name, []).append((rel_path, symbol))
+
+    def lookup(self, name, limit=None):
+        return self.names.get(name, [])[:limit]
+
+    def __len__(self):
+        return sum(len(symbols) for symbols in self.files.values())
+
+
+class IndexBuildTask(QRunnable):
+    def __init__(self, index, generation, sequence):
+        super().__init__()
+        self.index = index
+        self.generation = generation
+        self.sequence = sequence
+        self.args = (index.root_path, index.patterns, index.index_file)
+
+    def run(self):
+        # The table is built here too, so a large index never blocks the GUI thread
+        try:
+            stats, files = build_symbol_index(*self.args, pool=executor())
+        except (OSError, RuntimeError):
+            # Without worker processes the index is built on this thread
+            stats, files = build_symbol_index(*self.args)
+        self.index.built.emit(self.generation, self.sequence, stats, SymbolTable.from_index(files))
+
+
+class UpdateTask(QRunnable):
+    def __init__(self, index, generation, sequence, rel_path, path):
+        super().__init__()
+        self.index = index
+        self.generation = generation
+        self.sequence = sequence
+        self.rel_path = rel_path
+        self.path = path
+
+    def run(self):
+        symbols = file_symbols(self.path)
+        self.index.updated.emit(self.generation, self.rel_path, (self.sequence, symbols))
+
+
+class SymbolIndex(QObject):
+    built = pyqtSignal(int, int, dict, object)
+    updated = pyqtSignal(int, str, tuple)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.build_pool = QThreadPool(self)
+        self.build_pool.setMaxThreadCount(1)
+        self.update_pool = QThreadPool(self)
+        self.update_pool.setMaxThreadCount(1)
+        self.root_path = None
+        self.patterns = None
+        self.rules = None
+        self.index_file = None
+        self.generation = 0
+        self.sequence = 0
+        self.building = False
+        self.last_build = None
+        self.table = SymbolTable()
+        # Files saved since the last build started, re-applied over its result
+        self.overlay = {}
+
+        self.built.connect(self.apply_build)
+        self.updated.connect(self.apply_update)
+
+        self.rebuild_timer = QTimer(self)
+        self.rebuild_timer.setSingleShot(True)
+        self.rebuild_timer.setInterval(REBUILD_DELAY_MS)
+        self.rebuild_timer.timeout.connect(self.rebuild)
+
+    def open_root(self, root_path, patterns=None):
+        self.root_path = os.path.abspath(root_path)
+        self.patterns = patterns
+        self.rules = IgnoreRules(self.root_path, patterns)
+        self.index_file = project_cache_file(self.root_path, SYMBOL_INDEX_NAME)
+        self.generation += 1
+        self.building = False
+        self.table = SymbolTable()
+        self.overlay = {}
+        self.rebuild()
+
+    def wait(self):
+        self.rebuild_timer.stop()
+        self.build_pool.waitForDone()
+        self.update_pool.waitForDone()
+
+    def schedule_rebuild(self):
+        if self.root_path is not None:
+            self.rebuild_timer.start()
+
+    def rebuild(self):
+        if self.root_path is None:
+            return
+        if self.building:
+            self.rebuild_timer.start()
+            return
+        self.building = True
+        self.build_pool.start(IndexBuildTask(self, self.generation, self.sequence))
+
+    def apply_build(self, generation, sequence, stats, table):
+        if generation != self.generation:
+            return
+        self.building = False
+        self.last_build = stats
+        # Saves made after the build started aren't in the new index yet
+        self.overlay = {
+            rel_path: entry for rel_path, entry in self.overlay.items()
+            if entry[0] > sequence
+        }
+        for rel_path, (_, symbols) in self.overlay.items():
+            table.replace(rel_path, symbols)
+        self.table = table
+
+    def relative_path(self, path):
+        if self.root_path is None or extractor_for_path(path) is None:
+            return None
+        rel_path = os.path.relpath(os.path.abspath(path), self.root_path)
+        if rel_path.startswith('..') or self.rules.is_ignored(path, False):
+            return None
+        return rel_path.replace(os.sep, '/')
+
+    def absolute_path(self, rel_path):
+        return os.path.join(self.root_path, rel_path)
+
+    def update_file(self, path):
+        rel_path = self.relative_path(path)
+        if rel_path is None:
+            return
+        self.sequence += 1
+        self.update_pool.start(UpdateTask(self, self.generation, self.sequence, rel_path, path))
+
+    def apply_update(self, generation, rel_path, entry):
+        if generation != self.generation:
+            return
+        current = self.overlay.get(rel_path)
+        if current is None or current[0] < entry[0]:
+            self.overlay[rel_path] = entry
+            self.table.replace(rel_path, entry[1])
+
+    def lookup(self, name, limit=MAX_LOOKUP_RESULTS):
+        # [(absolute path, Symbol), ...], in path order except for files
+        # saved since the last build, which come last
+        if self.root_path is None:
+            return []
+        return [(self.absolute_path(rel_path), symbol) for rel_path, symbol in self.table.lookup(name, limit)]
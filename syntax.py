@@ -0,0 +1,646 @@
+import os
+import re
+from collections import namedtuple
+from PyQt5.QtCore import QObject
+from profiler import timed
+
+# Documents above this many characters are not parsed at all
+PARSE_SIZE_LIMIT = 8 * 1024 * 1024
+# Rough memory cost of one parsed line, for the tab memory estimate
+PARSED_LINE_SIZE = 300
+# A bracket whose partner is further away than this many lines gets no
+# match highlight, rather than parsing a huge file to find it
+BRACKET_SEARCH_LINES = 5000
+
+# tokens   - flat tuple of (start, length, kind) triples
+# brackets - flat tuple of (column, character) pairs, code only
+# state    - parser state at the end of the line; the next line starts in it
+# indent   - indentation of the line's first code token, None when there is none
+# marker   - 'suite' for a Python line opening an indented block, 'open' and
+#            'close' for C preprocessor conditionals
+ParsedLine = namedtuple('ParsedLine', ['tokens', 'brackets', 'state', 'indent', 'marker'])
+
+OPENING_BRACKETS = {'(': ')', '[': ']', '{': '}'}
+CLOSING_BRACKETS = {')': '(', ']': '[', '}': '{'}
+
+
+def keyword_group(keywords):
+    return r'\b(?:' + '|'.join(keywords) + r')\b'
+
+
+NUMBER_PATTERN = r'\b(?:0[xXoObB][\da-fA-F_]+|\d[\d_]*\.?[\d_]*(?:[eE][+-]?\d+)?)[jJlLuUfF]*\b'
+
+
+class Parser:
+    # Backends parse one line at a time from the state the previous line
+    # ended in, which is what lets SyntaxTree re-parse only an edited range.
+    # Subclasses set initial_state and define parse_line(text, state), which
+    # takes a line without its line break and returns a ParsedLine whose
+    # state the next line is parsed from. Patterns are given as source and
+    # compiled the first time a parser is created.
+    initial_state = None
+    patterns = {}
+
+    def __init__(self):
+        cls = type(self)
+        if cls.__dict__.get('compiled') is None:
+            cls.compiled = {name: re.compile(source) for name, source in cls.patterns.items()}
+
+
+PYTHON_KEYWORDS = [
+    'def', 'class', 'if', 'else', 'elif', 'while', 'for', 'in', 'try',
+    'except', 'finally', 'with', 'as', 'import', 'from', 'return', 'pass',
+    'break', 'continue', 'True', 'False', 'None', 'and', 'or', 'not', 'is',
+    'lambda', 'yield', 'raise', 'assert', 'del', 'global', 'nonlocal',
+    'async', 'await'
+]
+
+
+class PythonParser(Parser):
+    # State is None, or (quote, is_fstring) inside a triple-quoted string
+    patterns = {
+        'token': (
+            r'(?P<comment>#.*)'
+            r'|(?P<string>(?P<prefix>\b[rRbBuUfF]{1,2})?(?P<quote>\'\'\'|"""|\'|"))'
+            r'|(?P<definition>\b(?:def|class)\b)\s+(?P<name>\w+)'
+            r'|(?P<decorator>@[\w.]+)'
+            r'|(?P<keyword>' + keyword_group(PYTHON_KEYWORDS) + ')'
+            r'|(?P<number>' + NUMBER_PATTERN + ')'
+            r'|(?P<bracket>[()\[\]{}])'
+        ),
+        # String bodies up to and including the closing quote; the f-string
+        # variants stop at a replacement field instead
+        "'''": r"(?:[^'\\]|\\.|'(?!''))*'''",
+        '"""': r'(?:[^"\\]|\\.|"(?!""))*"""',
+        "'": r"(?:[^'\\]|\\.)*'",
+        '"': r'(?:[^"\\]|\\.)*"',
+        "f'''": r"(?:[^'\\{]|\\.|\{\{|'(?!''))*",
+        'f"""': r'(?:[^"\\{]|\\.|\{\{|"(?!""))*',
+        "f'": r"(?:[^'\\{]|\\.|\{\{)*",
+        'f"': r'(?:[^"\\{]|\\.|\{\{)*',
+    }
+
+    def parse_line(self, text, state):
+        tokens = []
+        brackets = []
+        pos = 0
+        if state is not None:
+            pos = self.string_end(text, 0, 0, state[0], state[1], tokens)
+            if pos < 0:
+                return ParsedLine(tuple(tokens), (), state, None, None)
+
+        stripped = text.lstrip()
+        indent = None
+        if state is None and stripped and not stripped.startswith('#'):
+            indent = len(text) - len(stripped)
+
+        token_pattern = self.compiled['token']
+        code_end = len(text)
+        while True:
+            match = token_pattern.search(text, pos)
+            if match is None:
+                break
+            kind = match.lastgroup
+            start = match.start()
+            if kind == 'comment':
+                tokens += (start, len(text) - start, 'comment')
+                code_end = start
+                break
+            if kind == 'string':
+                prefix = match.group('prefix') or ''
+                quote = match.group('quote')
+                fstring = 'f' in prefix.lower()
+                end = self.string_end(text, start, match.end(), quote, fstring, tokens)
+                if end < 0:
+                    if len(quote) == 3:
+                        return ParsedLine(tuple(tokens), tuple(brackets), (quote, fstring), indent, None)
+                    # An unterminated single-quoted string stops at the end of the line
+                    return ParsedLine(tuple(tokens), tuple(brackets), None, indent, None)
+                pos = end
+                continue
+            if kind == 'name':
+                tokens += (start, match.end('definition') - start, 'keyword')
+                tokens += (match.start('name'), len(match.group('name')), 'definition')
+            elif kind == 'decorator':
+                # Only at the start of a line; elsewhere @ is matrix multiplication
+                if start == indent:
+                    tokens += (start, match.end() - start, 'decorator')
+            elif kind == 'bracket':
+                brackets += (start, match.group())
+            else:
+                tokens += (start, match.end() - start, kind)
+            pos = match.end()
+
+        marker = 'suite' if indent is not None and text[:code_end].rstrip().endswith(':') else None
+        return ParsedLine(tuple(tokens), tuple(brackets), None, indent, marker)
+
+    def string_end(self, text, start, pos, quote, fstring, tokens):
+        # Adds the string's tokens from start and returns where it ends, or
+        # -1 when it is still open at the end of the line
+        if not fstring:
+            end = self.compiled[quote].match(text, pos)
+            stop = end.end() if end else len(text)
+            tokens += (start, stop - start, 'string')
+            return stop if end else -1
+
+        body = self.compiled['f' + quote]
+        while True:
+            pos = body.match(text, pos).end()
+            # A trailing backslash continues the string onto the next line
+            if pos >= len(text) or text[pos] == '\\':
+                tokens += (start, len(text) - start, 'string')
+                return -1
+            if text[pos] != '{':
+                stop = pos + len(quote)
+                tokens += (start, stop - start, 'string')
+                return stop
+            field_end = self.field_end(text, pos + 1)
+            if field_end < 0:
+                # A replacement field running onto the next line is left as string text
+                pos += 1
+                continue
+            tokens += (start, pos - start, 'string')
+            tokens += (pos, 1, 'interpolation')
+            self.parse_expression(text, pos + 1, field_end, tokens)
+            tokens += (field_end, 1, 'interpolation')
+            start = pos = field_end + 1
+
+    def field_end(self, text, pos):
+        depth = 0
+        for i in range(pos, len(text)):
+            char = text[i]
+            if char in OPENING_BRACKETS:
+                depth += 1
+            elif char in CLOSING_BRACKETS:
+                if depth == 0:
+                    return i if char == '}' else -1
+                depth -= 1
+        return -1
+
+    def parse_expression(self, text, pos, end, tokens):
+        # Inside a replacement field only the simple tokens are picked out
+        token_pattern = self.compiled['token']
+        while True:
+            match = token_pattern.search(text, pos, end)
+            if match is None:
+                return
+            if match.lastgroup in ('keyword', 'number'):
+                tokens += (match.start(), match.end() - match.start(), match.lastgroup)
+            elif match.lastgroup == 'string':
+                close = self.compiled[match.group('quote')].match(text, match.end(), end)
+                stop = close.end() if close else end
+                tokens += (match.start(), stop - match.start(), 'string')
+                pos = stop
+                continue
+            pos = match.end()
+
+
+C_KEYWORDS = [
+    'int', 'float', 'double', 'char', 'bool', 'void', 'if', 'else',
+    'while', 'for', 'return', 'switch', 'case', 'break', 'continue',
+    'default', 'do', 'struct', 'class', 'public', 'private', 'protected',
+    'true', 'false', 'namespace', 'using', 'new', 'delete', 'const',
+    'static', 'unsigned', 'signed', 'long', 'short', 'enum', 'union',
+    'typedef', 'sizeof', 'extern', 'inline', 'template', 'typename',
+    'virtual', 'override', 'auto', 'nullptr', 'this', 'throw', 'try',
+    'catch', 'goto', 'volatile', 'register', 'constexpr', 'operator',
+    'friend', 'explicit', 'mutable', 'noexcept'
+]
+
+
+class CParser(Parser):
+    # State is (in_block_comment, depth of disabled #if 0 nesting)
+    initial_state = (False, 0)
+    patterns = {
+        'token': (
+            r'(?P<comment>//.*)'
+            r'|(?P<block_comment>/\*)'
+            r'|(?P<string>"(?:[^"\\]|\\.)*"?'
+            r"|'(?:[^'\\]|\\.)*'?)"
+            r'|(?P<keyword>' + keyword_group(C_KEYWORDS) + ')'
+            r'|(?P<number>' + NUMBER_PATTERN + ')'
+            r'|(?P<bracket>[()\[\]{}])'
+        ),
+        'comment_end': r'\*/',
+        'directive': r'\s*(#\s*(\w*))',
+        'include': r'\s*(<[^>]*>?|"[^"]*"?)',
+    }
+
+    def parse_line(self, text, state):
+        in_comment, disabled = state
+        tokens = []
+        brackets = []
+        marker = None
+        pos = 0
+
+        if in_comment:
+            end = self.compiled['comment_end'].search(text)
+            if end is None:
+                return ParsedLine((0, len(text), 'comment'), (), state, None, None)
+            tokens += (0, end.end(), 'comment')
+            pos = end.end()
+
+        directive = self.compiled['directive'].match(text, pos) if not in_comment else None
+        if directive is not None:
+            name = directive.group(2)
+            if name in ('if', 'ifdef', 'ifndef'):
+                marker = 'open'
+                if disabled or (name == 'if' and text[directive.end():].split('//')[0].strip() == '0'):
+                    disabled += 1
+            elif name == 'endif':
+                marker = 'close'
+                disabled = max(disabled - 1, 0)
+            elif name in ('else', 'elif') and disabled == 1:
+                disabled = 0
+            tokens += (directive.start(1), directive.end() - directive.start(1), 'preprocessor')
+            pos = directive.end()
+            if name == 'include':
+                path = self.compiled['include'].match(text, pos)
+                if path is not None:
+                    tokens += (path.start(1), len(path.group(1)), 'string')
+                    pos = path.end()
+        elif disabled:
+            # Code under #if 0 is shown as inactive and its brackets don't count
+            return ParsedLine((0, len(text), 'inactive'), (), state, None, None)
+
+        token_pattern = self.compiled['token']
+        while True:
+            match = token_pattern.search(text, pos)
+            if match is None:
+                break
+            kind = match.lastgroup
+            start = match.start()
+            if kind == 'comment':
+                tokens += (start, len(text) - start, 'comment')
+                break
+            if kind == 'block_comment':
+                end = self.compiled['comment_end'].search(text, match.end())
+                if end is None:
+                    tokens += (start, len(text) - start, 'comment')
+                    return ParsedLine(tuple(tokens), tuple(brackets), (True, disabled), None, marker)
+                tokens += (start, end.end() - start, 'comment')
+                pos = end.end()
+                continue
+            if kind == 'bracket':
+                brackets += (start, match.group())
+            else:
+                tokens += (start, match.end() - start, kind)
+            pos = match.end()
+
+        return ParsedLine(tuple(tokens), tuple(brackets), (False, disabled), None, marker)
+
+
+PARSERS = {
+    '.py': PythonParser,
+    '.c': CParser,
+    '.cpp': CParser,
+    '.h': CParser,
+}
+
+
+def register_parser(extension, parser_class):
+    PARSERS[extension.lower()] = parser_class
+
+
+def parser_for_path(path):
+    if not path:
+        return None
+    return PARSERS.get(os.path.splitext(path)[1].lower())
+
+
+def bracket_depths(brackets, depth):
+    # The depth before each of a line's brackets, given the depth it starts at
+    befores = []
+    for i in range(1, len(brackets), 2):
+        befores.append(depth)
+        depth = depth + 1 if brackets[i] in OPENING_BRACKETS else max(depth - 1, 0)
+    return befores
+
+
+class Node:
+    # A region of the document: a multi-line bracket pair, a Python block,
+    # a preprocessor conditional, or a string or comment spanning lines
+    __slots__ = ('kind', 'start', 'end', 'children', 'indent')
+
+    def __init__(self, kind, start, end=None, indent=None):
+        self.kind = kind
+        self.start = start
+        self.end = end
+        self.children = []
+        self.indent = indent
+
+    def folded_lines(self):
+        # Lines hidden when the node is folded; closing brackets and #endif
+        # stay visible under the line that opened them
+        if self.kind in ('bracket', 'conditional'):
+            return self.start + 1, self.end - 1
+        return self.start + 1, self.end
+
+
+class SyntaxTree(QObject):
+    # Parsed lines for one QTextDocument, kept in step with its edits. Lines
+    # are parsed lazily from the top as far as anything has asked for; an
+    # edit re-parses the changed lines and then carries on only while the
+    # state a line ends in differs from what it was before the edit.
+    def __init__(self, document, parser_class):
+        super().__init__(document)
+        self.parser_class = parser_class
+        self.parser = parser_class()
+        self.lines = []
+        # Bracket depth at the start of each line and the lowest it gets
+        # within each line, both valid for a prefix of the lines
+        self.depths = [0]
+        self.lows = []
+        self.block_count = document.blockCount()
+        self.state_ids = {self.parser.initial_state: 0}
+        self.root = None
+        self.root_revision = None
+        document.contentsChange.connect(self.contents_changed)
+
+    def detach(self):
+        self.document().contentsChange.disconnect(self.contents_changed)
+        self.setParent(None)
+        self.deleteLater()
+
+    def document(self):
+        return self.parent()
+
+    def memory_usage(self):
+        return len(self.lines) * PARSED_LINE_SIZE
+
+    def state_id(self, state):
+        # QSyntaxHighlighter block states are ints
+        return self.state_ids.setdefault(state, len(self.state_ids))
+
+    def line(self, number):
+        if number >= len(self.lines):
+            self.parse_until(number)
+        return self.lines[number]
+
+    def parse_until(self, number):
+        lines = self.lines
+        parse_line = self.parser.parse_line
+        state = lines[-1].state if lines else self.parser.initial_state
+        block = self.document().findBlockByNumber(len(lines))
+        while block.isValid() and len(lines) <= number:
+            parsed = parse_line(block.text(), state)
+            lines.append(parsed)
+            state = parsed.state
+            block = block.next()
+
+    @timed("syntax reparse")
+    def contents_changed(self, position, removed, added):
+        # Only the block count before and after is needed to line the old
+        # parsed lines up with the new blocks; the removed text never is
+        document = self.document()
+        delta = document.blockCount() - self.block_count
+        self.block_count = document.blockCount()
+        self.root = None
+
+        first = document.findBlock(position).blockNumber()
+        if first < 0 or first >= len(self.lines):
+            return
+
+        last_block = document.findBlock(min(position + added, document.characterCount() - 1))
+        last = last_block.blockNumber()
+        old_last = last - delta
+        if not first <= old_last < len(self.lines):
+            # The edit runs past what has been parsed, so that is redone lazily
+            del self.lines[first:]
+            self.forget_depths(first)
+            return
+
+        parse_line = self.parser.parse_line
+        state = self.lines[first - 1].state if first > 0 else self.parser.initial_state
+        old_state = self.lines[old_last].state
+        parsed = []
+        block = document.findBlockByNumber(first)
+        for _ in range(first, last + 1):
+            line = parse_line(block.text(), state)
+            parsed.append(line)
+            state = line.state
+            block = block.next()
+        # Depths only depend on which brackets each line has, so typing that
+        # leaves them alone keeps the cache for the rest of the document
+        same_brackets = delta == 0 and all(
+            old.brackets[1::2] == new.brackets[1::2]
+            for old, new in zip(self.lines[first:old_last + 1], parsed)
+        )
+        self.lines[first:old_last + 1] = parsed
+
+        # Later lines only change if the state they start in did
+        number = last + 1
+        while state != old_state and number < len(self.lines):
+            old_line = self.lines[number]
+            old_state = old_line.state
+            line = parse_line(block.text(), state)
+            self.lines[number] = line
+            same_brackets = same_brackets and old_line.brackets[1::2] == line.brackets[1::2]
+            state = line.state
+            block = block.next()
+            number += 1
+
+        if not same_brackets:
+            self.forget_depths(first)
+
+    def forget_depths(self, first):
+        del self.depths[first + 1:]
+        del self.lows[first:]
+
+    def depth_at(self, number):
+        # Bracket nesting depth at the start of a line, cached per line and
+        # only recomputed from the first line an edit changed the brackets of
+        depths = self.depths
+        lows = self.lows
+        while len(depths) <= number:
+            line = self.line(len(depths) - 1)
+            depth = low = depths[-1]
+            brackets = line.brackets
+            for i in range(1, len(brackets), 2):
+                # Stray closing brackets don't take the depth below zero
+                depth = depth + 1 if brackets[i] in OPENING_BRACKETS else max(depth - 1, 0)
+                low = min(low, depth)
+            depths.append(depth)
+            lows.append(low)
+        return depths[number]
+
+    def low_at(self, number):
+        # The lowest depth anywhere on a line, its start included
+        self.depth_at(number + 1)
+        return self.lows[number]
+
+    def match_bracket(self, position):
+        # Returns (position of the bracket, position of the other one, whether
+        # the pair matches) for a bracket just after or just before the
+        # cursor. Lines that never get back down to the depth the pair sits at
+        # are skipped using the depth cache, without looking at their brackets.
+        document = self.document()
+        block = document.findBlock(position)
+        if not block.isValid():
+            return None
+        number = block.blockNumber()
+        column = position - block.position()
+        brackets = self.line(number).brackets
+        found = None
+        for wanted in (column, column - 1):
+            for i in range(0, len(brackets), 2):
+                if brackets[i] == wanted:
+                    found = i
+                    break
+            if found is not None:
+                break
+        if found is None:
+            return None
+
+        char = brackets[found + 1]
+        own = block.position() + brackets[found]
+        befores = bracket_depths(brackets, self.depth_at(number))
+        if char in OPENING_BRACKETS:
+            # The first closing bracket that brings the depth back down
+            target = befores[found // 2]
+            line_brackets, line_befores = brackets, befores
+            start = found + 2
+            last = min(document.blockCount() - 1, number + BRACKET_SEARCH_LINES)
+            while True:
+                for i in range(start, len(line_brackets), 2):
+                    if line_befores[i // 2] == target + 1 and line_brackets[i + 1] in CLOSING_BRACKETS:
+                        other = document.findBlockByNumber(number).position() + line_brackets[i]
+                        return own, other, line_brackets[i + 1] == OPENING_BRACKETS[char]
+                number += 1
+                while number <= last and self.low_at(number) > target:
+                    number += 1
+                if number > last:
+                    return None
+                line_brackets = self.line(number).brackets
+                line_befores = bracket_depths(line_brackets, self.depth_at(number))
+                start = 0
+        else:
+            # The last opening bracket that took the depth up to where it is
+            target = befores[found // 2] - 1
+            if target < 0:
+                return None
+            line_brackets, line_befores = brackets, befores
+            end = found
+            first = max(0, number - BRACKET_SEARCH_LINES)
+            while True:
+                for i in range(end - 2, -1, -2):
+                    if line_befores[i // 2] == target and line_brackets[i + 1] in OPENING_BRACKETS:
+                        other = document.findBlockByNumber(number).position() + line_brackets[i]
+                        return own, other, line_brackets[i + 1] == CLOSING_BRACKETS[char]
+                number -= 1
+                while number >= first and self.low_at(number) > target:
+                    number -= 1
+                if number < first:
+                    return None
+                line_brackets = self.line(number).brackets
+                line_befores = bracket_depths(line_brackets, self.depth_at(number))
+                end = len(line_brackets)
+
+    def tree(self):
+        # The document's regions as a tree of Nodes, rebuilt on demand after edits
+        revision = self.document().revision()
+        if self.root is not None and self.root_revision == revision:
+            return self.root
+        count = self.document().blockCount()
+        self.parse_until(count - 1)
+
+        root = Node('document', 0, count - 1)
+        stack = [root]
+        last_code_line = 0
+
+        def close(node, end):
+            node.end = end
+            if end > node.start:
+                stack[-1].children.append(node)
+
+        initial_state = self.parser.initial_state
+        for number, line in enumerate(self.lines):
+            # Python blocks end at the first code line indented no deeper
+            # than their header, outside of any open bracket
+            if line.indent is not None and self.depth_at(number) == 0:
+                while stack[-1].kind == 'suite' and stack[-1].indent >= line.indent:
+                    suite = stack.pop()
+                    close(suite, last_code_line)
+
+            start_state = self.lines[number - 1].state if number else initial_state
+            if line.marker == 'close':
+                while len(stack) > 1:
+                    node = stack.pop()
+                    close(node, number)
+                    if node.kind == 'conditional':
+                        break
+
+            brackets = line.brackets
+            for i in range(1, len(brackets), 2):
+                if brackets[i] in OPENING_BRACKETS:
+                    stack.append(Node('bracket', number))
+                else:
+                    while len(stack) > 1:
+                        node = stack.pop()
+                        close(node, number)
+                        if node.kind == 'bracket':
+                            break
+
+            if line.marker == 'open':
+                stack.append(Node('conditional', number))
+            elif line.marker == 'suite' and self.depth_at(number + 1) == 0:
+                stack.append(Node('suite', number, indent=line.indent))
+
+            # Strings and comments that run over several lines
+            if line.state != start_state:
+                if stack[-1].kind == 'span':
+                    close(stack.pop(), number)
+                if line.state != initial_state:
+                    stack.append(Node('span', number))
+
+            # Lines carrying on a string or comment belong to the block too
+            if line.indent is not None or start_state != initial_state:
+                last_code_line = number
+
+        while len(stack) > 1:
+            node = stack.pop()
+            close(node, last_code_line if node.kind == 'suite' else count - 1)
+
+        self.root = root
+        self.root_revision = revision
+        return root
+
+    def fold_region(self, number):
+        # The outermost region starting on this line, or failing that the
+        # innermost one containing it
+        containing = None
+        nodes = self.tree().children
+        while nodes:
+            for node in nodes:
+                if node.start <= number <= node.end:
+                    first, last = node.folded_lines()
+                    if node.start == number and last >= first:
+                        return node
+                    if last >= first:
+                        containing = node
+                    nodes = node.children
+                    break
+            else:
+                break
+        return containing
+
+
+def attach_syntax_tree(editor, parser_class):
+    # One tree per editor, shared by its highlighter, bracket matching and
+    # folding. Like the highlighter it is kept on the editor: a reference
+    # held only through the document's wrapper doesn't survive.
+    tree = getattr(editor, "syntax_tree", None)
+    if tree is not None and tree.parser_class is parser_class:
+        return tree
+    detach_syntax_tree(editor)
+    if parser_class is None or editor.document().characterCount() > PARSE_SIZE_LIMIT:
+        return None
+    editor.syntax_tree = SyntaxTree(editor.document(), parser_class)
+    return editor.syntax_tree
+
+
+def detach_syntax_tree(editor):
+    tree = getattr(editor, "syntax_tree", None)
+    if tree is not None:
+        tree.detach()
+    editor.syntax_tree = None
@@ -0,0 +1,429 @@
+import os
+import pty
+import signal
+import termios
+from collections import deque
+from PyQt5.QtCore import QObject, QTimer, QSocketNotifier, pyqtSignal
+from PyQt5.QtWidgets import QPlainTextEdit
+from PyQt5.QtGui import QTextCursor
+from fileio import make_decoder
+from profiler import timed
+
+# Output is painted at most this often, however fast the process writes
+OUTPUT_FLUSH_INTERVAL_MS = 33
+MAX_SCROLLBACK_LINES = 10000
+# Text waiting for the next flush is capped too; anything older than this
+# would be trimmed from the scrollback straight away
+MAX_PENDING_CHARS = 4 * 1024 * 1024
+
+READ_SIZE = 64 * 1024
+# The shell reports its working directory before every prompt with an OSC 7
+# sequence, which is stripped from the output
+CWD_MARKER_START = b'\x1b]7;'
+CWD_MARKER_END = b'\x07'
+SHELL_ARGS = ['bash', '--noprofile', '--norc', '--noediting', '-i']
+
+
+class OutputBuffer(QObject):
+    def __init__(self, widget, parent=None):
+        super().__init__(parent or widget)
+        self.widget = widget
+        self.widget.setMaximumBlockCount(MAX_SCROLLBACK_LINES)
+        self.decoders = {}
+        self.pending = deque()
+        self.pending_chars = 0
+
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.setInterval(OUTPUT_FLUSH_INTERVAL_MS)
+        self.flush_timer.timeout.connect(self.flush)
+
+    def write(self, data, stream="stdout"):
+        # Each stream keeps its own incremental decoder so a multibyte
+        # character split across two reads still decodes correctly
+        decoder = self.decoders.get(stream)
+        if decoder is None:
+            decoder = self.decoders[stream] = make_decoder()
+        self.write_text(decoder.decode(data))
+
+    def write_text(self, text):
+        if not text:
+            return
+        self.pending.append(text)
+        self.pending_chars += len(text)
+
+        # Whole chunks are dropped from the front while they are all over
+        # the cap; only the one straddling it is sliced
+        while self.pending_chars > MAX_PENDING_CHARS:
+            excess = self.pending_chars - MAX_PENDING_CHARS
+            oldest = self.pending[0]
+            if len(oldest) <= excess:
+                self.pending.popleft()
+                self.pending_chars -= len(oldest)
+            else:
+                self.pending[0] = oldest[excess:]
+                self.pending_chars -= excess
+
+        if not self.flush_timer.isActive():
+            self.flush_timer.start()
+
+    def append_line(self, text):
+        self.end_stream_lines()
+        self.write_text(text + "\n")
+
+    def end_stream(self, stream="stdout"):
+        decoder = self.decoders.pop(stream, None)
+        if decoder is not None:
+            self.write_text(decoder.decode(b'', final=True))
+
+    def end_stream_lines(self):
+        # Commands and messages always start on a fresh line
+        if self.pending:
+            if not self.pending[-1].endswith("\n"):
+                self.write_text("\n")
+        elif self.widget.document().lastBlock().text():
+            self.write_text("\n")
+
+    @timed("terminal append")
+    def flush(self):
+        if not self.pending:
+            return
+        text = ''.join(self.pending)
+        self.pending.clear()
+        self.pending_chars = 0
+
+        scrollbar = self.widget.verticalScrollBar()
+        at_bottom = scrollbar.value() >= scrollbar.maximum()
+
+        cursor = QTextCursor(self.widget.document())
+        cursor.movePosition(QTextCursor.End)
+        cursor.insertText(text)
+
+        if at_bottom:
+            scrollbar.setValue(scrollbar.maximum())
+
+
+class ShellSession(QObject):
+    output = pyqtSignal(bytes)
+    cwd_changed = pyqtSignal(str)
+    command_started = pyqtSignal(str)
+    busy_changed = pyqtSignal(bool)
+    finished = pyqtSignal(int)
+
+    def __init__(self, cwd, env=None, parent=None):
+        super().__init__(parent)
+        self.cwd = cwd
+        self.env = dict(os.environ if env is None else env)
+        self.pid = None
+        self.fd = None
+        self.notifier = None
+        self.carry = b''
+        # Busy until the shell prints its first prompt; commands submitted
+        # while busy wait in the queue instead of being read by the running job
+        self.busy = True
+        self.ready = False
+        self.queue = []
+
+    def start(self):
+        env = dict(self.env)
+        env.update({
+            'TERM': 'dumb',
+            'PS1': '',
+            'PS2': '',
+            'PROMPT_COMMAND': 'printf "\\033]7;%s\\007" "$PWD"',
+        })
+
+        pid, fd = pty.fork()
+        if pid == 0:
+            try:
+                os.chdir(self.cwd)
+                os.execvpe(SHELL_ARGS[0], SHELL_ARGS, env)
+            finally:
+                os._exit(127)
+
+        # Commands are written to stdin by the IDE and already echoed by it,
+        # so the terminal must not echo them back
+        attrs = termios.tcgetattr(fd)
+        attrs[3] &= ~termios.ECHO
+        termios.tcsetattr(fd, termios.TCSANOW, attrs)
+
+        self.pid = pid
+        self.fd = fd
+        self.busy = True
+        self.notifier = QSocketNotifier(fd, QSocketNotifier.Read, self)
+        self.notifier.activated.connect(self.read_output)
+
+    def is_running(self):
+        return self.pid is not None
+
+    def run(self, command):
+        if self.busy:
+            self.queue.append(command)
+            return False
+        self.send(command)
+        return True
+
+    def send(self, command):
+        if self.fd is None:
+            return
+        self.set_busy(True)
+        self.command_started.emit(command)
+        os.write(self.fd, (command + "\n").encode('utf-8'))
+
+    def set_busy(self, busy):
+        if busy != self.busy:
+            self.busy = busy
+            self.busy_changed.emit(busy)
+
+    def prompt_ready(self):
+        self.ready = True
+        self.set_busy(False)
+        if self.queue:
+            self.send(self.queue.pop(0))
+
+    def interrupt(self):
+        # Signals the foreground job of the shell's terminal, like Ctrl+C would
+        self.signal_job(signal.SIGINT)
+
+    def kill_job(self):
+        self.signal_job(signal.SIGKILL)
+
+    def signal_job(self, signum):
+        if self.fd is None:
+            return
+        try:
+            pgrp = os.tcgetpgrp(self.fd)
+            # When the shell itself is in the foreground nothing is running
+            if pgrp != self.pid:
+                os.killpg(pgrp, signum)
+        except OSError:
+            pass
+
+    def close(self):
+        if self.pid is None:
+            return
+        try:
+            os.killpg(self.pid, signal.SIGHUP)
+        except OSError:
+            pass
+        self.shutdown()
+
+    @timed("terminal read")
+    def read_output(self, *args):
+        try:
+            data = os.read(self.fd, READ_SIZE)
+        except OSError:
+            data = b''
+        if not data:
+            self.shutdown()
+            return
+        self.output.emit(self.strip_cwd_markers(data))
+
+    def strip_cwd_markers(self, data):
+        data = self.carry + data
+        self.carry = b''
+        output = []
+
+        while True:
+            start = data.find(CWD_MARKER_START)
+            if start < 0:
+                break
+            end = data.find(CWD_MARKER_END, start)
+            if end < 0:
+                # The rest of the marker arrives with the next read
+                self.carry = data[start:]
+                data = data[:start]
+                break
+            output.append(data[:start])
+            self.marker_received(data[start + len(CWD_MARKER_START):end].decode('utf-8', 'replace'))
+            data = data[end + len(CWD_MARKER_END):]
+
+        # A marker can also be cut off before its start sequence is complete
+        for size in range(len(CWD_MARKER_START) - 1, 0, -1):
+            if data.endswith(CWD_MARKER_START[:size]):
+                self.carry = data[-size:] + self.carry
+                data = data[:-size]
+                break
+
+        output.append(data)
+        return b''.join(output)
+
+    def marker_received(self, cwd):
+        self.set_cwd(cwd)
+        self.prompt_ready()
+
+    def set_cwd(self, cwd):
+        if cwd != self.cwd:
+            self.cwd = cwd
+            self.cwd_changed.emit(cwd)
+
+    def shutdown(self):
+        if self.notifier is not None:
+            self.notifier.setEnabled(False)
+            self.notifier.deleteLater()
+            self.notifier = None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+        status = 0
+        if self.pid is not None:
+            try:
+                _, wait_status = os.waitpid(self.pid, 0)
+                status = os.waitstatus_to_exitcode(wait_status)
+            except ChildProcessError:
+                pass
+            self.pid = None
+        self.queue = []
+        self.busy = True
+        self.ready = False
+        self.finished.emit(status)
+
+
+class TerminalPane(QPlainTextEdit):
+    cwd_changed = pyqtSignal(str)
+    busy_changed = pyqtSignal(bool)
+
+    def __init__(self, cwd, env=None, parent=None):
+        super().__init__(parent)
+        self.setReadOnly(True)
+        self.output = OutputBuffer(self)
+        self.cwd = cwd
+        self.env = env
+        self.shell = None
+
+    def start_shell(self):
+        # The output of one pane's shell is flushed into its own buffer, so a
+        # chatty build in one tab never holds up another
+        self.shell = ShellSession(self.cwd, self.env, self)
+        self.shell.output.connect(self.output.write)
+        self.shell.cwd_changed.connect(self.set_cwd)
+        self.shell.command_started.connect(self.command_started)
+        self.shell.busy_changed.connect(self.busy_changed)
+        self.shell.finished.connect(self.shell_finished)
+        try:
+            self.shell.start()
+        except OSError as e:
+            self.output.append_line(f"Error starting shell: {str(e)}")
+            self.shell = None
+
+    def run(self, command):
+        if self.shell is None:
+            self.start_shell()
+            if self.shell is None:
+                return
+        if not self.shell.run(command) and self.shell.ready:
+            self.output.append_line(f"[queued] {command}")
+
+    def command_started(self, command):
+        self.output.append_line(f"$ {command}")
+
+    def is_busy(self):
+        return self.shell is not None and self.shell.busy
+
+    def cancel(self):
+        if self.shell is None:
+            return
+        dropped = len(self.shell.queue)
+        self.shell.queue = []
+        self.shell.interrupt()
+        if dropped:
+            self.output.append_line(f"[cancelled {dropped} queued command(s)]")
+
+    def kill(self):
+        if self.shell is not None:
+            self.shell.queue = []
+            self.shell.kill_job()
+
+    def set_cwd(self, cwd):
+        self.cwd = cwd
+        self.cwd_changed.emit(cwd)
+
+    def shell_finished(self, status):
+        self.output.end_stream()
+        self.output.append_line(f"[shell exited with status {status}]")
+        self.shell = None
+        self.busy_changed.emit(False)
+
+    def close_shell(self):
+        if self.shell is not None:
+            self.shell.finished.disconnect(self.shell_finished)
+            self.shell.close()
+            self.shell = None
+
+
+class TerminalManager(QObject):
+    cwd_changed = pyqtSignal(str)
+
+    def __init__(self, tabs, cwd, env=None, style_sheet="", parent=None):
+        super().__init__(parent)
+        self.tabs = tabs
+        self.cwd = cwd
+        self.env = env
+        self.style_sheet = style_sheet
+        self.count = 0
+
+        self.tabs.setTabsClosable(True)
+        self.tabs.tabCloseRequested.connect(self.close_session)
+        self.tabs.currentChanged.connect(self.current_changed)
+
+    def new_session(self, cwd=None):
+        # New tabs start where the active one currently is
+        if cwd is None:
+            current = self.tabs.currentWidget()
+            cwd = current.cwd if current is not None else self.cwd
+
+        self.count += 1
+        pane = TerminalPane(cwd, self.env)
+        pane.setStyleSheet(self.style_sheet)
+        pane.title = f"Terminal {self.count}"
+        pane.cwd_changed.connect(lambda path, pane=pane: self.pane_cwd_changed(pane, path))
+        pane.busy_changed.connect(lambda busy, pane=pane: self.update_title(pane))
+
+        index = self.tabs.addTab(pane, pane.title)
+        self.tabs.setCurrentIndex(index)
+        return pane
+
+    def current(self):
+        pane = self.tabs.currentWidget()
+        if pane is None:
+            pane = self.new_session()
+        return pane
+
+    def sessions(self):
+        return [self.tabs.widget(i) for i in range(self.tabs.count())]
+
+    def run(self, command):
+        self.current().run(command)
+
+    def cancel(self):
+        self.current().cancel()
+
+    def kill(self):
+        self.current().kill()
+
+    def update_title(self, pane):
+        index = self.tabs.indexOf(pane)
+        if index >= 0:
+            self.tabs.setTabText(index, pane.title + (" •" if pane.is_busy() else ""))
+
+    def pane_cwd_changed(self, pane, cwd):
+        if pane is self.tabs.currentWidget():
+            self.cwd_changed.emit(cwd)
+
+    def current_changed(self, index):
+        pane = self.tabs.widget(index)
+        if pane is not None:
+            self.cwd_changed.emit(pane.cwd)
+
+    def close_session(self, index):
+        pane = self.tabs.widget(index)
+        if pane is None:
+            return
+        pane.close_shell()
+        self.tabs.removeTab(index)
+        pane.deleteLater()
+
+    def close_all(self):
+        for pane in self.sessions():
+            pane.close_shell()
@@ -0,0 +1,45 @@
+import os
+import sys
+import time
+
+import pytest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt5.QtCore import QEventLoop
+from PyQt5.QtWidgets import QApplication
+
+
+@pytest.fixture(scope='session')
+def qapp():
+    return QApplication.instance() or QApplication([])
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    # Sessions, indexes and build caches go to a scratch directory rather
+    # than the user's
+    directory = tmp_path / 'cache'
+    directory.mkdir()
+    monkeypatch.setenv('XDG_CACHE_HOME', str(directory))
+    return directory
+
+
+@pytest.fixture
+def window(qapp, cache):
+    from main import MainWindow
+    window = MainWindow()
+    yield window
+    window.file_saver.wait()
+    window.shutdown()
+    window.deleteLater()
+    QApplication.processEvents()
+
+
+def wait_until(condition, timeout=30):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            raise AssertionError("timed out waiting for the IDE")
+        QApplication.processEvents(QEventLoop.AllEvents, 10)
@@ -0,0 +1,88 @@
+import time
+
+import pytest
+from PyQt5.QtCore import QEvent, QPoint, QPointF, Qt
+from PyQt5.QtGui import QMouseEvent
+
+from bufferview import BufferView, DISPLAY_LIMIT, MARGIN
+
+
+@pytest.fixture
+def open_view(qapp, tmp_path):
+    def open_view(data):
+        path = tmp_path / 'big.txt'
+        path.write_bytes(data)
+        return BufferView.open(str(path))
+    return open_view
+
+
+def contents(view):
+    return b''.join(view.table.chunks())
+
+
+def test_backspace_joins_with_a_line_longer_than_shown(open_view):
+    long_line = b'a' * 100000
+    view = open_view(long_line + b'\nsecond')
+    view.set_cursor(1, 0)
+    view.delete_backward()
+    assert contents(view) == long_line + b'second'
+    assert (view.line, view.column) == (0, 100000)
+    view.insert_text('|')
+    assert contents(view) == long_line + b'|second'
+
+
+def test_backspace_removes_a_crlf(open_view):
+    view = open_view(b'first\r\nsecond')
+    view.set_cursor(1, 0)
+    view.delete_backward()
+    assert contents(view) == b'firstsecond'
+    assert (view.line, view.column) == (0, 5)
+
+
+def test_delete_at_the_shown_end_of_a_long_line_removes_one_character(open_view):
+    long_line = b'a' * 100000
+    view = open_view(long_line + b'\nsecond')
+    shown = len(view.text(0))
+    assert shown == DISPLAY_LIMIT
+    view.set_cursor(0, shown)
+    view.delete_forward()
+    assert contents(view) == long_line[:-1] + b'\nsecond'
+
+
+def test_delete_at_a_line_end_joins_the_next_line(open_view):
+    view = open_view(b'first\r\nsecond')
+    view.set_cursor(0, 5)
+    view.delete_forward()
+    assert contents(view) == b'firstsecond'
+
+
+def click(view, line, x):
+    y = (line - view.verticalScrollBar().value()) * view.line_height() + 1
+    point = QPointF(QPoint(x, y))
+    view.mousePressEvent(QMouseEvent(QEvent.MouseButtonPress, point, Qt.LeftButton, Qt.LeftButton, Qt.NoModifier))
+
+
+def test_clicking_a_long_line_finds_the_column_quickly(open_view):
+    view = open_view(b'\tab' * 40000 + b'\nshort')
+    text = view.text(0)
+    column = len(text) - 3
+    left = view.gutter_width() + MARGIN
+    view.horizontalScrollBar().setMaximum(10 ** 9)
+    view.horizontalScrollBar().setValue(view.column_x(text, column))
+
+    start = time.perf_counter()
+    click(view, 0, left)
+    assert time.perf_counter() - start < 0.5
+    assert (view.line, view.column) == (0, column)
+
+
+def test_clicking_between_characters_picks_the_column_to_the_left(open_view):
+    view = open_view(b'a\tbc\n')
+    left = view.gutter_width() + MARGIN
+    x = view.column_x(view.text(0), 2)
+    click(view, 0, left + x + 1)
+    assert view.column == 2
+    click(view, 0, left + x - 1)
+    assert view.column == 1
+    click(view, 0, left + 10 ** 5)
+    assert view.column == 4
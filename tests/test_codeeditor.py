@@ -0,0 +1,24 @@
+from codeeditor import CodeEditor
+
+
+def test_hiding_lines_past_the_end_changes_nothing(qapp):
+    editor = CodeEditor()
+    editor.setPlainText("one\ntwo\nthree")
+    editor.set_lines_visible(10, 12, False)
+    editor.set_lines_visible(2, 1, False)
+
+    block = editor.document().firstBlock()
+    while block.isValid():
+        assert block.isVisible()
+        block = block.next()
+    editor.deleteLater()
+
+
+def test_hiding_lines_hides_only_that_range(qapp):
+    editor = CodeEditor()
+    editor.setPlainText("one\ntwo\nthree\nfour")
+    editor.set_lines_visible(1, 2, False)
+
+    document = editor.document()
+    assert [document.findBlockByNumber(i).isVisible() for i in range(4)] == [True, False, False, True]
+    editor.deleteLater()
@@ -0,0 +1,36 @@
+from fileindex import FileIndex
+
+from conftest import wait_until
+
+PATHS = sorted([
+    'README.md',
+    'src/app/main.py',
+    'src/app/widgets/widget_view.py',
+    'src/core/util.py',
+    'tests/test_widget_view.py',
+])
+
+
+def test_search_does_not_wait_for_the_tables(qapp):
+    index = FileIndex()
+    index.paths = list(PATHS)
+    ready = []
+    index.ready.connect(lambda: ready.append(True))
+
+    assert index.search('wview') == PATHS
+    wait_until(lambda: ready)
+    assert index.tables is not None
+    assert index.search('wview') == ['src/app/widgets/widget_view.py', 'tests/test_widget_view.py']
+    index.wait()
+
+
+def test_typed_queries_match_a_fresh_search(qapp):
+    typed = FileIndex()
+    typed.paths = list(PATHS)
+    typed.search_tables()
+    for query in ['app/wv.py', 'src/util', 'tview']:
+        for size in range(1, len(query) + 1):
+            fresh = FileIndex()
+            fresh.paths = list(PATHS)
+            fresh.search_tables()
+            assert typed.search(query[:size]) == fresh.search(query[:size])
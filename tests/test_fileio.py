@@ -0,0 +1,36 @@
+import hashlib
+import os
+from fileio import FileSaver
+
+
+def record(saver):
+    events = []
+    saver.saved.connect(lambda path, content_hash: events.append(("saved", path, content_hash)))
+    saver.failed.connect(lambda path, message: events.append(("failed", path)))
+    return events
+
+
+def test_wait_reports_the_queued_follow_up_write(qapp, tmp_path):
+    saver = FileSaver()
+    events = record(saver)
+    path = str(tmp_path / "note.txt")
+    saver.save(path, "first")
+    saver.save(path, "second")
+    saver.wait()
+
+    with open(path) as f:
+        assert f.read() == "second"
+    assert events == [("saved", path, hashlib.sha1(b"second").hexdigest())]
+    assert not saver.in_flight and not saver.pending
+
+
+def test_wait_reports_failed_writes_instead_of_raising(qapp, tmp_path):
+    saver = FileSaver()
+    events = record(saver)
+    path = str(tmp_path / "missing" / "note.txt")
+    saver.save(path, "first")
+    saver.save(path, "second")
+    saver.wait()
+
+    assert events == [("failed", path), ("failed", path)]
+    assert not os.path.exists(path)
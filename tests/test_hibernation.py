@@ -0,0 +1,75 @@
+from PyQt5.QtGui import QTextCursor
+
+from conftest import wait_until
+
+
+TEXT = ('x' * 69 + '\n') * 2000
+
+
+def open_edited_tabs(window, tmp_path, count=3):
+    editors = []
+    for index in range(count):
+        path = tmp_path / f'file{index}.txt'
+        path.write_text(TEXT)
+        window.open_in_editor(str(path))
+        editor = window.current_editor()
+        wait_until(lambda: getattr(editor, 'loader', None) is None)
+        cursor = editor.textCursor()
+        cursor.movePosition(QTextCursor.End)
+        cursor.insertText(f'edit {index}\n')
+        editors.append((path, editor))
+    return editors
+
+
+def hibernate_background_tabs(window):
+    window.tab_memory_budget = 1
+    window.enforce_tab_budget()
+    return [document for document in window.documents.recent if document.hibernated is not None]
+
+
+def test_saving_a_hibernated_tab_writes_its_text(window, tmp_path):
+    editors = open_edited_tabs(window, tmp_path)
+    hibernated = hibernate_background_tabs(window)
+    assert hibernated
+
+    saved = []
+    window.file_saver.saved.connect(lambda path, content_hash: saved.append(path))
+    for document in hibernated:
+        assert window.save_document(document.editor)
+    wait_until(lambda: len(saved) == len(hibernated))
+
+    for index, (path, editor) in enumerate(editors):
+        if window.documents.get(editor) in hibernated:
+            assert path.read_text() == TEXT + f'edit {index}\n'
+
+
+def test_activating_a_hibernated_tab_restores_its_text(window, tmp_path):
+    editors = open_edited_tabs(window, tmp_path)
+    hibernate_background_tabs(window)
+
+    path, editor = editors[0]
+    document = window.documents.get(editor)
+    assert document.hibernated is not None
+    window.tabs.setCurrentWidget(editor)
+
+    assert document.hibernated is None
+    assert editor.toPlainText() == TEXT + 'edit 0\n'
+    assert document.is_dirty()
+
+
+def test_saving_all_keeps_hibernated_tabs_hibernated(window, tmp_path):
+    editors = open_edited_tabs(window, tmp_path)
+    hibernated = hibernate_background_tabs(window)
+    assert hibernated
+
+    window.save_all_documents()
+
+    assert not window.documents.dirty_documents()
+    for index, (path, editor) in enumerate(editors):
+        assert path.read_text() == TEXT + f'edit {index}\n'
+    document = hibernated[0]
+    assert document.hibernated is not None
+    window.tabs.setCurrentWidget(document.editor)
+    assert document.hibernated is None
+    assert document.editor.toPlainText().startswith(TEXT)
+    assert not document.is_dirty()
@@ -0,0 +1,103 @@
+import random
+
+import pytest
+
+from piecetable import PieceTable, LINE_CHUNK_SIZE
+
+
+def line_starts(data):
+    return [0] + [i + 1 for i, byte in enumerate(data) if byte == ord('\n')]
+
+
+def check(table, model):
+    assert len(table) == len(model)
+    assert b''.join(table.chunks()) == model
+    assert table.read(0, len(model)) == model
+    starts = line_starts(model)
+    assert table.line_count() == len(starts)
+    for line, start in enumerate(starts):
+        assert table.line_start(line) == start
+    assert sum(piece.newlines for piece in table.pieces) == model.count(b'\n')
+
+
+@pytest.fixture
+def original(tmp_path):
+    # Spans several line chunks, so counts come from the open-time index
+    rng = random.Random(1)
+    lines = [bytes(rng.choice(b'abc \t') for _ in range(rng.randrange(0, 200))) for _ in range(2000)]
+    data = b'\n'.join(lines)
+    assert len(data) > 2 * LINE_CHUNK_SIZE
+    path = tmp_path / 'original.txt'
+    path.write_bytes(data)
+    return str(path), data
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_random_edits_match_a_bytes_model(original, seed):
+    path, data = original
+    table = PieceTable(path)
+    model = data
+    history = [model]
+    rng = random.Random(seed)
+    for _ in range(300):
+        action = rng.random()
+        if action < 0.45:
+            offset = rng.randrange(len(model) + 1)
+            text = rng.choice(['x', '\n', 'ab\ncd', 'é\n\n', 'tail'])
+            table.insert(offset, text)
+            model = model[:offset] + text.encode() + model[offset:]
+            history.append(model)
+        elif action < 0.8:
+            start = rng.randrange(len(model) + 1)
+            end = min(len(model), start + rng.randrange(LINE_CHUNK_SIZE * 3))
+            table.delete(start, end)
+            if start < end:
+                model = model[:start] + model[end:]
+                history.append(model)
+        elif action < 0.9 and len(history) > 1:
+            table.undo()
+            history.pop()
+            model = history[-1]
+        else:
+            table.split(rng.randrange(len(model) + 1))
+        check(table, model)
+
+
+def test_typing_grows_one_piece(tmp_path):
+    path = tmp_path / 'text.txt'
+    path.write_bytes(b'one\ntwo\n')
+    table = PieceTable(str(path))
+    offset = table.line_start(1)
+    for i, char in enumerate('hello\n'):
+        table.insert(offset + i, char)
+    assert len(table.pieces) == 3
+    check(table, b'one\nhello\ntwo\n')
+
+
+def test_undo_and_redo_restore_the_pieces(tmp_path):
+    path = tmp_path / 'text.txt'
+    path.write_bytes(b'one\ntwo\n')
+    table = PieceTable(str(path))
+    table.insert(3, ' and', cursor=(0, 3))
+    table.delete(0, 4, cursor=(0, 7))
+    check(table, b'and\ntwo\n')
+    assert table.undo() == (0, 7)
+    check(table, b'one and\ntwo\n')
+    assert table.undo() == (0, 3)
+    check(table, b'one\ntwo\n')
+    assert table.undo() is None
+    table.redo()
+    check(table, b'one and\ntwo\n')
+
+
+def test_lines_keep_crlf_and_invalid_bytes_column_exact(tmp_path):
+    path = tmp_path / 'text.txt'
+    path.write_bytes(b'\xff\xfeabc\r\n\xe2\x82x\n')
+    table = PieceTable(str(path))
+    assert table.line(0) == '��abc'
+    assert table.line_end(0) == 5
+    assert table.line_length(0) == 5
+    assert table.offset_of(0, 2) == 2
+    assert table.offset_of(1, 2) == table.line_start(1) + 2
+    table.insert(table.offset_of(0, 2), 'x')
+    assert b''.join(table.chunks()) == b'\xff\xfexabc\r\n\xe2\x82x\n'
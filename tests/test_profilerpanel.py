@@ -0,0 +1,29 @@
+from profiler import profiler, Stall, MAX_STALLS
+from profilerpanel import ProfilerPanel
+
+
+def add_stall(at):
+    stall = Stall(profiler.origin + at)
+    stall.end = stall.start + 0.2
+    profiler.add_stall(stall)
+    return stall
+
+
+def test_stalls_past_the_kept_limit_are_still_shown(qapp):
+    panel = ProfilerPanel()
+    try:
+        panel.reset()
+        for at in range(MAX_STALLS):
+            add_stall(at)
+        panel.refresh()
+        assert panel.stalls.topLevelItemCount() == MAX_STALLS
+
+        add_stall(MAX_STALLS)
+        panel.refresh()
+        assert panel.stalls.topLevelItemCount() == MAX_STALLS
+        assert panel.stalls.topLevelItem(0).text(0).endswith(f"at {MAX_STALLS:.1f}s")
+        assert panel.stalls.topLevelItem(MAX_STALLS - 1).text(0).endswith("at 1.0s")
+        assert f"{MAX_STALLS + 1} stalls" in panel.status.text()
+    finally:
+        panel.shutdown()
+        profiler.reset()
@@ -0,0 +1,98 @@
+from PyQt5.QtGui import QTextCursor
+
+from conftest import wait_until
+
+
+def preview(window, root, query, replacement):
+    panel = window.search_panel
+    window.set_project_root(str(root))
+    panel.query_input.setText(query)
+    panel.replace_input.setText(replacement)
+    panel.start_preview()
+    wait_until(lambda: panel.replace_generation is None)
+    return panel
+
+
+def apply(window, panel):
+    saved = []
+    window.file_saver.saved.connect(lambda path, content_hash: saved.append(path))
+    panel.apply_replace()
+    _, _, tabs, _, _, unsaved = panel.applying
+    wait_until(lambda: panel.replace_generation is None)
+    window.file_saver.wait()
+    wait_until(lambda: len(saved) == tabs - unsaved)
+
+
+def open_file(window, path):
+    window.open_in_editor(str(path))
+    editor = window.current_editor()
+    wait_until(lambda: getattr(editor, 'loader', None) is None)
+    return editor
+
+
+def test_files_opened_after_the_preview_are_replaced_in_their_tab(window, tmp_path):
+    path = tmp_path / 'opened.txt'
+    path.write_text('old value\n')
+    panel = preview(window, tmp_path, 'old', 'new')
+
+    editor = open_file(window, path)
+    apply(window, panel)
+
+    assert editor.toPlainText() == 'new value\n'
+    assert path.read_text() == 'new value\n'
+    assert not window.documents.get(editor).is_dirty()
+
+
+def test_unsaved_edits_in_a_tab_are_not_saved_by_a_replace(window, tmp_path):
+    path = tmp_path / 'edited.txt'
+    path.write_text('old value\n')
+    editor = open_file(window, path)
+    cursor = editor.textCursor()
+    cursor.movePosition(QTextCursor.End)
+    cursor.insertText('typed\n')
+    panel = preview(window, tmp_path, 'old', 'new')
+
+    apply(window, panel)
+
+    assert editor.toPlainText() == 'new value\ntyped\n'
+    assert path.read_text() == 'old value\n'
+    assert window.documents.get(editor).is_dirty()
+    assert '1 tabs with unsaved changes not saved' in panel.status.text()
+
+
+def test_tabs_closed_after_the_preview_are_reported(window, tmp_path):
+    path = tmp_path / 'closed.txt'
+    path.write_text('old value\n')
+    window.open_in_editor(str(path))
+    editor = window.current_editor()
+    wait_until(lambda: getattr(editor, 'loader', None) is None)
+    editor.insertPlainText('unsaved ')
+    panel = preview(window, tmp_path, 'old', 'new')
+
+    window.documents.get(editor).mark_clean()
+    window.close_tab(window.tabs.indexOf(editor))
+    apply(window, panel)
+
+    assert path.read_text() == 'old value\n'
+    assert 'skipped' in panel.file_items['closed.txt'].text(0)
+    assert '1 skipped' in panel.status.text()
+
+
+def test_files_are_reindexed_under_the_root_they_were_replaced_in(window, tmp_path):
+    project = tmp_path / 'project'
+    project.mkdir()
+    (project / 'a.txt').write_text('old value\n')
+    other = tmp_path / 'other'
+    other.mkdir()
+    panel = preview(window, project, 'old', 'new')
+
+    replaced = []
+    panel.files_replaced.connect(replaced.extend)
+    panel.apply_replace()
+    # Switched before the replace reports back
+    window.set_project_root(str(other))
+    wait_until(lambda: panel.applying is None)
+
+    assert replaced == [str(project / 'a.txt')]
+    assert (project / 'a.txt').read_text() == 'new value\n'
+    assert panel.replace_generation is None
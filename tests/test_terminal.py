@@ -0,0 +1,32 @@
+import time
+from PyQt5.QtWidgets import QPlainTextEdit
+from terminal import OutputBuffer, MAX_PENDING_CHARS
+
+
+def test_pending_output_keeps_only_the_newest_text(qapp):
+    widget = QPlainTextEdit()
+    buffer = OutputBuffer(widget)
+    chunk = 'x' * 1000 + '\n'
+    for i in range(MAX_PENDING_CHARS // len(chunk) + 10):
+        buffer.write_text(chunk)
+    buffer.write_text('tail')
+
+    text = ''.join(buffer.pending)
+    assert buffer.pending_chars == len(text) == MAX_PENDING_CHARS
+    assert text.endswith(chunk + 'tail')
+    widget.deleteLater()
+
+
+def test_writes_over_the_cap_stay_cheap(qapp):
+    widget = QPlainTextEdit()
+    buffer = OutputBuffer(widget)
+    buffer.write_text('x' * MAX_PENDING_CHARS)
+
+    # Each write used to re-join the whole capped buffer
+    start = time.perf_counter()
+    for _ in range(2000):
+        buffer.write_text('line\n')
+    assert time.perf_counter() - start < 1
+    assert buffer.pending_chars == MAX_PENDING_CHARS
+    assert ''.join(buffer.pending).endswith('line\n' * 2000)
+    widget.deleteLater()
@@ -0,0 +1,452 @@
+import os
+import re
+import mmap
+import time
+import bisect
+import struct
+import threading
+from array import array
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, QTimer, pyqtSignal
+from filetree import IgnoreRules
+from fileindex import walk_project
+from fileio import atomic_write
+from search import executor, read_bytes
+from storage import project_cache_file
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+TRIGRAM_INDEX_NAME = 'trigrams.idx'
+INDEX_MAGIC = b'AIDTRI01'
+# Magic, file count, trigram count, then the offsets of the stamp, path,
+# key, start and posting sections. Every section starts 8-byte aligned.
+HEADER = struct.Struct('<8sIIQQQQQ')
+REBUILD_DELAY_MS = 5000
+# More stale files than this found by one search and the whole index is
+# rebuilt instead of updating them one by one
+MAX_STALE_UPDATES = 50
+
+TRIGRAM = re.compile(b'...', re.DOTALL)
+REPEATS = tuple(
+    getattr(sre_parse, name) for name in ('MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT')
+    if hasattr(sre_parse, name)
+)
+
+
+def trigram_keys(data):
+    # Trigrams are taken over lowercased bytes so one index serves both case
+    # modes. Lines are deduplicated first; queries never rely on a trigram
+    # spanning two lines, so joining them in any order is harmless.
+    text = b'\n'.join(set(data.lower().split(b'\n')))
+    trigrams = set()
+    for offset in range(3):
+        trigrams.update(TRIGRAM.findall(text, offset))
+    return {int.from_bytes(trigram, 'big') for trigram in trigrams}
+
+
+def file_stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return (0, -1)
+    return (st.st_mtime_ns, st.st_size)
+
+
+def literal_runs(items, ignore_case, runs, current):
+    # Collects the runs of literal characters every match must contain.
+    # Anything optional, repeated or alternated ends the current run.
+    for op, av in items:
+        if op == sre_parse.LITERAL:
+            char = chr(av)
+            # Non-ASCII case folding doesn't match bytes.lower(), and
+            # trigrams are never taken across line breaks
+            if char == '\n' or char == '\ufffd' or (ignore_case and av > 127):
+                end_run(runs, current)
+            else:
+                current.append(char)
+        elif op == sre_parse.AT:
+            continue
+        elif op == sre_parse.SUBPATTERN and not av[1] and not av[2]:
+            literal_runs(av[3], ignore_case, runs, current)
+        elif op in REPEATS:
+            end_run(runs, current)
+            if av[0] >= 1:
+                literal_runs(av[2], ignore_case, runs, current)
+                end_run(runs, current)
+        else:
+            end_run(runs, current)
+
+
+def end_run(runs, current):
+    if len(current) >= 3:
+        runs.append(''.join(current))
+    current.clear()
+
+
+def query_trigrams(pattern):
+    # Returns one set of trigram keys per top-level alternative, or None
+    # when some alternative has none and every file has to be searched
+    try:
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    except Exception:
+        return None
+
+    items = list(parsed)
+    if len(items) == 1 and items[0][0] == sre_parse.BRANCH:
+        branches = items[0][1][1]
+    else:
+        branches = [items]
+
+    ignore_case = bool(pattern.flags & re.IGNORECASE)
+    alternatives = []
+    for branch in branches:
+        runs = []
+        current = []
+        literal_runs(branch, ignore_case, runs, current)
+        end_run(runs, current)
+
+        keys = set()
+        for run in runs:
+            keys.update(trigram_keys(run.encode('utf-8')))
+        if not keys:
+            return None
+        alternatives.append(keys)
+    return alternatives
+
+
+def pad(data):
+    return data + b'\0' * (-len(data) % 8)
+
+
+class IndexReader:
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.file_count, self.trigram_count,
+         stamps_at, paths_at, keys_at, starts_at, postings_at) = HEADER.unpack_from(self.map)
+        if magic != INDEX_MAGIC:
+            raise ValueError(f"{path} is not a trigram index")
+
+        # Every section is a view straight into the mapping, so opening the
+        # index reads nothing but the header
+        view = memoryview(self.map)
+        self.stamps = view[stamps_at:paths_at].cast('q')
+        self.path_blob = view[paths_at:keys_at]
+        self.keys = view[keys_at:starts_at].cast('I')[:self.trigram_count]
+        self.starts = view[starts_at:postings_at].cast('I')[:self.trigram_count + 1]
+        self.postings = view[postings_at:].cast('I')
+        self.paths = None
+        self.ids = None
+
+    def path_ids(self):
+        if self.ids is None:
+            blob = bytes(self.path_blob).rstrip(b'\0').decode('utf-8', 'surrogateescape')
+            self.paths = blob.split('\n') if blob else []
+            self.ids = {rel_path: file_id for file_id, rel_path in enumerate(self.paths)}
+        return self.ids
+
+    def stamp(self, file_id):
+        return (self.stamps[2 * file_id], self.stamps[2 * file_id + 1])
+
+    def lookup(self, key):
+        index = bisect.bisect_left(self.keys, key)
+        if index < self.trigram_count and self.keys[index] == key:
+            return self.postings[self.starts[index]:self.starts[index + 1]]
+        return self.postings[0:0]
+
+    def matching_ids(self, keys):
+        postings = sorted((self.lookup(key) for key in keys), key=len)
+        ids = set(postings[0])
+        for file_ids in postings[1:]:
+            if not ids:
+                break
+            ids.intersection_update(file_ids)
+        return ids
+
+
+def build_index(root_path, patterns, index_file):
+    # Runs in a worker process. Files whose mtime and size still match the
+    # previous index keep their postings; only the rest are read again.
+    started = time.perf_counter()
+    rel_paths = walk_project(root_path, IgnoreRules(root_path, patterns))
+    try:
+        previous = IndexReader(index_file)
+        old_ids = previous.path_ids()
+    except (OSError, ValueError, struct.error):
+        previous = None
+        old_ids = {}
+
+    stamps = array('q')
+    remap = array('l', [-1]) * len(old_ids)
+    fresh = {}
+    changed = 0
+    for file_id, rel_path in enumerate(rel_paths):
+        path = os.path.join(root_path, rel_path)
+        stamp = file_stamp(path)
+        stamps.extend(stamp)
+
+        old_id = old_ids.get(rel_path)
+        if old_id is not None and previous.stamp(old_id) == stamp:
+            remap[old_id] = file_id
+            continue
+
+        changed += 1
+        data = read_bytes(path)
+        if data is None:
+            continue
+        for key in trigram_keys(data):
+            file_ids = fresh.get(key)
+            if file_ids is None:
+                file_ids = fresh[key] = array('I')
+            file_ids.append(file_id)
+
+    stats = {'files': len(rel_paths), 'changed': changed, 'written': False}
+    if previous is not None and not changed and previous.paths == rel_paths:
+        stats['seconds'] = time.perf_counter() - started
+        return stats
+
+    postings = {}
+    if previous is not None:
+        for index in range(previous.trigram_count):
+            kept = array('I', [
+                remap[old_id] for old_id in previous.postings[previous.starts[index]:previous.starts[index + 1]]
+                if remap[old_id] >= 0
+            ])
+            key = previous.keys[index]
+            added = fresh.pop(key, None)
+            if added is not None:
+                kept = array('I', sorted(kept + added))
+            if kept:
+                postings[key] = kept
+    postings.update(fresh)
+
+    keys = sorted(postings)
+    starts = array('I', [0])
+    all_postings = array('I')
+    for key in keys:
+        all_postings.extend(postings[key])
+        starts.append(len(all_postings))
+
+    sections = [
+        stamps.tobytes(),
+        pad('\n'.join(rel_paths).encode('utf-8', 'surrogateescape')),
+        pad(array('I', keys).tobytes()),
+        pad(starts.tobytes()),
+        all_postings.tobytes(),
+    ]
+    offsets = []
+    position = HEADER.size
+    for section in sections:
+        offsets.append(position)
+        position += len(section)
+    header = HEADER.pack(INDEX_MAGIC, len(rel_paths), len(keys), *offsets)
+
+    try:
+        atomic_write(index_file, b''.join([header] + sections))
+        stats['written'] = True
+    except OSError:
+        pass
+    stats['trigrams'] = len(keys)
+    stats['bytes'] = position
+    stats['seconds'] = time.perf_counter() - started
+    return stats
+
+
+class IndexBuildTask(QRunnable):
+    def __init__(self, index, generation, sequence):
+        super().__init__()
+        self.index = index
+        self.generation = generation
+        self.sequence = sequence
+        self.args = (index.root_path, index.patterns, index.index_file)
+
+    def run(self):
+        try:
+            stats = executor().submit(build_index, *self.args).result()
+        except (OSError, RuntimeError):
+            # Without worker processes the index is built on this thread
+            stats = build_index(*self.args)
+        self.index.built.emit(self.generation, self.sequence, stats)
+
+
+class UpdateTask(QRunnable):
+    def __init__(self, index, generation, sequence, rel_path, path):
+        super().__init__()
+        self.index = index
+        self.generation = generation
+        self.sequence = sequence
+        self.rel_path = rel_path
+        self.path = path
+
+    def run(self):
+        stamp = file_stamp(self.path)
+        data = read_bytes(self.path)
+        keys = None if data is None else frozenset(trigram_keys(data))
+        self.index.updated.emit(self.generation, self.rel_path, (self.sequence, stamp, keys))
+
+
+class TrigramIndex(QObject):
+    built = pyqtSignal(int, int, dict)
+    updated = pyqtSignal(int, str, tuple)
+    stale_found = pyqtSignal(int, list)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.build_pool = QThreadPool(self)
+        self.build_pool.setMaxThreadCount(1)
+        self.update_pool = QThreadPool(self)
+        self.update_pool.setMaxThreadCount(1)
+        self.root_path = None
+        self.patterns = None
+        self.rules = None
+        self.index_file = None
+        self.generation = 0
+        self.sequence = 0
+        self.building = False
+        self.last_build = None
+        # The mapped index and the overlay of files saved since it was
+        # written are swapped together, since searches read them off-thread
+        self.lock = threading.Lock()
+        self.reader = None
+        self.overlay = {}
+
+        self.built.connect(self.apply_build)
+        self.updated.connect(self.apply_update)
+        self.stale_found.connect(self.refresh_files)
+
+        self.rebuild_timer = QTimer(self)
+        self.rebuild_timer.setSingleShot(True)
+        self.rebuild_timer.setInterval(REBUILD_DELAY_MS)
+        self.rebuild_timer.timeout.connect(self.rebuild)
+
+    def open_root(self, root_path, patterns=None):
+        # The index from the last session is mapped straight away and
+        # brought up to date in the background
+        self.root_path = os.path.abspath(root_path)
+        self.patterns = patterns
+        self.rules = IgnoreRules(self.root_path, patterns)
+        self.index_file = project_cache_file(self.root_path, TRIGRAM_INDEX_NAME)
+        self.generation += 1
+        self.building = False
+        with self.lock:
+            self.reader = self.open_reader()
+            self.overlay = {}
+        self.rebuild()
+
+    def open_reader(self):
+        try:
+            return IndexReader(self.index_file)
+        except (OSError, ValueError, struct.error):
+            return None
+
+    def wait(self):
+        # A build already handed to a worker process is left to finish, so
+        # the next session starts from an up to date index
+        self.rebuild_timer.stop()
+        self.build_pool.waitForDone()
+        self.update_pool.waitForDone()
+
+    def schedule_rebuild(self):
+        if self.root_path is not None:
+            self.rebuild_timer.start()
+
+    def rebuild(self):
+        if self.root_path is None:
+            return
+        if self.building:
+            self.rebuild_timer.start()
+            return
+        self.building = True
+        self.build_pool.start(IndexBuildTask(self, self.generation, self.sequence))
+
+    def apply_build(self, generation, sequence, stats):
+        if generation != self.generation:
+            return
+        self.building = False
+        self.last_build = stats
+        reader = self.open_reader() if stats['written'] else self.reader
+        with self.lock:
+            self.reader = reader
+            # Saves made after the build started aren't in the new index yet
+            self.overlay = {
+                rel_path: entry for rel_path, entry in self.overlay.items()
+                if entry[0] > sequence
+            }
+
+    def relative_path(self, path):
+        if self.root_path is None:
+            return None
+        rel_path = os.path.relpath(os.path.abspath(path), self.root_path)
+        if rel_path.startswith('..') or self.rules.is_ignored(path, False):
+            return None
+        return rel_path.replace(os.sep, '/')
+
+    def update_file(self, path):
+        rel_path = self.relative_path(path)
+        if rel_path is None:
+            return
+        self.sequence += 1
+        self.update_pool.start(UpdateTask(self, self.generation, self.sequence, rel_path, path))
+
+    def apply_update(self, generation, rel_path, entry):
+        if generation != self.generation:
+            return
+        with self.lock:
+            current = self.overlay.get(rel_path)
+            if current is None or current[0] < entry[0]:
+                self.overlay[rel_path] = entry
+
+    def refresh_files(self, generation, rel_paths):
+        if generation != self.generation:
+            return
+        if len(rel_paths) > MAX_STALE_UPDATES:
+            self.schedule_rebuild()
+            return
+        for rel_path in rel_paths:
+            self.update_file(os.path.join(self.root_path, rel_path))
+
+    def candidates(self, root_path, rel_paths, pattern):
+        # Called from search threads. Returns the files that can contain a
+        # match; files the index knows nothing about are always kept, and so
+        # are files changed on disk since they were indexed.
+        with self.lock:
+            reader = self.reader
+            overlay = dict(self.overlay)
+            generation = self.generation
+        if reader is None or os.path.abspath(root_path) != self.root_path:
+            return rel_paths
+        alternatives = query_trigrams(pattern)
+        if alternatives is None:
+            return rel_paths
+
+        ids = reader.path_ids()
+        matching = set()
+        for keys in alternatives:
+            matching |= reader.matching_ids(keys)
+
+        result = []
+        stale = []
+        for rel_path in rel_paths:
+            entry = overlay.get(rel_path)
+            if entry is not None:
+                _, stamp, trigrams = entry
+                if trigrams is None or any(keys <= trigrams for keys in alternatives):
+                    result.append(rel_path)
+                    continue
+            else:
+                file_id = ids.get(rel_path)
+                if file_id is None or file_id in matching:
+                    result.append(rel_path)
+                    continue
+                stamp = reader.stamp(file_id)
+
+            # Only files the index rules out are checked for changes on disk
+            if file_stamp(os.path.join(root_path, rel_path)) != stamp:
+                result.append(rel_path)
+                stale.append(rel_path)
+
+        if stale:
+            self.stale_found.emit(generation, stale)
+        return result